@@ -0,0 +1,68 @@
+"""
+Measures the cold-start cost of importing main with python -X importtime and fails if it regresses.
+
+Each run imports main in a fresh interpreter; the best of --repeat runs is reported, with the modules that took
+the longest. The run fails if the import takes longer than --max-ms, or if a module that main only needs once it
+starts polling or sending (tls_client, requests, telegram, ...) is imported at startup.
+
+Usage: python benchmarks/bench_importtime.py [--repeat 5] [--top 15] [--max-ms 0] [--module main]
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Top-level packages main must not import at startup
+LAZY_MODULES = ("tls_client", "requests", "telegram", "httpx", "colorlog")
+
+
+def import_times(module):
+    """Imports module in a fresh interpreter. Returns {module name: (self us, cumulative us)}."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=REPO_ROOT,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit():
+            times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-ms", type=float, default=0, help="fail above this import time (0 disables)")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times[args.module][1])
+    total_ms = best[args.module][1] / 1000
+
+    print(f"{'module':<48} {'self ms':>9} {'cumul ms':>9}")
+    ranked = sorted(best.items(), key=lambda entry: entry[1][1], reverse=True)
+    for name, (self_us, cumulative_us) in ranked[:args.top]:
+        print(f"{name:<48} {self_us / 1000:>9.1f} {cumulative_us / 1000:>9.1f}")
+    print(f"\nimport {args.module}: {total_ms:.1f} ms (best of {args.repeat})")
+
+    failures = []
+    eager = sorted({name.split(".")[0] for name in best} & set(LAZY_MODULES))
+    if eager:
+        failures.append(f"imported at startup: {', '.join(eager)}")
+    if args.max_ms and total_ms > args.max_ms:
+        failures.append(f"{total_ms:.1f} ms is over the {args.max_ms:.0f} ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
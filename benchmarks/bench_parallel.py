@@ -0,0 +1,122 @@
+"""
+Compares the sequential parse, validate, stock join and fingerprint steps of a poll against the parallel pipeline.
+
+A synthetic listing is split into pages of --page-size items. The scaling curve runs the --items listing through
+the pool with 1 to --max-workers workers. The crossover runs each of --sizes sequentially and with --max-workers
+workers, and reports the smallest size where the pool wins, a starting point for PARALLEL_MIN_ITEMS. The pool is
+started before timing, as it stays up between polls.
+
+Usage: python benchmarks/bench_parallel.py [--items 100000] [--page-size 1000] [--max-workers 8]
+                                           [--sizes 1000,5000,20000,50000,100000] [--repeat 3]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from itertools import chain
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+
+def generate_listing(size, page_size):
+    """Returns the page texts of a synthetic listing of size items and its stock response."""
+    from fixtures import generate_product_page, generate_stock_response
+
+    items = generate_product_page(size)["items"]
+    pages = [json.dumps({"totalResults": size, "offset": offset, "items": items[offset:offset + page_size]})
+             for offset in range(0, size, page_size)]
+    return pages, generate_stock_response([item["id"] for item in items])
+
+
+def run_sequential(pages, stock_response):
+    """The steps as poll_products and store_products_to_db run them without the pool."""
+    import db
+    import main
+    from models import validate_products
+    from pagination import unique_items
+    from snapshot import hash64, product_fields_hash
+
+    items = unique_items(chain.from_iterable(json.loads(page)["items"] for page in pages))
+    products = validate_products(list(items))
+    main.join_stock_data(products, stock_response)
+    for product in products:
+        db.prepare_product(product)
+    return {product.id: (hash64(product.id), product_fields_hash(product, db.TRACKED_FIELDS)) for product in products}
+
+
+def run_parallel(pipeline, pages, stock_response):
+    """The same steps through the parallel pipeline."""
+    import db
+    import main
+
+    products, _ = pipeline.validate_pages(pages)
+    main.join_stock_data(products, stock_response)
+    for product in products:
+        db.prepare_product(product)
+    return pipeline.fingerprints(products, db.TRACKED_FIELDS)
+
+
+def best_time(run, repeat):
+    """Returns the best wall time of repeat calls of run."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def started_pipeline(workers):
+    """Returns a pipeline with its worker processes up and warmed."""
+    from parallel import ParallelPipeline
+
+    pipeline = ParallelPipeline(workers=workers, min_items=0)
+    pipeline.validate_pages([json.dumps({"items": []})] * workers)
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--sizes", default="1000,5000,20000,50000,100000", help="Comma separated listing sizes.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, listing of {args.items} items in pages of {args.page_size}")
+    pages, stock_response = generate_listing(args.items, args.page_size)
+    sequential = best_time(lambda: run_sequential(pages, stock_response), args.repeat)
+    print(f"\n{'workers':>7} {'seconds':>9} {'items/sec':>12} {'speedup':>8}")
+    print(f"{'seq':>7} {sequential:>9.3f} {args.items / sequential:>12,.0f} {1:>8.2f}")
+    for workers in range(1, args.max_workers + 1):
+        pipeline = started_pipeline(workers)
+        try:
+            seconds = best_time(lambda: run_parallel(pipeline, pages, stock_response), args.repeat)
+        finally:
+            pipeline.close()
+        print(f"{workers:>7} {seconds:>9.3f} {args.items / seconds:>12,.0f} {sequential / seconds:>8.2f}")
+
+    print(f"\n{'items':>9} {'sequential':>11} {f'{args.max_workers} workers':>11} {'speedup':>8}")
+    crossover = None
+    pipeline = started_pipeline(args.max_workers)
+    try:
+        for size in (int(size) for size in args.sizes.split(",")):
+            pages, stock_response = generate_listing(size, args.page_size)
+            sequential = best_time(lambda: run_sequential(pages, stock_response), args.repeat)
+            seconds = best_time(lambda: run_parallel(pipeline, pages, stock_response), args.repeat)
+            print(f"{size:>9} {sequential:>10.3f}s {seconds:>10.3f}s {sequential / seconds:>8.2f}")
+            if seconds < sequential and crossover is None:
+                crossover = size
+    finally:
+        pipeline.close()
+    if crossover is None:
+        print("\nThe pool didn't win at any size; leave PARALLEL_WORKERS unset on this machine.")
+    else:
+        print(f"\nThe pool wins from {crossover} items; set PARALLEL_MIN_ITEMS around there.")
+
+
+if __name__ == "__main__":
+    main()
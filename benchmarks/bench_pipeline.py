@@ -0,0 +1,147 @@
+"""
+Replays product and stock responses through the poll pipeline offline.
+
+Each catalog size runs in its own subprocess with a fresh SQLite database in a temp dir and Telegram stubbed
+out. The first poll loads the catalog into an empty database, the later polls apply --churn to the catalog
+first. Reports wall time per stage, items/sec, peak RSS and database statements/rows changed.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--sizes 100,1000,10000,50000] [--churn 0.05] [--polls 3]
+    python benchmarks/bench_pipeline.py --product-fixture products.json --stock-fixture stock.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+STAGES = ["validate", "stock_join", "db_sync"]
+
+
+def load_fixtures(args, size):
+    """Loads recorded fixtures if given, otherwise generates a synthetic catalog of the given size."""
+    from fixtures import generate_product_page, generate_stock_response
+
+    if args.product_fixture:
+        with open(args.product_fixture) as f:
+            product_page = json.load(f)
+        if args.stock_fixture:
+            with open(args.stock_fixture) as f:
+                stock_response = json.load(f)
+        else:
+            stock_response = generate_stock_response([item["id"] for item in product_page["items"]])
+        return product_page, stock_response
+
+    product_page = generate_product_page(size)
+    return product_page, generate_stock_response([item["id"] for item in product_page["items"]])
+
+
+def run_size(args, size):
+    """Runs the polls for one catalog size in this process and returns the measurements."""
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="whisky-bench-"), "products.db")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+
+    import db
+    import main
+    from fixtures import apply_churn
+    from models import validate_products
+
+    # Telegram is stubbed: count notifications instead of sending them
+    notifications = []
+    db.notify_new_product = lambda product, chat_id=None: notifications.append(product)
+    db.initialize_db()
+
+    statements = []
+    conn = db.get_connection()
+    conn.set_trace_callback(statements.append)
+
+    product_page, stock_response = load_fixtures(args, size)
+    items = len(product_page["items"])
+    totals = dict.fromkeys(STAGES, 0.0)
+    polls = []
+
+    for poll in range(args.polls):
+        if poll:
+            apply_churn(product_page, stock_response, args.churn, poll)
+        statements.clear()
+        changes_before = conn.total_changes
+        timings = {}
+
+        start = time.perf_counter()
+        product_list = validate_products(product_page["items"], lean=args.validation == "lean")
+        timings["validate"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        main.join_stock_data(product_list, stock_response)
+        timings["stock_join"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        db_stats = db.store_products_to_db(product_list)
+        timings["db_sync"] = time.perf_counter() - start
+
+        for stage in STAGES:
+            totals[stage] += timings[stage]
+        polls.append({
+            "timings": timings,
+            "statements": len(statements),
+            "rows_changed": conn.total_changes - changes_before,
+            "new": db_stats["new"],
+            "changed": db_stats["changed"],
+        })
+
+    return {
+        "size": items,
+        "polls": polls,
+        "totals": totals,
+        "notifications": len(notifications),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def print_report(result):
+    """Prints the measurements for one catalog size."""
+    print(f"\n== {result['size']} items, peak RSS {result['peak_rss_mib']:.1f} MiB, "
+          f"{result['notifications']} notifications stubbed")
+    print(f"{'poll':>4} " + " ".join(f"{stage:>11}" for stage in STAGES)
+          + f" {'items/sec':>11} {'stmts':>7} {'rows':>7} {'new':>6} {'changed':>7}")
+    for index, poll in enumerate(result["polls"]):
+        total = sum(poll["timings"].values())
+        print(f"{index:>4} " + " ".join(f"{poll['timings'][stage]:>10.3f}s" for stage in STAGES)
+              + f" {result['size'] / total:>11,.0f} {poll['statements']:>7} {poll['rows_changed']:>7}"
+              f" {poll['new']:>6} {poll['changed']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000,50000", help="Comma separated catalog sizes.")
+    parser.add_argument("--churn", type=float, default=0.05, help="Fraction of the catalog changed between polls.")
+    parser.add_argument("--polls", type=int, default=3)
+    parser.add_argument("--validation", choices=["lean", "full"], default="lean")
+    parser.add_argument("--product-fixture", help="Recorded PRODUCT_URL response to replay instead of synthetic data.")
+    parser.add_argument("--stock-fixture", help="Recorded STOCK_URL response to replay with --product-fixture.")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(run_size(args, args.single)))
+        return
+
+    sizes = [0] if args.product_fixture else [int(size) for size in args.sizes.split(",")]
+    for size in sizes:
+        # A fresh interpreter per size keeps the peak RSS of one size from leaking into the next
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--single", str(size)],
+            check=True, capture_output=True, text=True, cwd=BENCHMARK_DIR
+        ).stdout
+        print_report(json.loads(output.strip().splitlines()[-1]))
+
+
+if __name__ == "__main__":
+    main()
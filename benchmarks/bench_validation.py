@@ -0,0 +1,48 @@
+"""
+Compares the full ItemModel validation path against the lean ProductModel path.
+
+Usage: python benchmarks/bench_validation.py [--items 5000] [--repeat 3]
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import validate_products
+from fixtures import generate_product_page
+
+
+def measure(items, lean, repeat):
+    """Returns the best wall time and the peak traced memory of validating items."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        validate_products(items, lean=lean)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    products = validate_products(items, lean=lean)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del products
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    items = generate_product_page(args.items)["items"]
+    print(f"{'path':<8} {'seconds':>9} {'items/sec':>12} {'peak MiB':>9}")
+    for label, lean in (("full", False), ("lean", True)):
+        seconds, peak = measure(items, lean, args.repeat)
+        print(f"{label:<8} {seconds:>9.3f} {args.items / seconds:>12,.0f} {peak / 2 ** 20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
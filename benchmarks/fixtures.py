@@ -0,0 +1,121 @@
+"""Synthetic product and stock responses shaped like the release page API, for running benchmarks offline."""
+import random
+
+BRANDS = ["Buffalo Trace", "Weller", "Blanton's", "Eagle Rare", "Pappy Van Winkle", "E.H. Taylor", "Stagg"]
+SIZES = ["375ML", "750ML", "1L", "1.75L"]
+
+
+def generate_item(index, modified="2024-01-01T00:00:00.000Z", rng=random):
+    """Returns one raw product item with the fields ItemModel requires plus a realistic amount of extras."""
+    product_id = f"{index:09d}"
+    return {
+        "id": product_id,
+        "repositoryId": product_id,
+        "displayName": f"{rng.choice(BRANDS)} Bourbon {index}",
+        "brand": rng.choice(BRANDS),
+        "listPrice": round(rng.uniform(20, 400), 2),
+        "b2c_proof": str(rng.choice([80, 90, 100, 107, 125])),
+        "b2c_size": rng.choice(SIZES),
+        "lastModifiedDate": modified,
+        "shippable": True,
+        "active": True,
+        "b2c_upc": f"0{index:011d}",
+        "primaryFullImageURL": f"/ccstore/v1/images/?source=/file/v{index}/products/{product_id}.jpg",
+        "primarySourceImageURL": f"/file/v{index}/products/{product_id}.jpg",
+        "primaryImageAltText": "Bourbon",
+        "primaryImageTitle": "Bourbon",
+        "sourceImageURLs": [f"/file/v{index}/products/{product_id}.jpg"],
+        "fullImageURLs": [f"/ccstore/v1/images/?source=/file/v{index}/products/{product_id}.jpg"],
+        "b2c_type": "Spirits",
+        "b2c_tastingNotes": "Caramel, vanilla and oak.",
+        "route": f"/bourbon-{index}/product/{product_id}",
+        "x_volumeOZ": "25.4",
+        "x_volume": "750",
+        "b2c_productIdNumber": product_id,
+        "minOrderLimit": None,
+        "b2c_highlyAllocatedProduct": rng.choice(["true", "false", "false", "false"]),
+        "b2c_inventoryAvailability": None,
+        "b2c_freightIncludedSalePrice": 0.0,
+        "b2c_freightIncludedListPrice": 0.0,
+        "b2c_freightIncludedActivePrice": 0.0,
+        "onlineOnly": False,
+        "x_type": "Bourbon",
+        "x_typeDisplay": "Bourbon",
+        "b2c_country": "United States",
+        "creationDate": "2023-06-01T00:00:00.000Z",
+        "parentCategoryIdPath": "root>spirits>whiskey>bourbon",
+        "b2c_onlineAvailable": "true",
+        "b2c_onlineExclusive": "false",
+        "b2c_specialOrderAddressShip": "false",
+        "b2c_lotteryProduct": "false",
+        "b2c_lotteryAvailabilityDescription": None,
+        "b2c_specialOrderProduct": "false",
+        "b2c_clearance": "false",
+        "b2c_futuresProduct": "false",
+        "b2c_comingSoon": rng.choice(["true", "false", "false", "false", "false"]),
+        "b2c_madeInPa": "false",
+        # Extras the API returns that ItemModel doesn't declare
+        "description": "A small batch bourbon. " * 8,
+        "longDescription": "Aged in new charred oak barrels. " * 20,
+        "thumbImageURLs": [f"/file/v{index}/products/{product_id}_thumb.jpg"],
+        "childSKUs": [{"repositoryId": product_id, "listPrice": 0, "active": True}],
+        "parentCategories": [{"repositoryId": "bourbon"}, {"repositoryId": "whiskey"}],
+        "productImagesMetadata": [{}],
+    }
+
+
+def generate_product_page(count, seed=0):
+    """Returns a product response with count items."""
+    rng = random.Random(seed)
+    return {"totalResults": count, "offset": 0, "limit": count,
+            "items": [generate_item(index, rng=rng) for index in range(count)]}
+
+
+def generate_stock_response(product_ids, seed=0):
+    """Returns a stock response for the given product IDs."""
+    rng = random.Random(seed)
+    items = []
+    for product_id in product_ids:
+        quantity = rng.choice([0, 0, 1, 5, 12, 48])
+        status = "IN_STOCK" if quantity else "OUT_OF_STOCK"
+        items.append({
+            "productId": product_id,
+            product_id: status,
+            "stockStatus": status,
+            "productSkuInventoryDetails": [{
+                "inStockQuantity": quantity,
+                "orderableQuantity": quantity,
+                "stockStatus": status,
+                "catRefId": product_id,
+            }],
+        })
+    return {"items": items}
+
+
+def apply_churn(product_page, stock_response, rate, poll, seed=0):
+    """
+    Mutates a fraction (rate) of the catalog in place, as if a poll had happened in between.
+
+    Half of the churned items change stock, a quarter change price and lastModifiedDate, and a quarter flip
+    between in and out of stock. Returns the number of churned items.
+    """
+    rng = random.Random(seed + poll)
+    items = product_page["items"]
+    stock_by_id = {entry["productId"]: entry for entry in stock_response["items"]}
+    churned = rng.sample(range(len(items)), int(len(items) * rate))
+
+    for position, index in enumerate(churned):
+        item = items[index]
+        details = stock_by_id[item["id"]]["productSkuInventoryDetails"][0]
+        kind = position % 4
+        if kind in (0, 1):
+            details["inStockQuantity"] = max(0, details["inStockQuantity"] + rng.choice([-3, -1, 2, 6]))
+        elif kind == 2:
+            item["listPrice"] = round(item["listPrice"] * rng.choice([0.9, 1.1]), 2)
+            item["lastModifiedDate"] = f"2024-01-01T00:{poll:02d}:00.000Z"
+        else:
+            details["inStockQuantity"] = 0 if details["inStockQuantity"] else 12
+        details["orderableQuantity"] = details["inStockQuantity"]
+        details["stockStatus"] = "IN_STOCK" if details["inStockQuantity"] else "OUT_OF_STOCK"
+
+    return len(churned)
@@ -1,194 +1,849 @@
 import sqlite3
+import time
+from types import SimpleNamespace
 from telegram_utils import *
+from db_layer import *
+from notification_ledger import notification_ledger, INSERT_LEDGER_SQL
+from events import event_dispatcher, build_change_events
+from product_diff import diff_product, keep_known_stock
+from snapshot import snapshot_cache, CatalogSnapshot, hash64, product_fields_hash
 
 load_dotenv()  # Load the .env file
 base_url = os.getenv("BASE_URL", "https://www.google.com")
 
+# Columns compared against the stored row to decide whether a product changed. How much a change to each one
+# matters is set in product_diff.
+TRACKED_FIELDS = [
+    "brand", "displayName", "inStockQuantity", "orderableQuantity", "listPrice",
+    "b2c_proof", "b2c_size", "stockStatus", "lastModifiedDate",
+    "shippable", "active", "b2c_upc", "primaryFullImageURL", "url"
+]
+
+# Columns recorded in product_history whenever one of them changes
+HISTORY_FIELDS = ["inStockQuantity", "orderableQuantity", "listPrice", "stockStatus"]
+# History older than HISTORY_DOWNSAMPLE_DAYS keeps one row per product per hour, and is dropped after
+# HISTORY_RETENTION_DAYS
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "365"))
+HISTORY_DOWNSAMPLE_DAYS = int(os.getenv("HISTORY_DOWNSAMPLE_DAYS", "30"))
+HISTORY_PRUNE_INTERVAL = int(os.getenv("HISTORY_PRUNE_INTERVAL", "86400"))
+# How often expired notification ledger entries are deleted
+LEDGER_PRUNE_INTERVAL = int(os.getenv("LEDGER_PRUNE_INTERVAL", "3600"))
+# Product rows written (inserted, updated or tombstoned) after which the query planner's statistics are refreshed
+ANALYZE_MIN_ROWS = int(os.getenv("ANALYZE_MIN_ROWS", "10000"))
+
+# Products that disappear from their target's listing are tombstoned, optionally announced, and purged after
+# TOMBSTONE_RETENTION_DAYS. A poll whose listing lost more than REMOVAL_MAX_FRACTION of the live catalog, net of
+# the new products that replaced them, is suspected to be a partial response and doesn't tombstone anything, until
+# a product has been missing from REMOVAL_CONFIRM_POLLS such polls in a row.
+NOTIFY_REMOVED_PRODUCTS = os.getenv("NOTIFY_REMOVED_PRODUCTS", "false").lower() == "true"
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+TOMBSTONE_PURGE_INTERVAL = int(os.getenv("TOMBSTONE_PURGE_INTERVAL", "86400"))
+REMOVAL_MAX_FRACTION = float(os.getenv("REMOVAL_MAX_FRACTION", "0.5"))
+REMOVAL_CONFIRM_POLLS = int(os.getenv("REMOVAL_CONFIRM_POLLS", "3"))
+# Announce products whose stock went from empty to positive, at most once per NOTIFICATION_DEDUP_TTL
+NOTIFY_RESTOCKS = os.getenv("NOTIFY_RESTOCKS", "false").lower() == "true"
+# Stored columns loaded for products that disappeared, for their notification and removed event
+REMOVED_FIELDS = ["brand", "displayName", "listPrice", "b2c_proof", "b2c_size", "b2c_upc", "url"]
+
+# Stay below SQLite's default limit on bound parameters per statement
+SQLITE_MAX_VARIABLES = 900
+
+# Product rows written by this process since the statistics were last refreshed
+rows_written_since_analyze = 0
+
 
 def initialize_db():
-    """Initializes the SQLite database and creates the necessary table if it doesn't exist."""
+    """Initializes the SQLite database, bringing its schema up to date through the migrations in db_layer."""
     try:
-        with sqlite3.connect('products.db') as conn:
-            cursor = conn.cursor()
-
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                id TEXT PRIMARY KEY,
-                brand TEXT,
-                displayName TEXT,
-                inStockQuantity INTEGER,
-                orderableQuantity INTEGER,
-                listPrice REAL,
-                b2c_proof TEXT,
-                b2c_size TEXT,
-                stockStatus TEXT,
-                lastModifiedDate TEXT,
-                shippable BOOLEAN,
-                active BOOLEAN,
-                b2c_upc TEXT,
-                primaryFullImageURL TEXT,
-                url TEXT,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """)
-            conn.commit()
-        logging.info("Database initialized successfully.")
+        conn = get_connection()
+        version = apply_migrations(conn)
+        logging.info(f"Database initialized successfully (schema version {version}).")
     except sqlite3.Error as e:
         logging.error(f"Error initializing database: {e}")
 
 
-def has_product_changed(product):
+def has_product_changed(product, target=DEFAULT_TARGET):
     """Checks if the product is new, unchanged, or changed in the database."""
-    with sqlite3.connect('products.db') as conn:
-        cursor = conn.cursor()
-
-        cursor.execute("""
-        SELECT brand, displayName, inStockQuantity, orderableQuantity, listPrice, 
-               b2c_proof, b2c_size, stockStatus, lastModifiedDate, 
-               shippable, active, b2c_upc, primaryFullImageURL, url
-        FROM products WHERE id = ?
-        """, (product.id,))
-
-        existing_product = cursor.fetchone()
-
-        if existing_product is None:
-            return "new"
-
-        # Convert tuple to dictionary
-        existing_data = dict(zip(
-            ["brand", "displayName", "inStockQuantity", "orderableQuantity", "listPrice",
-             "b2c_proof", "b2c_size", "stockStatus", "lastModifiedDate",
-             "shippable", "active", "b2c_upc", "primaryFullImageURL", "url"], existing_product
-        ))
+    cursor = get_connection().cursor()
+
+    cursor.execute(
+        f"SELECT {', '.join(TRACKED_FIELDS)} FROM products WHERE target = ? AND id = ? AND removed_at IS NULL",
+        (target, product.id)
+    )
 
-        for key, value in existing_data.items():
-            if value != getattr(product, key, None):
-                return "changed"
-
-        return "no_change"
-
-
-def update_or_insert_product(product):
+    existing_product = cursor.fetchone()
+
+    if existing_product is None:
+        return "new"
+
+    # Convert tuple to dictionary
+    existing_data = dict(zip(TRACKED_FIELDS, existing_product))
+
+    return compare_product(existing_data, product)
+
+
+def compare_product(existing_data, product):
+    """
+    Compares a stored row (as a dict) against a product. Returns "changed" if a difference is significant enough to
+    rewrite the row, otherwise "no_change". Stock fields the product has no value for are first filled in from the
+    stored row.
+    """
+    keep_known_stock(existing_data, product)
+    return "changed" if diff_product(existing_data, product).stored else "no_change"
+
+
+def prepare_product(product):
+    """Fixes the image link and generates the product url before the product is stored."""
+    # Prepends the base url to the image link to fix it
+    if product.primaryFullImageURL and not product.primaryFullImageURL.startswith(base_url):
+        product.primaryFullImageURL = base_url + product.primaryFullImageURL
+
+    # Generates a link to the individual product as a new attribute url. Products prepared by a parallel worker
+    # already have it.
+    url = base_url + "/product/" + product.id
+    if product.url != url:
+        product.url = url
+
+
+def build_new_product_message(product):
+    """Builds the Telegram message announcing a new product."""
+    return (
+        f"🆕 *New Product Added!*\n"
+        f"📌 *{product.displayName}*\n"
+        f"🏷️ Brand: {product.brand}\n"
+        f"📦 In Stock: {product.inStockQuantity}\n"
+        f"💰 Price: ${product.listPrice}\n"
+        f"🛒 Orderable Quantity: {product.orderableQuantity}\n"
+        f"🔗 [View Product]({product.url})"
+    )
+
+
+def build_new_product_summary(product):
+    """Builds the one-line form of the new product message used in digests."""
+    return f"📌 [{product.displayName}]({product.url}) – ${product.listPrice}, {product.inStockQuantity} in stock"
+
+
+def notify_new_product(product, chat_id=None):
+    """Queues the new product notification for chat_id, or the group chat if none is given."""
+    notification_queue.enqueue(
+        build_new_product_message(product), chat_id or TELEGRAM_GROUP_CHAT_ID,
+        summary=build_new_product_summary(product), title="🆕 *New Products Added!*"
+    )
+
+
+def build_removed_product_message(product):
+    """Builds the Telegram message announcing a product that disappeared from the listing."""
+    return (
+        f"❌ *Product Removed!*\n"
+        f"📌 *{product.displayName}*\n"
+        f"🏷️ Brand: {product.brand}\n"
+        f"💰 Last Price: ${product.listPrice}\n"
+        f"🔗 [View Product]({product.url})"
+    )
+
+
+def notify_removed_product(product, chat_id=None):
+    """Queues the removed product notification for chat_id, or the group chat if none is given."""
+    notification_queue.enqueue(
+        build_removed_product_message(product), chat_id or TELEGRAM_GROUP_CHAT_ID,
+        summary=f"📌 [{product.displayName}]({product.url})", title="❌ *Products Removed!*"
+    )
+
+
+def build_restock_message(product):
+    """Builds the Telegram message announcing a product that is back in stock."""
+    return (
+        f"🔄 *Back in Stock!*\n"
+        f"📌 *{product.displayName}*\n"
+        f"🏷️ Brand: {product.brand}\n"
+        f"📦 In Stock: {product.inStockQuantity}\n"
+        f"💰 Price: ${product.listPrice}\n"
+        f"🔗 [View Product]({product.url})"
+    )
+
+
+def notify_restocked_product(product, chat_id=None):
+    """Queues the restock notification for chat_id, or the group chat if none is given."""
+    notification_queue.enqueue(
+        build_restock_message(product), chat_id or TELEGRAM_GROUP_CHAT_ID,
+        summary=build_new_product_summary(product), title="🔄 *Back in Stock!*"
+    )
+
+
+# A tombstoned product that shows up again is inserted over its old row and becomes live again
+INSERT_PRODUCT_SQL = """
+INSERT INTO products (
+    target, id, brand, displayName, inStockQuantity, orderableQuantity, listPrice, 
+    b2c_proof, b2c_size, stockStatus, lastModifiedDate, 
+    shippable, active, b2c_upc, primaryFullImageURL, url
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (target, id) DO UPDATE SET
+    brand = excluded.brand, displayName = excluded.displayName, inStockQuantity = excluded.inStockQuantity,
+    orderableQuantity = excluded.orderableQuantity, listPrice = excluded.listPrice, b2c_proof = excluded.b2c_proof,
+    b2c_size = excluded.b2c_size, stockStatus = excluded.stockStatus, lastModifiedDate = excluded.lastModifiedDate,
+    shippable = excluded.shippable, active = excluded.active, b2c_upc = excluded.b2c_upc,
+    primaryFullImageURL = excluded.primaryFullImageURL, url = excluded.url,
+    last_updated = CURRENT_TIMESTAMP, removed_at = NULL
+"""
+
+UPDATE_PRODUCT_SQL = """
+UPDATE products SET
+    brand = ?, displayName = ?, inStockQuantity = ?, orderableQuantity = ?, 
+    listPrice = ?, b2c_proof = ?, b2c_size = ?, stockStatus = ?, 
+    lastModifiedDate = ?, shippable = ?, active = ?, b2c_upc = ?, 
+    primaryFullImageURL = ?, url = ?, last_updated = CURRENT_TIMESTAMP WHERE target = ? AND id = ?
+"""
+
+
+def product_insert_params(product, target=DEFAULT_TARGET):
+    """Returns the parameters for INSERT_PRODUCT_SQL."""
+    return (target, product.id) + tuple(getattr(product, field, None) for field in TRACKED_FIELDS)
+
+
+def product_update_params(product, target=DEFAULT_TARGET):
+    """Returns the parameters for UPDATE_PRODUCT_SQL."""
+    return tuple(getattr(product, field, None) for field in TRACKED_FIELDS) + (target, product.id)
+
+
+def update_or_insert_product(product, target=DEFAULT_TARGET, chat_id=None):
     """Inserts a new product or updates an existing one in the database if changes are detected."""
     try:
-        with sqlite3.connect('products.db') as conn:
+        conn = get_connection()
+        with conn:
             cursor = conn.cursor()
 
-            # Prepends the base url to the image link to fix it
-            if product.primaryFullImageURL and not product.primaryFullImageURL.startswith(base_url):
-                product.primaryFullImageURL = base_url + product.primaryFullImageURL
+            prepare_product(product)
 
-            # Generates a link to the individual product as a new attribute url
-            product.url = base_url + "/product/" + product.id
-
-            product_status = has_product_changed(product)
+            product_status = has_product_changed(product, target)
 
             if product_status == "new":
-                cursor.execute("""
-                INSERT INTO products (
-                    id, brand, displayName, inStockQuantity, orderableQuantity, listPrice, 
-                    b2c_proof, b2c_size, stockStatus, lastModifiedDate, 
-                    shippable, active, b2c_upc, primaryFullImageURL, url
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    product.id, product.brand, product.displayName, product.inStockQuantity,
-                    product.orderableQuantity, product.listPrice, product.b2c_proof,
-                    product.b2c_size, product.stockStatus, product.lastModifiedDate,
-                    product.shippable, product.active, product.b2c_upc, product.primaryFullImageURL, product.url
-                ))
-                conn.commit()
-
-                message = (
-                    f"🆕 *New Product Added!*\n"
-                    f"📌 *{product.displayName}*\n"
-                    f"🏷️ Brand: {product.brand}\n"
-                    f"📦 In Stock: {product.inStockQuantity}\n"
-                    f"💰 Price: ${product.listPrice}\n"
-                    f"🛒 Orderable Quantity: {product.orderableQuantity}\n"
-                    f"🔗 [View Product]({product.url})"
-                )
-
-                # Sends a telegram message to the group chat
-                send_telegram_message(message, TELEGRAM_GROUP_CHAT_ID)
+                cursor.execute(INSERT_PRODUCT_SQL, product_insert_params(product, target))
+
+                # Queues a telegram message to the group chat, unless it was announced recently
+                notification_ledger.load(conn)
+                to_notify, _, ledger_rows = notification_ledger.filter_products(target, [product], "new")
+                cursor.executemany(INSERT_LEDGER_SQL, ledger_rows)
+                if to_notify:
+                    notify_new_product(product, chat_id)
+                notification_ledger.remember(ledger_rows)
                 logging.info(f"New product added: {product.displayName}")
 
             elif product_status == "changed":
-                cursor.execute("""
-                UPDATE products SET
-                    brand = ?, displayName = ?, inStockQuantity = ?, orderableQuantity = ?, 
-                    listPrice = ?, b2c_proof = ?, b2c_size = ?, stockStatus = ?, 
-                    lastModifiedDate = ?, shippable = ?, active = ?, b2c_upc = ?, 
-                    primaryFullImageURL = ?, url = ? WHERE id = ?
-                """, (
-                    product.brand, product.displayName, product.inStockQuantity,
-                    product.orderableQuantity, product.listPrice, product.b2c_proof,
-                    product.b2c_size, product.stockStatus, product.lastModifiedDate,
-                    product.shippable, product.active, product.b2c_upc,
-                    product.primaryFullImageURL, product.url, product.id
-                ))
-                conn.commit()
+                cursor.execute(UPDATE_PRODUCT_SQL, product_update_params(product, target))
                 logging.info(f"Updated product: {product.displayName}")
 
             else:
                 logging.info(f"No changes detected for product: {product.displayName}. Skipping update.")
 
+            if product_status != "no_change":
+                bump_sync_generation(cursor, target)
+
     except sqlite3.Error as e:
         logging.error(f"Database error while updating product {product.displayName}: {e}")
     except Exception as e:
         logging.error(f"Unexpected error in update_or_insert_product(). Product: {product.displayName}: {e}")
 
 
-def store_products_to_db(product_list):
-    """Stores the products in the list to the database."""
+INSERT_HISTORY_SQL = """
+INSERT OR REPLACE INTO product_history (
+    target, product_id, observed_at, inStockQuantity, orderableQuantity, listPrice, stockStatus
+) VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def history_rows(new_products, changed_products, existing_products, observed_at, target=DEFAULT_TARGET):
+    """Returns the product_history rows for this poll: every new product, and changed products whose stock or price
+    moved."""
+    rows = []
+    for product in new_products:
+        rows.append(
+            (target, product.id, observed_at) + tuple(getattr(product, field, None) for field in HISTORY_FIELDS)
+        )
+    for product in changed_products:
+        values = tuple(getattr(product, field, None) for field in HISTORY_FIELDS)
+        existing_data = existing_products[product.id]
+        if values != tuple(existing_data[field] for field in HISTORY_FIELDS):
+            rows.append((target, product.id, observed_at) + values)
+    return rows
+
+
+def load_existing_products(cursor, product_ids, target=DEFAULT_TARGET):
+    """Loads the target's stored rows for the given product IDs into a dict keyed by id."""
+    existing_products = {}
+    product_ids = list(product_ids)
+
+    # Query in chunks so large catalogs stay under SQLite's bound-parameter limit
+    for start in range(0, len(product_ids), SQLITE_MAX_VARIABLES):
+        chunk = product_ids[start:start + SQLITE_MAX_VARIABLES]
+        placeholders = ", ".join("?" * len(chunk))
+        cursor.execute(
+            f"SELECT id, {', '.join(TRACKED_FIELDS)} FROM products "
+            f"WHERE target = ? AND removed_at IS NULL AND id IN ({placeholders})",
+            [target] + chunk
+        )
+        for row in cursor.fetchall():
+            existing_products[row[0]] = dict(zip(TRACKED_FIELDS, row[1:]))
+
+    return existing_products
+
+
+def find_removed_products(cursor, target, live_ids):
+    """
+    Returns the target's live stored products whose IDs are not in live_ids, as namespaces of REMOVED_FIELDS,
+    together with the number of live stored products.
+
+    The stored IDs come from one query over the (target, id) primary key, and the difference is a set
+    operation in memory.
+    """
+    cursor.execute(f"SELECT id, {', '.join(REMOVED_FIELDS)} FROM products WHERE target = ? AND removed_at IS NULL",
+                   (target,))
+    removed_products = []
+    stored_count = 0
+    for row in cursor:
+        stored_count += 1
+        if row[0] not in live_ids:
+            removed_products.append(SimpleNamespace(id=row[0], **dict(zip(REMOVED_FIELDS, row[1:]))))
+    return removed_products, stored_count
+
+
+def tombstone_missing_products(cursor, target, live_ids, new_count=0):
+    """
+    Tombstones the target's live stored products whose IDs are not in live_ids, inside the caller's transaction.
+    new_count is the number of products this poll inserted, which are already among the stored ones.
+
+    Returns the removed products and whether every missing product was tombstoned. A listing that lost more than
+    REMOVAL_MAX_FRACTION of the catalog as it was before the poll, net of the new products, is suspected to be a
+    partial response: only the products missing from REMOVAL_CONFIRM_POLLS such listings in a row are removed.
+    """
+    removed_products, stored_count = find_removed_products(cursor, target, live_ids)
+    previous_count = stored_count - new_count
+    if len(removed_products) - new_count > REMOVAL_MAX_FRACTION * previous_count:
+        # The miss counts live in the database, so they add up across one-shot runs too
+        cursor.execute(SELECT_REMOVAL_CANDIDATES_SQL, (target,))
+        previous_misses = dict(cursor.fetchall())
+        misses = {p.id: previous_misses.get(p.id, 0) + 1 for p in removed_products}
+        confirmed = [p for p in removed_products if misses[p.id] >= REMOVAL_CONFIRM_POLLS]
+        cursor.execute(DELETE_REMOVAL_CANDIDATES_SQL, (target,))
+        cursor.executemany(INSERT_REMOVAL_CANDIDATE_SQL, [
+            (target, product_id, count) for product_id, count in misses.items() if count < REMOVAL_CONFIRM_POLLS
+        ])
+        logging.warning(
+            f"{len(removed_products)} of {previous_count} stored products are missing from the listing of "
+            f"{target}. Suspecting a partial response and removing only the {len(confirmed)} missing from "
+            f"{REMOVAL_CONFIRM_POLLS} such listings in a row."
+        )
+        complete = len(confirmed) == len(removed_products)
+        removed_products = confirmed
+    else:
+        complete = True
+        cursor.execute(DELETE_REMOVAL_CANDIDATES_SQL, (target,))
+    if removed_products:
+        removed_at = int(time.time())
+        cursor.executemany(TOMBSTONE_PRODUCT_SQL, [(removed_at, target, p.id) for p in removed_products])
+    return removed_products, complete
+
+
+def forget_removal_candidates(connection, target):
+    """
+    Clears the target's miss counts after a listing that had every stored product, when no transaction is open.
+    Only writes if there is something to clear, so an unchanged poll stays read-only.
+    """
+    if connection.execute("SELECT 1 FROM removal_candidates WHERE target = ? LIMIT 1", (target,)).fetchone():
+        with connection:
+            connection.execute(DELETE_REMOVAL_CANDIDATES_SQL, (target,))
+
+
+def get_sync_generation(connection, target):
+    """Returns the target's sync generation, 0 if its products were never written."""
+    row = connection.execute("SELECT generation FROM sync_generations WHERE target = ?", (target,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_sync_generation(cursor, target):
+    """Increments the target's sync generation inside the caller's transaction and returns the new value."""
+    cursor.execute(
+        "INSERT INTO sync_generations (target, generation) VALUES (?, 1) "
+        "ON CONFLICT (target) DO UPDATE SET generation = generation + 1 RETURNING generation",
+        (target,)
+    )
+    return cursor.fetchall()[0][0]
+
+
+def announce_removed_products(removed_products, removed_to_notify, chat_id=None):
+    """Logs the removed products and queues the notifications that passed the ledger."""
+    for product in removed_products:
+        logging.info(f"Product removed from the listing: {product.displayName}")
+    for product in removed_to_notify:
+        try:
+            notify_removed_product(product, chat_id)
+        except Exception as e:
+            logging.error(f"Error queueing removal notification for product {product.displayName}: {e}")
+
+
+def filter_removed_notifications(target, removed_products):
+    """Returns the removed products to announce and their ledger rows, or nothing unless NOTIFY_REMOVED_PRODUCTS."""
+    if not NOTIFY_REMOVED_PRODUCTS or not removed_products:
+        return [], []
+    removed_to_notify, _, ledger_rows = notification_ledger.filter_products(target, removed_products, "removed")
+    return removed_to_notify, ledger_rows
+
+
+def filter_restock_notifications(target, changed_products, existing_products):
+    """Returns the restocked products to announce and their ledger rows, or nothing unless NOTIFY_RESTOCKS."""
+    if not NOTIFY_RESTOCKS or not changed_products:
+        return [], []
+    restocked = [
+        product for product in changed_products
+        if any(kind == "restock" for kind, _ in diff_product(existing_products[product.id], product).transitions)
+    ]
+    restocked_to_notify, _, ledger_rows = notification_ledger.filter_products(target, restocked, "restock")
+    return restocked_to_notify, ledger_rows
+
+
+def classify_products(product_list, existing_products):
+    """
+    Splits products into new, changed and unchanged lists using the stored rows in existing_products. Products
+    whose only differences are insignificant count as unchanged.
+    """
+    new_products, changed_products, unchanged_products = [], [], []
+
     for product in product_list:
+        existing_data = existing_products.get(product.id)
+        if existing_data is None:
+            new_products.append(product)
+        elif compare_product(existing_data, product) == "changed":
+            changed_products.append(product)
+        else:
+            unchanged_products.append(product)
+
+    return new_products, changed_products, unchanged_products
+
+
+TOMBSTONE_PRODUCT_SQL = "UPDATE products SET removed_at = ? WHERE target = ? AND id = ?"
+
+# Products missing from suspected partial listings, with the number of such listings in a row they were missing from
+SELECT_REMOVAL_CANDIDATES_SQL = "SELECT product_id, missed_polls FROM removal_candidates WHERE target = ?"
+DELETE_REMOVAL_CANDIDATES_SQL = "DELETE FROM removal_candidates WHERE target = ?"
+INSERT_REMOVAL_CANDIDATE_SQL = "INSERT INTO removal_candidates (target, product_id, missed_polls) VALUES (?, ?, ?)"
+
+
+def count_written_rows(count):
+    """Adds to the product rows written since the last ANALYZE."""
+    global rows_written_since_analyze
+    rows_written_since_analyze += count
+
+
+def analyze_if_stale(conn=None):
+    """
+    Refreshes the query planner's statistics once ANALYZE_MIN_ROWS product rows were written since the last
+    refresh, e.g. after the first sync of a big catalog. Returns True if it ran.
+    """
+    global rows_written_since_analyze
+    if rows_written_since_analyze < ANALYZE_MIN_ROWS:
+        return False
+    try:
+        analyze(conn or get_connection())
+    except sqlite3.Error as e:
+        logging.error(f"Database error while refreshing the query planner statistics: {e}")
+        return False
+    logging.info(f"Refreshed the query planner statistics after {rows_written_since_analyze} product writes.")
+    rows_written_since_analyze = 0
+    return True
+
+
+def store_products_to_db(product_list, conn=None, target=DEFAULT_TARGET, chat_id=None, detect_removed=True,
+                         fingerprints=None):
+    """
+    Stores the products in the list to the database under the given monitoring target.
+
+    All stored rows are loaded with one query, diffed in memory and written back with executemany inside a
+    single transaction. Only products with a significant change (see product_diff) are rewritten. Pass conn to
+    use a specific connection, otherwise this thread's long-lived one is used. New products are announced to
+    chat_id (the group chat by default) unless the notification ledger shows they were announced within
+    NOTIFICATION_DEDUP_TTL, and so are restocks when NOTIFY_RESTOCKS is set. The ledger rows are written in the
+    same transaction, so a run that crashes before committing neither stores nor records its notifications.
+
+    With detect_removed, product_list is taken to be the target's whole listing: stored products missing from it
+    are tombstoned (and announced when NOTIFY_REMOVED_PRODUCTS is set), unless the listing looks partial (see
+    tombstone_missing_products). Pass detect_removed=False when storing a partial listing.
+
+    Products whose hashes match the target's catalog snapshot are unchanged without being loaded from SQLite,
+    and a listing that matches the snapshot entirely doesn't open a transaction at all. fingerprints can hold the
+    products' snapshot hashes, keyed by id, when they were already computed (e.g. by the parallel pipeline).
+
+    After the commit, the new, changed, removed and transition (restock, sell_out, price_drop, price_raise,
+    status_change) events with field diffs go to the configured event sinks. Returns a dict with the
+    new/changed/unchanged/removed/suppressed counts and the time spent in the database.
+    """
+    stats = {"new": 0, "changed": 0, "unchanged": 0, "removed": 0, "history": 0, "suppressed": 0, "db_time": 0.0}
+    if not product_list:
+        return stats
+
+    # De-duplicate by id so a repeated item can't trip the primary key on insert
+    products_by_id = {}
+    for product in product_list:
+        prepare_product(product)
+        products_by_id[product.id] = product
+
+    db_start = time.perf_counter()
+    connection = conn or get_connection()
+    try:
+        snapshot = None
+        candidates = products_by_id
+        unchanged_products = []
+        if snapshot_cache.enabled:
+            if fingerprints is None:
+                fingerprints = {product_id: (hash64(product_id), product_fields_hash(product, TRACKED_FIELDS))
+                                for product_id, product in products_by_id.items()}
+            snapshot = snapshot_cache.get(target, get_sync_generation(connection, target))
+
+        if snapshot is not None:
+            # Only products the snapshot doesn't vouch for need their stored row
+            candidates = {}
+            for product_id, product in products_by_id.items():
+                id_hash, fields_hash = fingerprints[product_id]
+                if snapshot.entries.get(id_hash) == fields_hash:
+                    unchanged_products.append(product)
+                else:
+                    candidates[product_id] = product
+
+            # Every hit is in the snapshot, so it only holds more products if some disappeared
+            check_removed = detect_removed and (not snapshot.complete or len(snapshot.entries) > len(unchanged_products))
+            if not candidates and not check_removed:
+                if detect_removed:
+                    forget_removal_candidates(connection, target)
+                stats["unchanged"] = len(unchanged_products)
+                logging.debug(f"All {len(unchanged_products)} products match the snapshot of {target}.")
+                return stats
+        else:
+            check_removed = detect_removed
+
+        notification_ledger.load(connection)
+        with connection:
+            cursor = connection.cursor()
+
+            existing_products = load_existing_products(cursor, candidates.keys(), target)
+            new_products, changed_products, unchanged_candidates = classify_products(
+                candidates.values(), existing_products
+            )
+            unchanged_products += unchanged_candidates
+
+            # The connection context manager commits once on success and rolls back on error
+            if new_products:
+                cursor.executemany(INSERT_PRODUCT_SQL, [product_insert_params(p, target) for p in new_products])
+            if changed_products:
+                cursor.executemany(UPDATE_PRODUCT_SQL, [product_update_params(p, target) for p in changed_products])
+
+            # Stock/price deltas go into the history in the same transaction
+            history = history_rows(new_products, changed_products, existing_products, int(time.time()), target)
+            if history:
+                cursor.executemany(INSERT_HISTORY_SQL, history)
+
+            # Products stored for this target but missing from the listing have been pulled
+            if check_removed:
+                removed_products, listing_complete = tombstone_missing_products(cursor, target, products_by_id,
+                                                                                len(new_products))
+            else:
+                removed_products, listing_complete = [], detect_removed
+                if detect_removed:
+                    cursor.execute(DELETE_REMOVAL_CANDIDATES_SQL, (target,))
+
+            # Record the notifications to send with the rows that trigger them
+            to_notify, suppressed, ledger_rows = notification_ledger.filter_products(target, new_products, "new")
+            removed_to_notify, removed_ledger_rows = filter_removed_notifications(target, removed_products)
+            restocked_to_notify, restock_ledger_rows = filter_restock_notifications(target, changed_products,
+                                                                                    existing_products)
+            ledger_rows += removed_ledger_rows + restock_ledger_rows
+            if ledger_rows:
+                cursor.executemany(INSERT_LEDGER_SQL, ledger_rows)
+
+            generation = bump_sync_generation(cursor, target)
+
+    except sqlite3.Error as e:
+        logging.error(f"Database error while storing {len(products_by_id)} products: {e}")
+        return stats
+    finally:
+        stats["db_time"] = time.perf_counter() - db_start
+
+    if snapshot_cache.enabled:
+        entries = dict(fingerprints.values())
+        if listing_complete:
+            # The stored live products are now exactly this listing
+            snapshot_cache.put(target, CatalogSnapshot(entries, generation, complete=True))
+        else:
+            merged = dict(snapshot.entries) if snapshot is not None else {}
+            merged.update(entries)
+            # Products tombstoned after missing several suspected partial listings are no longer live
+            for product in removed_products:
+                merged.pop(hash64(product.id), None)
+            snapshot_cache.put(target, CatalogSnapshot(merged, generation, snapshot is not None and snapshot.complete))
+
+    notification_ledger.remember(ledger_rows)
+    stats.update(new=len(new_products), changed=len(changed_products), unchanged=len(unchanged_products),
+                 removed=len(removed_products), history=len(history), suppressed=len(suppressed))
+    count_written_rows(len(new_products) + len(changed_products) + len(removed_products))
+
+    for product in changed_products:
+        logging.info(f"Updated product: {product.displayName}")
+
+    # Notify only once the rows are committed; the queue's worker does the sending
+    for product in to_notify:
         try:
-            update_or_insert_product(product)
+            notify_new_product(product, chat_id)
         except Exception as e:
-            logging.error(f"Error storing product {product.displayName} to the database: {e}")
+            logging.error(f"Error queueing notification for product {product.displayName}: {e}")
+    for product in new_products:
+        logging.info(f"New product added: {product.displayName}")
+    if suppressed:
+        logging.info(f"Suppressed {len(suppressed)} new product notifications already sent recently.")
+
+    announce_removed_products(removed_products, removed_to_notify, chat_id)
+    for product in restocked_to_notify:
+        try:
+            notify_restocked_product(product, chat_id)
+        except Exception as e:
+            logging.error(f"Error queueing restock notification for product {product.displayName}: {e}")
+
+    if event_dispatcher.sinks:
+        event_dispatcher.emit(build_change_events(target, new_products, changed_products, existing_products,
+                                                  removed_products))
+
+    logging.debug(f"{len(unchanged_products)} products unchanged. Skipping update.")
+
+    return stats
+
+
+def remove_missing_products(live_ids, conn=None, target=DEFAULT_TARGET, chat_id=None, new_count=0):
+    """
+    Tombstones the target's stored products that are not in live_ids, for listings stored in several batches
+    with detect_removed=False. new_count is the number of new products the batches inserted. Returns the number
+    of removed products.
+    """
+    connection = conn or get_connection()
+    try:
+        snapshot = None
+        if snapshot_cache.enabled:
+            snapshot = snapshot_cache.get(target, get_sync_generation(connection, target))
+            live_hashes = {hash64(product_id) for product_id in live_ids}
+        if snapshot is not None and snapshot.complete and snapshot.entries.keys() <= live_hashes:
+            forget_removal_candidates(connection, target)
+            return 0
+
+        notification_ledger.load(connection)
+        with connection:
+            cursor = connection.cursor()
+            removed_products, listing_complete = tombstone_missing_products(cursor, target, live_ids, new_count)
+            removed_to_notify, ledger_rows = filter_removed_notifications(target, removed_products)
+            if ledger_rows:
+                cursor.executemany(INSERT_LEDGER_SQL, ledger_rows)
+            generation = bump_sync_generation(cursor, target)
+    except sqlite3.Error as e:
+        logging.error(f"Database error while removing missing products: {e}")
+        return 0
+
+    if snapshot is not None:
+        if listing_complete:
+            entries = {id_hash: fields_hash for id_hash, fields_hash in snapshot.entries.items()
+                       if id_hash in live_hashes}
+            # Complete only if every live product made it into the snapshot
+            snapshot_cache.put(target, CatalogSnapshot(entries, generation, len(entries) == len(live_hashes)))
+        else:
+            removed_hashes = {hash64(product.id) for product in removed_products}
+            entries = {id_hash: fields_hash for id_hash, fields_hash in snapshot.entries.items()
+                       if id_hash not in removed_hashes}
+            snapshot_cache.put(target, CatalogSnapshot(entries, generation, snapshot.complete))
+
+    notification_ledger.remember(ledger_rows)
+    count_written_rows(len(removed_products))
+    announce_removed_products(removed_products, removed_to_notify, chat_id)
+    if event_dispatcher.sinks and removed_products:
+        event_dispatcher.emit(build_change_events(target, [], [], {}, removed_products))
+    return len(removed_products)
+
+
+def prune_history(conn=None, retention_days=HISTORY_RETENTION_DAYS, downsample_days=HISTORY_DOWNSAMPLE_DAYS):
+    """
+    Applies the history retention policy.
+
+    Rows older than retention_days are deleted. Rows older than downsample_days are reduced to the last
+    observation per product per hour, which keeps the state at the end of each hour. Returns the number of
+    deleted rows.
+    """
+    now = int(time.time())
+    retention_cutoff = now - retention_days * 86400
+    downsample_cutoff = now - downsample_days * 86400
+
+    connection = conn or get_connection()
+    try:
+        with connection:
+            cursor = connection.cursor()
+            cursor.execute("DELETE FROM product_history WHERE observed_at < ?", (retention_cutoff,))
+            deleted = cursor.rowcount
+            cursor.execute("""
+            DELETE FROM product_history
+            WHERE observed_at < ? AND (target, product_id, observed_at) NOT IN (
+                SELECT target, product_id, MAX(observed_at) FROM product_history
+                WHERE observed_at < ?
+                GROUP BY target, product_id, observed_at / 3600
+            )
+            """, (downsample_cutoff, downsample_cutoff))
+            deleted += cursor.rowcount
+    except sqlite3.Error as e:
+        logging.error(f"Database error while pruning product history: {e}")
+        return 0
+
+    if deleted:
+        logging.info(f"Pruned {deleted} product history rows.")
+    return deleted
+
+
+def purge_tombstones(conn=None, retention_days=TOMBSTONE_RETENTION_DAYS):
+    """Deletes products that were tombstoned more than retention_days ago. Returns the number of deleted rows."""
+    cutoff = int(time.time()) - retention_days * 86400
+    connection = conn or get_connection()
+    try:
+        with connection:
+            deleted = connection.execute(
+                "DELETE FROM products WHERE removed_at IS NOT NULL AND removed_at < ?", (cutoff,)
+            ).rowcount
+    except sqlite3.Error as e:
+        logging.error(f"Database error while purging removed products: {e}")
+        return 0
 
+    if deleted:
+        logging.info(f"Purged {deleted} products removed more than {retention_days} days ago.")
+    return deleted
 
-def delete_product(product_id):
+
+def run_maintenance_if_due(name, interval, task, conn=None):
+    """Runs task(conn) if it hasn't run in the last interval seconds, recording the run in maintenance_runs."""
+    now = int(time.time())
+    connection = conn or get_connection()
+    try:
+        row = connection.execute("SELECT last_run FROM maintenance_runs WHERE name = ?", (name,)).fetchone()
+        if row and now - row[0] < interval:
+            return None
+        result = task(connection)
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO maintenance_runs (name, last_run) VALUES (?, ?)", (name, now))
+        return result
+    except sqlite3.Error as e:
+        logging.error(f"Database error while running maintenance task {name}: {e}")
+        return None
+
+
+def get_product_history(product_id, since=None, conn=None, target=DEFAULT_TARGET):
+    """Returns the history of a product as a list of dicts, oldest first. since is an optional unix timestamp."""
+    cursor = (conn or get_connection()).execute(
+        f"SELECT observed_at, {', '.join(HISTORY_FIELDS)} FROM product_history "
+        f"WHERE target = ? AND product_id = ? AND observed_at >= ? ORDER BY observed_at",
+        (target, product_id, since or 0)
+    )
+    return [dict(zip(["observed_at"] + HISTORY_FIELDS, row)) for row in cursor]
+
+
+def get_sell_through_rate(product_id, since=None, conn=None, target=DEFAULT_TARGET):
+    """
+    Returns how fast a product sells, computed from decreases in inStockQuantity.
+
+    The result has units_sold, hours (the span the history covers), units_per_hour, and sold_out_after_hours:
+    the time from the most recent restock to the product hitting zero, or None if it hasn't sold out since.
+    """
+    history = get_product_history(product_id, since, conn, target)
+    result = {"units_sold": 0, "hours": 0.0, "units_per_hour": None, "sold_out_after_hours": None}
+    if len(history) < 2:
+        return result
+
+    restocked_at = None
+    previous = history[0]
+    for row in history[1:]:
+        before, after = previous["inStockQuantity"] or 0, row["inStockQuantity"] or 0
+        if after < before:
+            result["units_sold"] += before - after
+        if before == 0 and after > 0:
+            restocked_at = row["observed_at"]
+            result["sold_out_after_hours"] = None
+        elif before > 0 and after == 0 and restocked_at is not None:
+            result["sold_out_after_hours"] = (row["observed_at"] - restocked_at) / 3600
+        previous = row
+
+    result["hours"] = (history[-1]["observed_at"] - history[0]["observed_at"]) / 3600
+    if result["hours"]:
+        result["units_per_hour"] = result["units_sold"] / result["hours"]
+    return result
+
+
+def get_restock_timing(product_id, since=None, conn=None, target=DEFAULT_TARGET):
+    """
+    Returns when a product gets restocked: the restock events (out of stock to in stock), the average hours
+    between restocks, and the most common UTC weekday (0 is Monday) and hour of the restocks.
+    """
+    cursor = (conn or get_connection()).execute("""
+    SELECT observed_at, inStockQuantity FROM (
+        SELECT observed_at, inStockQuantity,
+               LAG(inStockQuantity) OVER (ORDER BY observed_at) AS previousQuantity
+        FROM product_history
+        WHERE target = ? AND product_id = ? AND observed_at >= ?
+    )
+    WHERE COALESCE(previousQuantity, 0) = 0 AND inStockQuantity > 0 AND previousQuantity IS NOT NULL
+    ORDER BY observed_at
+    """, (target, product_id, since or 0))
+    restocks = [{"observed_at": observed_at, "inStockQuantity": quantity} for observed_at, quantity in cursor]
+
+    result = {"restocks": restocks, "average_hours_between": None, "common_weekday": None, "common_hour": None}
+    if len(restocks) >= 2:
+        span = restocks[-1]["observed_at"] - restocks[0]["observed_at"]
+        result["average_hours_between"] = span / (len(restocks) - 1) / 3600
+    if restocks:
+        times = [time.gmtime(restock["observed_at"]) for restock in restocks]
+        weekdays = [t.tm_wday for t in times]
+        hours = [t.tm_hour for t in times]
+        result["common_weekday"] = max(set(weekdays), key=weekdays.count)
+        result["common_hour"] = max(set(hours), key=hours.count)
+    return result
+
+
+def delete_product(product_id, target=DEFAULT_TARGET):
     """Deletes a product from the database based on its ID."""
-    with sqlite3.connect('products.db') as conn:
+    conn = get_connection()
+    with conn:
         cursor = conn.cursor()
 
-        cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
+        cursor.execute("DELETE FROM products WHERE target = ? AND id = ?", (target, product_id))
         if cursor.rowcount > 0:
+            bump_sync_generation(cursor, target)
             logging.warning(f"Product: {product_id} deleted from the database.")
         else:
             logging.warning(f"Product: {product_id} not found in the database.")
 
-        conn.commit()
-
 
 def fetch_and_print_products():
     """Fetches and prints all products from the database."""
-    with sqlite3.connect('products.db') as conn:
-        cursor = conn.cursor()
+    # WAL mode lets this read run while the poller is writing
+    cursor = get_connection().cursor()
 
-        try:
-            # Fetch all products from the database
-            cursor.execute("SELECT * FROM products")
-            rows = cursor.fetchall()
-
-            # Iterate over each row and print the product details
-            for row in rows:
-                print(f"ID: {row[0]}")
-                print(f"Brand: {row[1]}")
-                print(f"Display Name: {row[2]}")
-                print(f"In Stock Quantity: {row[3]}")
-                print(f"Orderable Quantity: {row[4]}")
-                print(f"List Price: {row[5]}")
-                print(f"B2C Proof: {row[6]}")
-                print(f"B2C Size: {row[7]}")
-                print(f"Stock Status: {row[8]}")
-                print(f"Last Modified Date: {row[9]}")
-                print(f"Shippable: {row[10]}")
-                print(f"Active: {row[11]}")
-                print(f"B2C UPC: {row[12]}")
-                print(f"Primary Image URL: {row[13]}")
-                print(f"URL: {row[14]}")
-                print("-" * 50)  # Separator for better readability
-
-        except sqlite3.Error as e:
-            logging.error(f"Database error: {e}")
+    try:
+        # Fetch all products from the database
+        cursor.execute(f"SELECT id, {', '.join(TRACKED_FIELDS)} FROM products WHERE removed_at IS NULL")
+
+        # Iterate over each row and print the product details
+        for row in cursor:
+            print(f"ID: {row[0]}")
+            print(f"Brand: {row[1]}")
+            print(f"Display Name: {row[2]}")
+            print(f"In Stock Quantity: {row[3]}")
+            print(f"Orderable Quantity: {row[4]}")
+            print(f"List Price: {row[5]}")
+            print(f"B2C Proof: {row[6]}")
+            print(f"B2C Size: {row[7]}")
+            print(f"Stock Status: {row[8]}")
+            print(f"Last Modified Date: {row[9]}")
+            print(f"Shippable: {row[10]}")
+            print(f"Active: {row[11]}")
+            print(f"B2C UPC: {row[12]}")
+            print(f"Primary Image URL: {row[13]}")
+            print(f"URL: {row[14]}")
+            print("-" * 50)  # Separator for better readability
+
+    except sqlite3.Error as e:
+        logging.error(f"Database error: {e}")
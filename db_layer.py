@@ -0,0 +1,299 @@
+import os
+import sqlite3
+import logging
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()  # Load the .env file
+
+# Location of the SQLite database
+DB_PATH = os.getenv("DB_PATH", "products.db")
+# Page cache size per connection in KiB, and how long a writer waits for a lock before failing
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "20000"))
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))
+# Prepared statements kept per connection; the poller reuses a handful of statements on every cycle
+DB_STATEMENT_CACHE_SIZE = 256
+# Monitoring target that rows belong to when none is given (single PRODUCT_URL setups)
+DEFAULT_TARGET = "default"
+# Rows ANALYZE samples per index when refreshing the query planner's statistics, so it stays fast on big tables
+ANALYZE_ROW_LIMIT = int(os.getenv("ANALYZE_ROW_LIMIT", "2000"))
+
+# Schema migrations, applied in order. Each entry is (version, statements). Never edit a released migration;
+# add a new one instead.
+MIGRATIONS = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id TEXT PRIMARY KEY,
+            brand TEXT,
+            displayName TEXT,
+            inStockQuantity INTEGER,
+            orderableQuantity INTEGER,
+            listPrice REAL,
+            b2c_proof TEXT,
+            b2c_size TEXT,
+            stockStatus TEXT,
+            lastModifiedDate TEXT,
+            shippable BOOLEAN,
+            active BOOLEAN,
+            b2c_upc TEXT,
+            primaryFullImageURL TEXT,
+            url TEXT,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, [
+        # Append-only stock and price history. observed_at is a unix timestamp.
+        """
+        CREATE TABLE IF NOT EXISTS product_history (
+            product_id TEXT NOT NULL,
+            observed_at INTEGER NOT NULL,
+            inStockQuantity INTEGER,
+            orderableQuantity INTEGER,
+            listPrice REAL,
+            stockStatus TEXT,
+            PRIMARY KEY (product_id, observed_at)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_product_history_observed_at ON product_history (observed_at)",
+    ]),
+    (3, [
+        # Last run time of periodic maintenance tasks, so they run on schedule across one-shot runs too
+        """
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            name TEXT PRIMARY KEY,
+            last_run INTEGER NOT NULL
+        )
+        """,
+    ]),
+    (4, [
+        # Scope products and history by monitoring target. Existing rows belong to the 'default' target.
+        """
+        CREATE TABLE products_by_target (
+            target TEXT NOT NULL DEFAULT 'default',
+            id TEXT NOT NULL,
+            brand TEXT,
+            displayName TEXT,
+            inStockQuantity INTEGER,
+            orderableQuantity INTEGER,
+            listPrice REAL,
+            b2c_proof TEXT,
+            b2c_size TEXT,
+            stockStatus TEXT,
+            lastModifiedDate TEXT,
+            shippable BOOLEAN,
+            active BOOLEAN,
+            b2c_upc TEXT,
+            primaryFullImageURL TEXT,
+            url TEXT,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (target, id)
+        )
+        """,
+        """
+        INSERT INTO products_by_target (
+            target, id, brand, displayName, inStockQuantity, orderableQuantity, listPrice, b2c_proof, b2c_size,
+            stockStatus, lastModifiedDate, shippable, active, b2c_upc, primaryFullImageURL, url, last_updated
+        )
+        SELECT 'default', id, brand, displayName, inStockQuantity, orderableQuantity, listPrice, b2c_proof, b2c_size,
+               stockStatus, lastModifiedDate, shippable, active, b2c_upc, primaryFullImageURL, url, last_updated
+        FROM products
+        """,
+        "DROP TABLE products",
+        "ALTER TABLE products_by_target RENAME TO products",
+        """
+        CREATE TABLE product_history_by_target (
+            target TEXT NOT NULL DEFAULT 'default',
+            product_id TEXT NOT NULL,
+            observed_at INTEGER NOT NULL,
+            inStockQuantity INTEGER,
+            orderableQuantity INTEGER,
+            listPrice REAL,
+            stockStatus TEXT,
+            PRIMARY KEY (target, product_id, observed_at)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO product_history_by_target (
+            target, product_id, observed_at, inStockQuantity, orderableQuantity, listPrice, stockStatus
+        )
+        SELECT 'default', product_id, observed_at, inStockQuantity, orderableQuantity, listPrice, stockStatus
+        FROM product_history
+        """,
+        "DROP TABLE product_history",
+        "ALTER TABLE product_history_by_target RENAME TO product_history",
+        "CREATE INDEX IF NOT EXISTS idx_product_history_observed_at ON product_history (observed_at)",
+    ]),
+    (5, [
+        # Notifications already sent, so flapping or re-added products aren't announced again within the TTL
+        """
+        CREATE TABLE IF NOT EXISTS notification_ledger (
+            target TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            event TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            notified_at INTEGER NOT NULL,
+            PRIMARY KEY (target, product_id, event)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_notification_ledger_notified_at ON notification_ledger (notified_at)",
+    ]),
+    (6, [
+        # Unix time a product disappeared from its target's listing; NULL while it is live
+        "ALTER TABLE products ADD COLUMN removed_at INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_products_removed_at ON products (removed_at) WHERE removed_at IS NOT NULL",
+    ]),
+    (7, [
+        # Bumped by every write to a target's products, so catalog snapshots can tell they are out of date
+        """
+        CREATE TABLE IF NOT EXISTS sync_generations (
+            target TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL
+        )
+        """,
+    ]),
+    (8, [
+        # Secondary indexes for the query API, over live products only
+        "CREATE INDEX IF NOT EXISTS idx_products_brand ON products (brand COLLATE NOCASE) WHERE removed_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_products_display_name ON products (displayName COLLATE NOCASE) "
+        "WHERE removed_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_products_stock_status ON products (stockStatus, listPrice) "
+        "WHERE removed_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_products_list_price ON products (listPrice) WHERE removed_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_products_size ON products (b2c_size COLLATE NOCASE) WHERE removed_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_products_proof ON products (CAST(b2c_proof AS REAL)) WHERE removed_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_products_last_updated ON products (last_updated) WHERE removed_at IS NULL",
+        # Full-text index over names and brands, kept in sync with the products table by triggers
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            displayName, brand, content='products', content_rowid='rowid', prefix='2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, displayName, brand) VALUES (new.rowid, new.displayName, new.brand);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, displayName, brand)
+            VALUES ('delete', old.rowid, old.displayName, old.brand);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF displayName, brand ON products
+        WHEN old.displayName IS NOT new.displayName OR old.brand IS NOT new.brand BEGIN
+            INSERT INTO products_fts (products_fts, rowid, displayName, brand)
+            VALUES ('delete', old.rowid, old.displayName, old.brand);
+            INSERT INTO products_fts (rowid, displayName, brand) VALUES (new.rowid, new.displayName, new.brand);
+        END
+        """,
+        "INSERT INTO products_fts (products_fts) VALUES ('rebuild')",
+    ]),
+    (9, [
+        # Products missing from suspected partial listings, counted across runs until they are confirmed removed
+        """
+        CREATE TABLE IF NOT EXISTS removal_candidates (
+            target TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            missed_polls INTEGER NOT NULL,
+            PRIMARY KEY (target, product_id)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (10, [
+        # Composite (filter, sort) indexes for the query API, so an equality filter combined with a sort order
+        # reads its page in index order instead of sorting every match. Rows with equal keys are in rowid order,
+        # the query API's tie-breaker. (stockStatus, listPrice) already exists from migration 8. The target filter
+        # has too few values to be worth its own set; the query API scans the sort index for it instead.
+        f"CREATE INDEX IF NOT EXISTS idx_products_{filter_name}_by_{sort_name} ON products ({filter_column}, "
+        f"{sort_column}) WHERE removed_at IS NULL"
+        for filter_name, filter_column in (
+            ("brand", "brand COLLATE NOCASE"), ("stock_status", "stockStatus"), ("size", "b2c_size COLLATE NOCASE"),
+        )
+        for sort_name, sort_column in (
+            ("name", "displayName COLLATE NOCASE"), ("brand", "brand COLLATE NOCASE"), ("price", "listPrice"),
+            ("proof", "CAST(b2c_proof AS REAL)"), ("size", "b2c_size COLLATE NOCASE"), ("last_updated", "last_updated"),
+        )
+        if filter_column != sort_column and (filter_name, sort_name) != ("stock_status", "price")
+    ]),
+]
+
+# One long-lived connection per thread
+thread_connections = threading.local()
+
+
+def open_connection(db_path=None):
+    """
+    Opens a new tuned connection to the database.
+
+    WAL journal mode lets readers query while the poller writes, and synchronous=NORMAL is safe under WAL while
+    skipping the fsync on every commit.
+    """
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+                           cached_statements=DB_STATEMENT_CACHE_SIZE)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def get_connection():
+    """Returns this thread's long-lived connection to DB_PATH, opening it on first use."""
+    conn = getattr(thread_connections, "conn", None)
+    if conn is None or thread_connections.path != DB_PATH:
+        conn = open_connection(DB_PATH)
+        thread_connections.conn = conn
+        thread_connections.path = DB_PATH
+    return conn
+
+
+def close_connection():
+    """Closes this thread's long-lived connection, if one is open."""
+    conn = getattr(thread_connections, "conn", None)
+    if conn is not None:
+        conn.close()
+        thread_connections.conn = None
+
+
+def get_schema_version(conn):
+    """Returns the schema version recorded in the database, 0 for a database that predates migrations."""
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(conn):
+    """Applies every pending migration, each in its own transaction. Returns the resulting schema version."""
+    version = get_schema_version(conn)
+    migrated = False
+
+    for migration_version, statements in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute("INSERT INTO schema_version (version) VALUES (?)", (migration_version,))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        logging.info(f"Applied database migration {migration_version}.")
+        version = migration_version
+        migrated = True
+
+    # New indexes have no statistics yet; without them the planner can't tell a selective index from a broad one
+    if migrated:
+        analyze(conn)
+    return version
+
+
+def analyze(conn):
+    """Refreshes the query planner's statistics, sampling at most ANALYZE_ROW_LIMIT rows per index."""
+    conn.execute(f"PRAGMA analysis_limit = {ANALYZE_ROW_LIMIT}")
+    conn.execute("ANALYZE")
+    conn.commit()
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import queue
+import socket
+import logging
+import threading
+from dotenv import load_dotenv
+from metrics import metrics
+from product_diff import diff_product, TRANSITION_TYPES
+
+load_dotenv()  # Load environment variables
+
+# Event sinks, each enabled by setting its target: an append-only JSON-lines file, a local HTTP webhook that
+# receives one POST per event, and a Unix stream socket that receives one JSON line per event
+EVENTS_FILE = os.getenv("EVENTS_FILE")
+EVENTS_WEBHOOK_URL = os.getenv("EVENTS_WEBHOOK_URL")
+EVENTS_SOCKET_PATH = os.getenv("EVENTS_SOCKET_PATH")
+# Events buffered per sink before new ones are dropped, and the webhook/socket timeout in seconds
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "1000"))
+EVENTS_SINK_TIMEOUT = float(os.getenv("EVENTS_SINK_TIMEOUT", "5"))
+# Most events a sink worker takes off its buffer per write
+EVENTS_BATCH_SIZE = 100
+
+EVENT_TYPES = ("new", "changed", "removed") + TRANSITION_TYPES
+# Product fields included in every event
+EVENT_PRODUCT_FIELDS = [
+    "brand", "displayName", "inStockQuantity", "orderableQuantity", "listPrice", "b2c_proof", "b2c_size",
+    "stockStatus", "lastModifiedDate", "shippable", "active", "b2c_upc", "primaryFullImageURL", "url"
+]
+
+
+def product_snapshot(product):
+    """Returns the event fields of a product as a dict."""
+    return {field: getattr(product, field, None) for field in EVENT_PRODUCT_FIELDS}
+
+
+def build_event(event_type, target, product_id, product=None, diff=None, timestamp=None):
+    """Builds one event dict. product is a dict of fields and diff a {field: {"old", "new"}} dict, both optional."""
+    return {
+        "type": event_type,
+        "target": target,
+        "product_id": product_id,
+        "timestamp": timestamp or time.time(),
+        "product": product,
+        "diff": diff or {},
+    }
+
+
+def build_change_events(target, new_products, changed_products, existing_products, removed_products=(),
+                        timestamp=None):
+    """
+    Builds the events of one sync.
+
+    Every new product gives a "new" event. A changed product gives a "changed" event with its field diff if a
+    field of "notify" significance changed, plus a "restock", "sell_out", "price_drop", "price_raise" or
+    "status_change" event for each transition the diff engine finds. Every removed product (a namespace of its
+    last stored fields) gives a "removed" event.
+    """
+    timestamp = timestamp or time.time()
+    events = [build_event("new", target, product.id, product_snapshot(product), timestamp=timestamp)
+              for product in new_products]
+
+    for product in changed_products:
+        change = diff_product(existing_products[product.id], product)
+        snapshot = product_snapshot(product)
+        if change.notify:
+            events.append(build_event("changed", target, product.id, snapshot, change.diff, timestamp))
+        for event_type, diff in change.transitions:
+            events.append(build_event(event_type, target, product.id, snapshot, diff, timestamp))
+
+    for product in removed_products:
+        fields = {field: value for field, value in vars(product).items() if field != "id"}
+        events.append(build_event("removed", target, product.id, fields, timestamp=timestamp))
+
+    return events
+
+
+class EventSink:
+    """
+    Base class of a buffered event sink.
+
+    emit() never blocks: events go into a bounded buffer drained by a background worker, and when the buffer is
+    full new events are dropped and counted, so a slow consumer can't stall polling. Subclasses implement
+    write(events) for a batch of events.
+    """
+
+    name = "sink"
+
+    def __init__(self, buffer_size=EVENTS_BUFFER_SIZE):
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.worker = None
+        self.lock = threading.Lock()
+        self.dropping = False
+
+    def start(self):
+        """Starts the background worker if it isn't running."""
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, name=f"events-{self.name}", daemon=True)
+                self.worker.start()
+
+    def emit(self, event):
+        """Buffers an event for the worker. Returns False if the buffer was full and the event was dropped."""
+        self.start()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            metrics.inc("events_dropped_total", sink=self.name)
+            if not self.dropping:
+                logging.warning(f"The {self.name} event sink is falling behind. Dropping events.")
+                self.dropping = True
+            return False
+        self.dropping = False
+        return True
+
+    def flush(self, timeout=None):
+        """Waits until every buffered event has been handled. Returns False if the timeout expired first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def write(self, events):
+        """Delivers a batch of events."""
+        raise NotImplementedError
+
+    def run(self):
+        """Worker loop: drains the buffer forever, in batches of up to EVENTS_BATCH_SIZE."""
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < EVENTS_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+                metrics.inc("events_total", len(batch), sink=self.name, result="sent")
+            except Exception as e:
+                metrics.inc("events_total", len(batch), sink=self.name, result="failed")
+                logging.error(f"Could not deliver {len(batch)} events to the {self.name} sink: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+
+class JsonlFileSink(EventSink):
+    """Appends events to a JSON-lines file."""
+
+    name = "jsonl"
+
+    def __init__(self, path, buffer_size=EVENTS_BUFFER_SIZE):
+        super().__init__(buffer_size)
+        self.path = path
+
+    def write(self, events):
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(event, default=str) + "\n" for event in events))
+
+
+class WebhookSink(EventSink):
+    """POSTs each event as JSON to an HTTP endpoint over a keep-alive session."""
+
+    name = "webhook"
+
+    def __init__(self, url, timeout=EVENTS_SINK_TIMEOUT, buffer_size=EVENTS_BUFFER_SIZE):
+        import requests
+
+        super().__init__(buffer_size)
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def write(self, events):
+        for event in events:
+            response = self.session.post(self.url, data=json.dumps(event, default=str),
+                                         headers={"Content-Type": "application/json"}, timeout=self.timeout)
+            response.raise_for_status()
+
+
+class UnixSocketSink(EventSink):
+    """Writes events as JSON lines to a Unix stream socket, reconnecting after the listener goes away."""
+
+    name = "socket"
+
+    def __init__(self, path, timeout=EVENTS_SINK_TIMEOUT, buffer_size=EVENTS_BUFFER_SIZE):
+        super().__init__(buffer_size)
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+
+    def write(self, events):
+        data = "".join(json.dumps(event, default=str) + "\n" for event in events).encode("utf-8")
+        try:
+            if self.sock is None:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(self.timeout)
+                self.sock.connect(self.path)
+            self.sock.sendall(data)
+        except OSError:
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            raise
+
+
+class EventDispatcher:
+    """Fans events out to every configured sink."""
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+
+    def emit(self, events):
+        """Hands each event to every sink without blocking."""
+        for event in events:
+            for sink in self.sinks:
+                sink.emit(event)
+
+    def flush(self, timeout=None):
+        """Waits for every sink to drain, sharing the timeout between them. Returns False if any timed out."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        flushed = True
+        for sink in self.sinks:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            flushed = sink.flush(remaining) and flushed
+        return flushed
+
+
+def create_event_dispatcher():
+    """Creates a dispatcher with a sink for each of EVENTS_FILE, EVENTS_WEBHOOK_URL and EVENTS_SOCKET_PATH that is set."""
+    sinks = []
+    if EVENTS_FILE:
+        sinks.append(JsonlFileSink(EVENTS_FILE))
+    if EVENTS_WEBHOOK_URL:
+        sinks.append(WebhookSink(EVENTS_WEBHOOK_URL))
+    if EVENTS_SOCKET_PATH:
+        sinks.append(UnixSocketSink(EVENTS_SOCKET_PATH))
+    return EventDispatcher(sinks)
+
+
+# Process-wide event dispatcher
+event_dispatcher = create_event_dispatcher()
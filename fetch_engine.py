@@ -0,0 +1,165 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from functools import partial
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from metrics import metrics
+
+load_dotenv()  # Load environment variables
+
+# Blocking TLS requests run on a bounded pool of this many threads, each with its own per-request timeout
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "16"))
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "30"))
+# Retry backoff grows exponentially from the request's base delay up to this cap, with jitter
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60"))
+# Consecutive failures after which a host's circuit opens, and how long it stays open before a trial request
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "60"))
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is refused because the host's circuit is open."""
+
+
+def backoff_delay(attempt, base_delay, factor=2, max_delay=RETRY_MAX_DELAY):
+    """
+    Returns the delay before retry number attempt (0 for the first retry).
+
+    The ceiling grows as base_delay * factor ** attempt up to max_delay. Half of the ceiling is fixed and half is
+    random, so retries from concurrent fetches spread out while every retry still waits longer than the last one
+    did on average.
+    """
+    ceiling = min(max_delay, base_delay * factor ** attempt)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures against one host.
+
+    After failure_threshold failures in a row the circuit opens and requests are refused for reset_timeout
+    seconds. Then a single trial request is let through (half open): a success closes the circuit, a failure
+    opens it again.
+    """
+
+    def __init__(self, host, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if a request to the host may go out now."""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                logging.info(f"Circuit for {self.host} is half open. Sending a trial request.")
+                return True
+            return False
+
+    def record_success(self):
+        """Closes the circuit after a successful request."""
+        with self.lock:
+            if self.state != "closed":
+                logging.info(f"Circuit for {self.host} closed.")
+            self.state = "closed"
+            self.failures = 0
+        metrics.set("circuit_open", 0, host=self.host)
+
+    def record_failure(self):
+        """Counts a failed request, opening the circuit at the threshold or when a trial request fails."""
+        with self.lock:
+            self.failures += 1
+            opened = self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold)
+            if opened:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+        if opened:
+            metrics.set("circuit_open", 1, host=self.host)
+            metrics.inc("circuit_opened_total", host=self.host)
+            logging.warning(
+                f"Circuit for {self.host} opened after {self.failures} consecutive failures. "
+                f"Refusing requests for {self.reset_timeout:.0f} seconds."
+            )
+
+
+class FetchEngine:
+    """
+    Runs fetch coroutines on a shared event loop in a background thread.
+
+    Blocking tls_client calls are pushed to a bounded thread pool with a per-request timeout, so retry waits are
+    asyncio sleeps that hold neither a worker thread nor the caller's other fetches. Synchronous code submits a
+    coroutine with run() and blocks only its own thread until the result is ready.
+    """
+
+    def __init__(self, workers=FETCH_WORKERS, timeout=REQUEST_TIMEOUT):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.executor = None
+        self.loop = None
+        self.thread = None
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Starts the event loop thread, if it isn't running yet."""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fetch")
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name="fetch-engine", daemon=True)
+                self.thread.start()
+
+    def run(self, coro):
+        """Runs a coroutine on the engine's loop and returns its result. Must not be called from the loop itself."""
+        self.start()
+        if threading.current_thread() is self.thread:
+            coro.close()
+            raise RuntimeError("FetchEngine.run() called from the fetch engine's own loop. Await the coroutine instead.")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def breaker(self, url):
+        """Returns the circuit breaker of the URL's host."""
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(host)
+            return self.breakers[host]
+
+    async def get(self, session, url, headers=None, timeout=None):
+        """
+        Sends a GET through the session on the worker pool. Raises CircuitOpenError without sending anything if
+        the host's circuit is open, and asyncio.TimeoutError if no response arrived within the timeout.
+        """
+        if not self.breaker(url).allow():
+            raise CircuitOpenError(f"Circuit for {urlsplit(url).netloc} is open.")
+        timeout = timeout or self.timeout
+        request = partial(session.get, url, headers=headers, timeout_seconds=int(timeout))
+        # tls_client enforces the timeout itself; the margin only catches a call that hangs past it
+        return await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(self.executor, request),
+                                      timeout + 5)
+
+    def close(self):
+        """Stops the event loop and the worker pool."""
+        with self.lock:
+            if self.thread is None:
+                return
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.executor.shutdown(wait=False)
+            self.thread = None
+
+
+# Process-wide fetch engine shared by every target
+fetch_engine = FetchEngine()
@@ -0,0 +1,124 @@
+import json
+import hashlib
+import logging
+
+
+def hash_content(content):
+    """Returns a stable hash of a response body (bytes or str)."""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content or b"").hexdigest()
+
+
+def hash_pages(responses):
+    """Returns a stable hash of the bodies of a listing's page responses, in order."""
+    digest = hashlib.sha256()
+    for resp in responses:
+        digest.update(resp.content or b"")
+    return digest.hexdigest()
+
+
+def hash_stock_items(stock_items):
+    """Returns a stable hash of the merged stock items."""
+    return hash_content(json.dumps(stock_items, sort_keys=True, separators=(",", ":")))
+
+
+class IncrementalFetchState:
+    """
+    Remembers what the previous poll saw so the next one can skip work.
+
+    It keeps the ETag/Last-Modified validators and body hash of the product response, the hash of the stock
+    items, and the validated model of every product keyed by id together with its lastModifiedDate. Items whose
+    lastModifiedDate hasn't moved reuse the cached model instead of being validated again.
+
+    A listing spread over several pages is compared by the hash of all its pages. Its first page's validators
+    say nothing about the others, so no conditional headers are sent for it.
+    """
+
+    def __init__(self):
+        self.etag = None
+        self.last_modified = None
+        self.body_hash = None
+        self.stock_hash = None
+        self.paginated = False
+        self.products = {}
+
+    def request_headers(self):
+        """Returns the conditional request headers for the product fetch. Empty until a page has been cached."""
+        if not self.products or self.paginated:
+            return None
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers or None
+
+    def page_unchanged(self, resp, extra_pages=()):
+        """
+        Returns True if the product response is a 304 or has the same body as the previous poll. Pass the
+        listing's other pages as extra_pages; the first page alone never matches a paginated listing.
+        """
+        if not self.products or (self.paginated and not extra_pages):
+            return False
+        if resp.status_code == 304:
+            return True
+        return hash_pages([resp, *extra_pages]) == self.body_hash
+
+    def remember_page(self, resp, extra_pages=()):
+        """Stores the validators and body hash of a product response, and its other pages, that were processed."""
+        headers = {key.lower(): value for key, value in (resp.headers or {}).items()}
+        self.etag = headers.get("etag")
+        self.last_modified = headers.get("last-modified")
+        self.body_hash = hash_pages([resp, *extra_pages])
+        self.paginated = bool(extra_pages)
+
+    def validate_items(self, items, validate_batch):
+        """
+        Validates the raw items, reusing cached models for items whose lastModifiedDate didn't move.
+
+        validate_batch takes the list of items that need validating and returns their models. Returns the product
+        list (fresh copies, so stock merged into a previous poll's objects can't leak) and the number of items
+        that had to be validated.
+        """
+        products = {}
+        to_validate = []
+
+        for item in items:
+            cached = self.products.get(item.get("id"))
+            if cached is not None and cached.lastModifiedDate == item.get("lastModifiedDate"):
+                products[cached.id] = cached
+            else:
+                to_validate.append(item)
+
+        for product in validate_batch(to_validate) if to_validate else []:
+            products[product.id] = product
+
+        self.products = products
+        logging.debug(
+            f"Validated {len(to_validate)} of {len(items)} items; the rest were unchanged since the last poll."
+        )
+        return self.cached_products(), len(to_validate)
+
+    def remember_products(self, products):
+        """Caches products validated elsewhere (by the parallel pipeline) for the next poll. Returns fresh copies."""
+        self.products = {product.id: product for product in products}
+        return self.cached_products()
+
+    def cached_products(self):
+        """Returns fresh copies of the cached product models."""
+        return [product.model_copy() for product in self.products.values()]
+
+    def invalidate(self):
+        """Forgets the hashes so the next poll runs the full pipeline, e.g. after a failed DB sync."""
+        self.body_hash = None
+        self.stock_hash = None
+        self.etag = None
+        self.last_modified = None
+
+    def stock_unchanged(self, stock_data):
+        """Records the stock hash and returns True if it matches the previous poll."""
+        stock_hash = hash_stock_items(stock_data["items"]) if stock_data else None
+        unchanged = stock_hash is not None and stock_hash == self.stock_hash
+        self.stock_hash = stock_hash
+        return unchanged
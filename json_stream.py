@@ -0,0 +1,124 @@
+import json
+from itertools import islice
+
+decoder = json.JSONDecoder()
+WHITESPACE = " \t\n\r"
+
+
+def skip_whitespace(text, index):
+    """Returns the index of the next non-whitespace character."""
+    while index < len(text) and text[index] in WHITESPACE:
+        index += 1
+    return index
+
+
+def expect(text, index, char):
+    """Skips whitespace and checks that the next character is char. Returns the index just after it."""
+    index = skip_whitespace(text, index)
+    if index >= len(text) or text[index] != char:
+        found = text[index] if index < len(text) else "end of input"
+        raise ValueError(f"Expected {char!r} at position {index}, found {found!r}")
+    return index + 1
+
+
+class ArrayReader:
+    """
+    Iterates over the elements of the JSON array that starts at text[index], decoding one element at a time.
+    Once it has been read to the end, end is the index just after the array.
+    """
+
+    def __init__(self, text, index):
+        self.text = text
+        self.index = index
+        self.end = None
+
+    def __iter__(self):
+        text = self.text
+        index = skip_whitespace(text, self.index + 1)
+        if index < len(text) and text[index] == "]":
+            self.end = index + 1
+            return
+        while True:
+            item, index = decoder.raw_decode(text, skip_whitespace(text, index))
+            yield item
+            index = skip_whitespace(text, index)
+            if index < len(text) and text[index] == "]":
+                self.end = index + 1
+                return
+            index = expect(text, index, ",")
+
+
+def iter_json_members(text, key="items"):
+    """
+    Yields (name, value) for each member of the top-level object.
+
+    If the key member is an array, its value is an ArrayReader instead of a list, so its elements can be decoded
+    one at a time. The members after it are read once the reader is exhausted (by the caller or, if the caller
+    didn't, by this generator). Raises ValueError on malformed JSON or if the top-level value isn't an object.
+    """
+    index = expect(text, 0, "{")
+    index = skip_whitespace(text, index)
+    if index < len(text) and text[index] == "}":
+        return
+
+    while True:
+        index = skip_whitespace(text, index)
+        name, index = decoder.raw_decode(text, index)
+        index = skip_whitespace(text, expect(text, index, ":"))
+
+        if name == key and index < len(text) and text[index] == "[":
+            reader = ArrayReader(text, index)
+            yield name, reader
+            if reader.end is None:
+                for _ in reader:
+                    pass
+            index = reader.end
+        else:
+            value, index = decoder.raw_decode(text, index)
+            yield name, value
+
+        index = skip_whitespace(text, index)
+        if index < len(text) and text[index] == "}":
+            return
+        index = expect(text, index, ",")
+
+
+def iter_json_items(text, key="items"):
+    """
+    Yields the elements of the top-level object's key array one at a time.
+
+    Only one element is decoded into Python objects at a time, so a large response costs its text plus one item
+    instead of the whole decoded tree. The other top-level values are decoded and discarded as they are passed.
+    Raises ValueError on malformed JSON or if the top-level value isn't an object. Yields nothing if the key is
+    missing or isn't an array.
+    """
+    for name, value in iter_json_members(text, key):
+        if name == key and isinstance(value, ArrayReader):
+            yield from value
+            # Nothing after the array matters
+            return
+
+
+def json_page_info(text, key="items"):
+    """
+    Returns the top-level members other than key as a dict, and the length of the key array. The array is
+    decoded one element at a time and its elements are discarded.
+    """
+    fields = {}
+    count = 0
+    for name, value in iter_json_members(text, key):
+        if name == key and isinstance(value, ArrayReader):
+            count = sum(1 for _ in value)
+        else:
+            fields[name] = value
+    return fields, count
+
+
+def iter_batches(iterable, size):
+    """Yields lists of up to size consecutive elements."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
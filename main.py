@@ -1,32 +1,52 @@
-import tls_client
 import os
+import asyncio
+import argparse
+import signal
 from dotenv import load_dotenv
 import logging
-import colorlog
 from logging.handlers import RotatingFileHandler
 import time
-from pydantic import ValidationError
-from models import ItemModel
-import requests
+import threading
+from itertools import chain
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from models import validate_products
 from db import *
-from telegram import Bot
+from fetch_engine import fetch_engine, backoff_delay, CircuitOpenError
+from proxy_pool import ProxyPool, load_proxy_file, PROXY_ROTATE_EACH_REQUEST
+from incremental import IncrementalFetchState
+from session_pool import SessionPool
+from snapshot import snapshot_cache
+from parallel import parallel_pipeline
+from json_stream import iter_json_items, iter_batches, json_page_info
+from pagination import (page_url, remaining_page_offsets, unique_items, PRODUCT_PAGE_SIZE, PAGE_FETCH_WORKERS,
+                        PAGE_FETCH_RETRIES)
+from metrics import metrics, start_metrics_server
+from scheduler import AdaptiveScheduler, is_hot_product, POLL_INTERVAL, POLL_INTERVAL_MIN, POLL_INTERVAL_MAX
+from targets import load_targets, default_target
 
 # Load environment variables from .env file
 load_dotenv()
 # Access the environment variables
-PRODUCT_URL = os.getenv("PRODUCT_URL")
-STOCK_URL = os.getenv("STOCK_URL")
 LOG_FILE_PATH = os.getenv("LOG_FILE_PATH")
 PROXY_FILE_PATH = os.getenv("PROXY_FILE_PATH")
-
-# Initialize the Telegram Bot
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
-# tmp_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getUpdates"
-# tmp = requests.get(tmp_url).json()
+# "lean" validates only the fields the database and notifications use; "full" validates the complete ItemModel
+VALIDATION_MODE = os.getenv("VALIDATION_MODE", "lean").lower()
+# Stock requests are split into chunks of this many product IDs, fetched concurrently
+STOCK_CHUNK_SIZE = int(os.getenv("STOCK_CHUNK_SIZE", "100"))
+STOCK_FETCH_WORKERS = int(os.getenv("STOCK_FETCH_WORKERS", "4"))
+STOCK_CHUNK_RETRIES = int(os.getenv("STOCK_CHUNK_RETRIES", "1"))
+# When set, product responses are parsed incrementally and run through validation, stock and the DB sync in
+# batches of this many items, so memory no longer grows with the catalog. 0 processes the whole page at once.
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "0"))
+# Seconds to wait for queued notifications to go out before exiting
+NOTIFICATION_FLUSH_TIMEOUT = float(os.getenv("NOTIFICATION_FLUSH_TIMEOUT", "120"))
 
 
 def initialize_logging():
     """Configures the logging setup to log to both console and file with rotation."""
+    import colorlog
+
     os.makedirs(os.path.dirname(LOG_FILE_PATH), exist_ok=True)
     log_formatter = colorlog.ColoredFormatter(
         "%(log_color)s%(asctime)s - %(levelname)s - %(message)s",
@@ -49,27 +69,15 @@ def initialize_logging():
 
 
 def handle_proxies(file_path):
-    """Handles loading, validating, and saving proxies."""
-    valid_proxies = []
+    """Handles loading, validating, and saving proxies. Returns a ProxyPool of the valid proxies."""
+    proxies = load_proxy_file(file_path)
+    if not proxies:
+        return None
 
-    # Load proxies from the file
-    try:
-        with open(file_path, 'r') as f:
-            proxies = [line.strip() for line in f.readlines() if line.strip()]
-    except FileNotFoundError:
-        logging.error(f"Proxy file {file_path} not found.")
-        return []
-
-    # Validate each proxy
-    for proxy in proxies:
-        try:
-            response = requests.get('https://httpbin.org/ip', proxies={"http": proxy, "https": proxy}, timeout=10)
-            if response.status_code == 200:
-                valid_proxies.append(proxy)
-            else:
-                logging.warning(f"Proxy {proxy} failed with status code {response.status_code}")
-        except requests.RequestException as e:
-            logging.error(f"Error with proxy {proxy}: {e}")
+    # Validate the proxies concurrently, reusing persisted scores that are still fresh
+    proxy_pool = ProxyPool(proxies)
+    with metrics.timer("proxy_validation"):
+        valid_proxies = proxy_pool.check_all()
 
     # Save only the valid proxies back to the file
     with open(file_path, 'w') as f:
@@ -78,70 +86,239 @@ def handle_proxies(file_path):
 
     logging.info(f"Proxy file updated. {len(valid_proxies)} valid proxies remaining.")
 
-    return valid_proxies
+    return proxy_pool
+
+
+def new_tls_session(client_identifier="chrome_120"):
+    """Creates a bare TLS client session with the given client identifier."""
+    with metrics.timer("session_creation"):
+        # tls_client loads a native library, so it is only imported once a session is needed
+        import tls_client
+        return tls_client.Session(client_identifier=client_identifier, random_tls_extension_order=True)
 
 
-def create_session():
+def create_session(proxy_pool=None):
     """Creates a session with TLS client and configures proxy if available."""
-    session = tls_client.Session(client_identifier="chrome_120", random_tls_extension_order=True)
+    session = new_tls_session()
 
-    if not PROXY_FILE_PATH:
-        logging.debug("PROXY_FILE environment variable is not set. Running without a proxy.")
+    if proxy_pool is None:
+        logging.debug("No proxy pool available. Running without a proxy.")
         return session
 
-    proxies = handle_proxies(PROXY_FILE_PATH)
-
-    if proxies:
-        session.proxies.update({"http": proxies[0], "https": proxies[0]})
-        logging.info(f"Using proxy: {proxies[0]}")
+    proxy = proxy_pool.apply(session)
+    if proxy:
+        logging.info(f"Using proxy: {proxy}")
     else:
         logging.debug("No valid proxies found. Running without a proxy.")
 
     return session
 
 
-def api_request(session: tls_client.Session, url, max_retries=3, delay=5, backoff_factor=2):
-    """Fetches API data with retry logic for handling slow responses and specific HTTP status codes."""
+def create_proxy_pool():
+    """Creates the proxy pool from PROXY_FILE_PATH, or returns None if no proxy file is configured."""
+    if not PROXY_FILE_PATH:
+        logging.debug("PROXY_FILE environment variable is not set. Running without a proxy.")
+        return None
+    return handle_proxies(PROXY_FILE_PATH)
+
+
+# Long-lived TLS sessions per target and stock worker, persisted between runs
+session_pool = SessionPool(new_tls_session)
+
+
+def get_target_session(target, proxy_pool=None):
+    """Returns the target's pooled session, restoring it from the previous run or creating it on first use."""
+    return session_pool.acquire(target.name, proxy_pool)
+
+
+def close_target_sessions():
+    """Saves the state of the pooled sessions and closes them."""
+    session_pool.close()
+
+
+def rotate_proxy(session, proxy_pool, failed=True):
+    """Moves the session to the next healthy proxy, recording a failure against the current one."""
+    current_proxy = session.proxies.get("http")
+    if failed and current_proxy:
+        proxy_pool.report_failure(current_proxy)
+    next_proxy = proxy_pool.apply(session)
+    if failed and next_proxy:
+        logging.info(f"Rotated to proxy: {next_proxy}")
+
+
+def tls_client_error():
+    """Returns tls_client's exception class. tls_client is always loaded by then, since a session exists."""
+    from tls_client.exceptions import TLSClientExeption
+    return TLSClientExeption
+
+
+async def api_request_async(session: "tls_client.Session", url, max_retries=3, delay=5, backoff_factor=2,
+                            proxy_pool=None, headers=None, raw=False):
+    """
+    Fetches API data with retry logic for handling slow responses and specific HTTP status codes.
+
+    Requests go through the fetch engine with a per-request timeout, and retries wait delay * backoff_factor **
+    attempt seconds (capped at RETRY_MAX_DELAY, with jitter) on the engine's loop instead of blocking a thread.
+    Timeouts, connection errors and 5xx responses count against the host's circuit breaker, and while the
+    circuit is open the request fails fast. With a proxy_pool, the session is moved to another healthy proxy
+    after a 403/503 or connection error (or before every request when PROXY_ROTATE_EACH_REQUEST is set) and the
+    proxy's score is updated with the outcome. Extra request headers can be passed, and with raw=True the
+    response object is returned (for 2xx and 304 responses) instead of the decoded JSON.
+    """
+    endpoint = urlsplit(url).path
+    breaker = fetch_engine.breaker(url)
     for attempt in range(max_retries):
+        if attempt:
+            metrics.inc("api_retries_total", endpoint=endpoint)
+        retry_delay = backoff_delay(attempt, delay, backoff_factor)
+        resp = None
         try:
+            if proxy_pool and PROXY_ROTATE_EACH_REQUEST:
+                rotate_proxy(session, proxy_pool, failed=False)
             logging.debug(f"Fetching data from {url}... (Attempt {attempt + 1})")
-            resp = session.get(url)
+            request_start = time.perf_counter()
+            resp = await fetch_engine.get(session, url, headers=headers)
+            if resp.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            metrics.observe("request_seconds", time.perf_counter() - request_start, endpoint=endpoint)
+            metrics.inc("requests_total", endpoint=endpoint, status=resp.status_code)
+            session_pool.report(session, resp.status_code, proxy_pool)
 
             # Check if the response status code is in the 2xx range (success)
             if 200 <= resp.status_code < 300:
+                if proxy_pool and session.proxies.get("http"):
+                    proxy_pool.report_success(session.proxies["http"], time.perf_counter() - request_start)
+                if raw:
+                    return resp
                 try:
                     return resp.json()  # Ensure response is valid JSON
                 except ValueError:
                     logging.error(f"Failed to decode JSON response. Response Text: {resp.text}")
                     return None
+            elif resp.status_code == 304 and raw:  # Not Modified since the validators we sent
+                return resp
             elif resp.status_code == 503:  # Service Unavailable
-                logging.warning(f"Service unavailable (503). Retrying in {delay} seconds...")
-                time.sleep(delay)
+                logging.warning(f"Service unavailable (503). Retrying in {retry_delay:.1f} seconds...")
+                if proxy_pool:
+                    rotate_proxy(session, proxy_pool)
             elif resp.status_code == 403:  # Forbidden
+                if proxy_pool and proxy_pool.healthy_proxies():
+                    logging.warning("Access forbidden (403). Rotating proxy and retrying...")
+                    rotate_proxy(session, proxy_pool)
+                    continue
                 logging.error(f"Access forbidden (403). Check your proxy settings or permissions.")
                 break
             else:
                 logging.error(f"Received non-success status code {resp.status_code}. Retrying...")
 
-        except requests.exceptions.Timeout:
-            logging.error(f"Timeout error while accessing {url}. Retrying in {delay} seconds...")
-            time.sleep(delay)
-        except requests.exceptions.ConnectionError:
-            logging.error(f"Connection error while accessing {url}. Retrying in {delay} seconds...")
-            time.sleep(delay)
+        except CircuitOpenError as e:
+            metrics.inc("requests_total", endpoint=endpoint, status="circuit_open")
+            logging.error(f"{e} Not fetching {url}.")
+            return None
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            metrics.inc("requests_total", endpoint=endpoint, status="timeout")
+            logging.error(f"Timeout error while accessing {url}. Retrying in {retry_delay:.1f} seconds...")
+        except tls_client_error() as e:
+            # tls_client reports timeouts and connection failures alike as TLSClientExeption
+            breaker.record_failure()
+            status = "timeout" if "timeout" in str(e).lower() or "deadline" in str(e).lower() else "connection_error"
+            metrics.inc("requests_total", endpoint=endpoint, status=status)
+            logging.error(f"Request to {url} failed ({status}): {e}. Retrying in {retry_delay:.1f} seconds...")
+            if proxy_pool:
+                rotate_proxy(session, proxy_pool)
         except Exception as e:
+            # A request that failed without a response still has to release a half open circuit's trial slot
+            if resp is None:
+                breaker.record_failure()
+            metrics.inc("requests_total", endpoint=endpoint, status="error")
             logging.error(f"Unexpected error while accessing {url}: {e}")
-            if attempt < max_retries - 1:
-                logging.warning(f"Attempt {attempt + 1} failed. Retrying in {delay} seconds...")
-                time.sleep(delay * backoff_factor)
+
+        if attempt < max_retries - 1:
+            await asyncio.sleep(retry_delay)
 
     logging.error("Max retries reached. Exiting.")
     return None
 
 
-def fetch_stock_data(session, product_data, stock_url):
-    """Fetches stock data for products based on product IDs in the product data."""
-    """product data is a json response from the api."""
+def api_request(session: "tls_client.Session", url, max_retries=3, delay=5, backoff_factor=2, proxy_pool=None,
+                headers=None, raw=False):
+    """Runs api_request_async on the fetch engine and waits for the result. See api_request_async."""
+    return fetch_engine.run(
+        api_request_async(session, url, max_retries, delay, backoff_factor, proxy_pool, headers, raw)
+    )
+
+
+async def gather_with_worker_sessions(session, jobs, fetch, workers, retries, kind, proxy_pool=None):
+    """
+    Runs fetch(worker_session, job) for every job concurrently on the fetch engine, at most workers at a time, each
+    on its own session and proxy. Jobs whose fetch returned None are retried on their own for retries more rounds.
+    Returns {job index: result} for the jobs that succeeded.
+
+    A pooled caller session gets long-lived worker sessions from the session pool, keyed by its pool key and kind;
+    otherwise they only live for this call.
+    """
+    pool_key = getattr(session, "pool_key", None)
+    worker_count = min(workers, len(jobs))
+    if pool_key:
+        worker_sessions = [session_pool.acquire(f"{pool_key}/{kind}-{i}", proxy_pool) for i in range(worker_count)]
+    else:
+        worker_sessions = [create_session(proxy_pool) for _ in range(worker_count)]
+    idle_sessions = asyncio.Queue()
+    for worker_session in worker_sessions:
+        idle_sessions.put_nowait(worker_session)
+
+    async def fetch_with_worker_session(job):
+        worker_session = await idle_sessions.get()
+        try:
+            return await fetch(worker_session, job)
+        finally:
+            idle_sessions.put_nowait(worker_session)
+
+    results = {}
+    pending = list(range(len(jobs)))
+    try:
+        for round_number in range(1 + retries):
+            if round_number:
+                logging.warning(f"Retrying {len(pending)} failed {kind} fetches (round {round_number}).")
+            job_results = await asyncio.gather(*(fetch_with_worker_session(jobs[index]) for index in pending))
+            for index, result in zip(pending, job_results):
+                if result is not None:
+                    results[index] = result
+            pending = [index for index in pending if index not in results]
+            if not pending:
+                break
+    finally:
+        if not pool_key:
+            for worker_session in worker_sessions:
+                worker_session.close()
+    return results
+
+
+async def fetch_stock_chunk(session, stock_url, product_ids, proxy_pool=None):
+    """Fetches the stock data for one chunk of product IDs. Returns the chunk's stock items, or None on failure."""
+    stock_data = await api_request_async(session, f"{stock_url},{','.join(product_ids)}", proxy_pool=proxy_pool)
+
+    # Handle missing or malformed stock data
+    if stock_data is None:
+        return None
+    elif not isinstance(stock_data.get("items"), list):
+        logging.error("No 'items' found in the stock data response or invalid format.")
+        return None
+    return stock_data["items"]
+
+
+async def fetch_stock_data_async(session, product_data, stock_url, proxy_pool=None):
+    """
+    Fetches stock data for products based on product IDs in the product data.
+
+    product_data is a json response from the api. The IDs are split into STOCK_CHUNK_SIZE chunks that are fetched
+    concurrently on the fetch engine, at most STOCK_FETCH_WORKERS at a time, each on its own session and proxy.
+    Failed chunks are retried on their own for STOCK_CHUNK_RETRIES more rounds, and whatever succeeded is merged
+    into one response.
+    """
 
     # Fetch stock data for products
     product_ids = [item["id"] for item in product_data.get("items", [])]
@@ -151,83 +328,535 @@ def fetch_stock_data(session, product_data, stock_url):
         return None  # Return None if no product IDs are available
 
     logging.debug(f"Successfully parsed {len(product_ids)} Product IDs.")
-    stock_url_current = f"{stock_url},{','.join(product_ids)}"
-    stock_data = api_request(session, stock_url_current)
+    chunks = [product_ids[i:i + STOCK_CHUNK_SIZE] for i in range(0, len(product_ids), STOCK_CHUNK_SIZE)]
 
-    # Handle missing or malformed stock data
-    if stock_data is None:
+    # A single chunk goes through the caller's session, as before
+    if len(chunks) == 1:
+        chunk_items = await fetch_stock_chunk(session, stock_url, chunks[0], proxy_pool)
+        if chunk_items is None:
+            logging.error("Failed to retrieve stock data!")
+            return None
+        logging.debug("Stock data successfully retrieved.")
+        return {"items": chunk_items}
+
+    def fetch_chunk(worker_session, chunk):
+        return fetch_stock_chunk(worker_session, stock_url, chunk, proxy_pool)
+
+    results = await gather_with_worker_sessions(session, chunks, fetch_chunk, STOCK_FETCH_WORKERS,
+                                                STOCK_CHUNK_RETRIES, "stock", proxy_pool)
+    pending = [index for index in range(len(chunks)) if index not in results]
+
+    if not results:
         logging.error("Failed to retrieve stock data!")
         return None
-    elif not isinstance(stock_data.get("items"), list):
-        logging.error("No 'items' found in the stock data response or invalid format.")
-        return None
+    if pending:
+        missing = sum(len(chunks[index]) for index in pending)
+        logging.error(f"{len(pending)} of {len(chunks)} stock chunks failed. Stock is unavailable for {missing} products.")
+
+    logging.debug(f"Stock data retrieved in {len(results)} chunks.")
+    return {"items": [item for index in sorted(results) for item in results[index]]}
+
+
+def fetch_stock_data(session, product_data, stock_url, proxy_pool=None):
+    """Runs fetch_stock_data_async on the fetch engine and waits for the result. See fetch_stock_data_async."""
+    return fetch_engine.run(fetch_stock_data_async(session, product_data, stock_url, proxy_pool))
+
+
+async def fetch_remaining_pages_async(session, product_url, fields, first_count, proxy_pool=None):
+    """
+    Fetches the product pages after the first one.
 
-    logging.debug("Stock data successfully retrieved.")
-    return stock_data
+    fields holds the first page's top-level members and first_count its number of items. The offsets of the
+    remaining pages follow from its totalResults, and the pages are fetched concurrently, at most
+    PAGE_FETCH_WORKERS at a time, each on its own session and proxy, so a whole listing takes about as long as
+    its slowest page. Returns the page responses in offset order and whether every page was fetched.
+    """
+    offsets, limit = remaining_page_offsets(fields, first_count)
+    if not offsets:
+        return [], True
 
+    logging.debug(f"Fetching {len(offsets)} more product pages of {limit} items.")
+    urls = [page_url(product_url, offset, limit) for offset in offsets]
+    def fetch_page(worker_session, url):
+        return api_request_async(worker_session, url, proxy_pool=proxy_pool, raw=True)
 
-def process_products_with_or_without_stock_data(product_list, stock_data):
-    """Process products and match them with stock data if available."""
+    results = await gather_with_worker_sessions(session, urls, fetch_page, PAGE_FETCH_WORKERS, PAGE_FETCH_RETRIES,
+                                                "page", proxy_pool)
+    if len(results) < len(urls):
+        logging.error(f"{len(urls) - len(results)} of {len(urls) + 1} product pages failed. The listing is incomplete.")
+    return [results[index] for index in sorted(results)], len(results) == len(urls)
+
+
+def fetch_remaining_pages(session, product_url, fields, first_count, proxy_pool=None):
+    """Runs fetch_remaining_pages_async on the fetch engine and waits for the result."""
+    return fetch_engine.run(fetch_remaining_pages_async(session, product_url, fields, first_count, proxy_pool))
+
+
+def page_items(resp):
+    """Returns the items of a product page response, or None if it can't be decoded."""
+    try:
+        product_data = resp.json()
+    except ValueError:
+        logging.error(f"Failed to decode JSON response. Response Text: {resp.text}")
+        return None
+    items = product_data.get("items") if isinstance(product_data, dict) else None
+    return items if isinstance(items, list) else None
+
+
+def build_stock_index(stock_data, product_ids):
+    """
+    Indexes the stock response by product ID in one pass.
+
+    Each stock item is keyed by its "productId" when present, otherwise by whichever of its keys is a polled
+    product ID (the response also carries one key per SKU ID). Returns the index and the number of stock items
+    that didn't match any polled product.
+    """
+    stock_index = {}
+    orphaned = 0
+
+    for stock_item in stock_data.get("items", []):
+        if not isinstance(stock_item, dict):
+            orphaned += 1
+            continue
+
+        product_id = stock_item.get("productId")
+        if product_id not in product_ids:
+            product_id = next((key for key in stock_item if key in product_ids), None)
+
+        if product_id is None:
+            orphaned += 1
+        else:
+            stock_index.setdefault(product_id, stock_item)
+
+    return stock_index, orphaned
+
+
+def join_stock_data(product_list, stock_data):
+    """
+    Merges the inventory details from the stock response into the products with an O(n) index join.
+
+    Returns counters for products with no stock entry ("stock_missing"), products whose stock entry had no
+    inventory details ("stock_without_details") and stock entries with no product ("stock_orphaned").
+    """
+    stock_index, orphaned = build_stock_index(stock_data, {product.id for product in product_list})
+    join_stats = {"stock_missing": 0, "stock_without_details": 0, "stock_orphaned": orphaned}
+
+    for new_product in product_list:
+        stock_item = stock_index.get(new_product.id)
+        if stock_item is None:
+            join_stats["stock_missing"] += 1
+            logging.debug(f"No stock entry found for product ID: {new_product.id}")
+        elif stock_item.get("productSkuInventoryDetails"):
+            new_product.__dict__.update(stock_item["productSkuInventoryDetails"][0])
+        else:
+            join_stats["stock_without_details"] += 1
+            logging.warning(f"No inventory details found for product ID: {new_product.id}")
+
+    if join_stats["stock_missing"] or join_stats["stock_orphaned"]:
+        logging.warning(
+            f"{join_stats['stock_missing']} products had no stock entry and "
+            f"{join_stats['stock_orphaned']} stock entries had no matching product."
+        )
+
+    return join_stats
+
+
+def process_products_with_or_without_stock_data(product_list, stock_data, conn=None, target=None,
+                                                 detect_removed=True):
+    """
+    Process products and match them with stock data if available.
+
+    The products are stored under the target's name and new products are announced to its chat. Pass
+    detect_removed=False when product_list is only part of the listing. Returns the database sync stats,
+    extended with the stock join counters, or None if storing failed.
+    """
+    target = target or default_target()
+    join_stats = {}
+    fingerprints = None
     if stock_data:
         # Continue processing stock data
-        for new_product in product_list:
-            try:
-                # Match each product with stock data
-                for stock_item in stock_data.get("items", []):
-                    if new_product.id in stock_item:
-                        if "productSkuInventoryDetails" in stock_item and stock_item["productSkuInventoryDetails"]:
-                            new_product.__dict__.update(stock_item["productSkuInventoryDetails"][0])
-                        else:
-                            logging.warning(f"No inventory details found for product ID: {new_product.id}")
-                        break
-            except ValidationError as e:
-                logging.error(f"Error parsing stock levels: {e}")
-                continue
-
+        with metrics.timer("stock_join"):
+            join_stats = join_stock_data(product_list, stock_data)
+        for counter, value in join_stats.items():
+            metrics.inc("stock_join_unmatched_total", value, kind=counter)
     else:
         logging.warning("Stock data is unavailable, proceeding with available product data only.")
 
+    # The snapshot hashes of a very large listing are computed by the worker pool
+    if snapshot_cache.enabled and parallel_pipeline.enabled_for(len(product_list)):
+        with metrics.timer("fingerprint"):
+            for product in product_list:
+                prepare_product(product)
+            fingerprints = parallel_pipeline.fingerprints(product_list, TRACKED_FIELDS)
+
     # Store the products in the database
     try:
-        store_products_to_db(product_list)
+        with metrics.timer("db_sync"):
+            db_stats = store_products_to_db(product_list, conn, target=target.name, chat_id=target.chat_id,
+                                            detect_removed=detect_removed, fingerprints=fingerprints)
     except Exception as e:
         logging.error(f"Error storing products in the database: {e}")
+        return None
+
+    db_stats.update(join_stats)
+    return db_stats
+
+
+def poll_products(session, conn=None, proxy_pool=None, fetch_state=None, target=None):
+    """
+    Runs one fetch, validate, stock and store cycle for a target (the default target if none is given).
+    Returns the cycle stats, or None if nothing was fetched.
+
+    A listing whose first page reports more totalResults than it holds is crawled page by page: the remaining
+    offsets are fetched concurrently and their items merged and de-duplicated by id. If some pages can't be
+    fetched, the products that were are stored without removed product detection. With PARALLEL_WORKERS set, the
+    pages of a listing of at least PARALLEL_MIN_ITEMS items are parsed and validated by the parallel pipeline.
+
+    Pass the same fetch_state on every poll of a target (as daemon mode does) to send conditional request
+    headers, reuse validated models for items whose lastModifiedDate didn't move, and skip the database entirely
+    when neither the product pages nor the stock changed since the previous poll.
+    """
+    target = target or default_target()
+    fetch_state = fetch_state or IncrementalFetchState()
+    product_url = page_url(target.product_url, limit=PRODUCT_PAGE_SIZE) if PRODUCT_PAGE_SIZE else target.product_url
+    with metrics.timer("product_fetch"):
+        resp = api_request(session, product_url, proxy_pool=proxy_pool, headers=fetch_state.request_headers(),
+                           raw=True)
+    if resp is None:
+        logging.warning("No 'items' found in the product data response or invalid format.")
+        return None
+
+    if STREAM_BATCH_SIZE > 0:
+        return poll_products_streaming(session, resp, conn, proxy_pool, target, product_url)
+
+    page_unchanged = fetch_state.page_unchanged(resp)
+    validated = 0
+    complete = True
+    if page_unchanged:
+        logging.debug("Product page unchanged since the last poll. Reusing the validated products.")
+        product_list = fetch_state.cached_products()
+    else:
+        try:
+            with metrics.timer("product_parse"):
+                product_data = resp.json()  # Ensure response is valid JSON
+        except ValueError:
+            logging.error(f"Failed to decode JSON response. Response Text: {resp.text}")
+            return None
+
+        # Extract and validate "items", and process product data in one go
+        available_items = product_data.get("items") if isinstance(product_data, dict) else None
+        if not available_items:
+            logging.warning("No 'items' found in the product data response or invalid format.")
+            return None
+
+        # The rest of a paginated listing is fetched concurrently
+        with metrics.timer("product_fetch"):
+            pages, complete = fetch_remaining_pages(session, product_url, product_data, len(available_items),
+                                                    proxy_pool)
+        if pages and complete and fetch_state.page_unchanged(resp, pages):
+            page_unchanged = True
+            logging.debug(f"All {len(pages) + 1} product pages unchanged since the last poll.")
+            product_list = fetch_state.cached_products()
+        else:
+            parallel_result = None
+            # Pages hold about as many items as the first, so a very large listing is known before it is parsed
+            if VALIDATION_MODE != "full" and parallel_pipeline.enabled_for(len(available_items) * (len(pages) + 1),
+                                                                           len(pages) + 1):
+                with metrics.timer("validation"):
+                    parallel_result = parallel_pipeline.validate_pages([page.text for page in [resp, *pages]])
+
+            if parallel_result is not None:
+                product_list, pages_valid = parallel_result
+                complete = complete and pages_valid
+                product_list = fetch_state.remember_products(product_list)
+                validated = len(product_list)
+            else:
+                if pages:
+                    with metrics.timer("product_parse"):
+                        page_item_lists = [page_items(page) for page in pages]
+                    complete = complete and None not in page_item_lists
+                    available_items = list(unique_items(chain(available_items, *filter(None, page_item_lists))))
+
+                # Validate, transform product data, and store them in product_list
+                with metrics.timer("validation"):
+                    product_list, validated = fetch_state.validate_items(
+                        available_items, lambda items: validate_products(items, lean=VALIDATION_MODE != "full")
+                    )
+            if complete:
+                fetch_state.remember_page(resp, pages)
+            else:
+                # Make sure the next poll doesn't take a partial listing for an unchanged one
+                fetch_state.invalidate()
+
+    # Fetch stock data for products
+    with metrics.timer("stock_fetch"):
+        stock_data = fetch_stock_data(session, {"items": [{"id": p.id} for p in product_list]}, target.stock_url,
+                                      proxy_pool)
+
+    cycle_stats = {
+        "items": len(product_list),
+        "validated": validated,
+        "hot": sum(1 for product in product_list if is_hot_product(product)),
+        "moved": 0,
+        "db": None,
+    }
+
+    if fetch_state.stock_unchanged(stock_data) and page_unchanged:
+        logging.info(f"[{target.name}] Product page and stock unchanged since the last poll. Skipping the database sync.")
+        cycle_stats["db"] = {"new": 0, "changed": 0, "unchanged": len(product_list), "removed": 0, "db_time": 0.0}
+        return cycle_stats
+
+    # Process products and store them to the database with or without stock data
+    db_stats = process_products_with_or_without_stock_data(product_list, stock_data, conn, target,
+                                                           detect_removed=complete)
+    if db_stats is None:
+        fetch_state.invalidate()
+
+    run_maintenance(conn)
+
+    cycle_stats["moved"] = db_stats["new"] + db_stats["changed"] if db_stats else 0
+    cycle_stats["db"] = db_stats
+    return cycle_stats
+
+
+def run_maintenance(conn=None):
+    """Runs the periodic database maintenance tasks that are due."""
+    with metrics.timer("maintenance"):
+        run_maintenance_if_due("prune_history", HISTORY_PRUNE_INTERVAL, prune_history, conn)
+        run_maintenance_if_due("prune_notification_ledger", LEDGER_PRUNE_INTERVAL, notification_ledger.prune, conn)
+        run_maintenance_if_due("purge_tombstones", TOMBSTONE_PURGE_INTERVAL, purge_tombstones, conn)
+        analyze_if_stale(conn)
+
+
+def poll_products_streaming(session, resp, conn=None, proxy_pool=None, target=None, product_url=None):
+    """
+    Runs the validate, stock and store steps over a product response in batches of STREAM_BATCH_SIZE items.
+
+    Items are decoded one at a time from the response text, and each batch is validated, joined with its own
+    stock request and stored before the next is decoded, so only one batch of raw items and models is alive at a
+    time. The other pages of a paginated listing are fetched concurrently up front and streamed after the first.
+    Removed products are detected once the whole listing was stored. The incremental fetch shortcuts need
+    every product of the previous poll in memory, so this mode always runs the full pipeline. Returns the cycle
+    stats, or None if the response held no items.
+    """
+    target = target or default_target()
+    lean = VALIDATION_MODE != "full"
+    cycle_stats = {"items": 0, "validated": 0, "hot": 0, "moved": 0, "db": None}
+    db_stats = {}
+    live_ids = set()
+
+    try:
+        with metrics.timer("product_parse"):
+            fields, first_count = json_page_info(resp.text)
+        with metrics.timer("product_fetch"):
+            pages, complete = fetch_remaining_pages(session, product_url or target.product_url, fields, first_count,
+                                                    proxy_pool)
+        with metrics.timer("product_parse"):
+            page_texts = [page.text for page in [resp, *pages]]
+            del pages
+            items = iter_batches(unique_items(chain.from_iterable(map(iter_json_items, page_texts))),
+                                 STREAM_BATCH_SIZE)
+            batch = next(items, None)
+        while batch is not None:
+            with metrics.timer("validation"):
+                product_list = validate_products(batch, lean=lean)
+            del batch
+
+            with metrics.timer("stock_fetch"):
+                stock_data = fetch_stock_data(session, {"items": [{"id": p.id} for p in product_list]},
+                                              target.stock_url, proxy_pool)
+            batch_stats = process_products_with_or_without_stock_data(product_list, stock_data, conn, target,
+                                                                      detect_removed=False)
+
+            live_ids.update(product.id for product in product_list)
+            cycle_stats["items"] += len(product_list)
+            cycle_stats["validated"] += len(product_list)
+            cycle_stats["hot"] += sum(1 for product in product_list if is_hot_product(product))
+            if batch_stats is None:
+                complete = False
+            else:
+                for key, value in batch_stats.items():
+                    db_stats[key] = db_stats.get(key, 0) + value
+            del product_list, stock_data
+
+            with metrics.timer("product_parse"):
+                batch = next(items, None)
+    except ValueError as e:
+        logging.error(f"Failed to decode JSON response after {cycle_stats['items']} items: {e}")
+        return None
+
+    if not cycle_stats["items"]:
+        logging.warning("No 'items' found in the product data response or invalid format.")
+        return None
+
+    # A listing that wasn't fully fetched and stored can't tell which products are gone
+    if complete:
+        db_stats["removed"] = remove_missing_products(live_ids, conn, target.name, target.chat_id,
+                                                      db_stats.get("new", 0))
+    else:
+        logging.warning(f"[{target.name}] Some pages or batches failed. Skipping removed product detection.")
+
+    run_maintenance(conn)
+
+    cycle_stats["moved"] = db_stats.get("new", 0) + db_stats.get("changed", 0)
+    cycle_stats["db"] = db_stats or None
+    return cycle_stats
+
+
+def run_poll_cycle(session, conn=None, proxy_pool=None, fetch_state=None, target=None):
+    """
+    Runs poll_products as one instrumented cycle, recording its latency and stats in the metrics, and writes the
+    target's catalog snapshot to disk if the cycle changed it.
+    """
+    metrics.start_cycle(target.name if target else None)
+    cycle_stats = None
+    try:
+        cycle_stats = poll_products(session, conn, proxy_pool, fetch_state, target)
+        return cycle_stats
+    finally:
+        metrics.finish_cycle(cycle_stats)
+        snapshot_cache.save(target.name if target else DEFAULT_TARGET)
+
+
+def create_target_scheduler(target, proxy_pool=None):
+    """Creates the adaptive scheduler polling one target with its own session and incremental fetch state."""
+    fetch_state = IncrementalFetchState()
+
+    def cycle():
+        session = get_target_session(target, proxy_pool)
+        try:
+            return run_poll_cycle(session, proxy_pool=proxy_pool, fetch_state=fetch_state, target=target)
+        finally:
+            # Keep the saved cookies and proxy scores current in case the daemon is killed. Dropped proxies whose
+            # score expired are probed again, so the pool doesn't run dry over a long run.
+            session_pool.save_state()
+            if proxy_pool:
+                proxy_pool.recheck()
+
+    return AdaptiveScheduler(
+        cycle,
+        interval=target.poll_interval or POLL_INTERVAL,
+        min_interval=target.min_interval or POLL_INTERVAL_MIN,
+        max_interval=target.max_interval or POLL_INTERVAL_MAX,
+        name=target.name,
+    )
+
+
+def run_scheduler(scheduler):
+    """Runs a scheduler until it is stopped, then closes the thread's database connection."""
+    try:
+        scheduler.run()
+    finally:
+        close_connection()
+
+
+def run_daemon(targets):
+    """
+    Polls every target on its own adaptive schedule until stopped.
+
+    Each target runs in its own thread with its own session, database connection and incremental fetch state,
+    so a slow target never delays the others. The proxy pool is shared.
+    """
+    proxy_pool = create_proxy_pool()
+    schedulers = [create_target_scheduler(target, proxy_pool) for target in targets]
+
+    def stop_all(*args):
+        for scheduler in schedulers:
+            scheduler.stop()
+
+    # Finish the current cycles and exit cleanly on SIGTERM
+    signal.signal(signal.SIGTERM, stop_all)
+
+    threads = [
+        threading.Thread(target=run_scheduler, args=(scheduler,), name=f"poll-{scheduler.name}", daemon=True)
+        for scheduler in schedulers
+    ]
+    for scheduler, thread in zip(schedulers, threads):
+        logging.info(f"Starting daemon mode for {scheduler.name} with a {scheduler.interval:.1f} second polling interval.")
+        thread.start()
+
+    try:
+        # Joining with a timeout keeps the main thread responsive to KeyboardInterrupt
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1.0)
+    except KeyboardInterrupt:
+        logging.info("Interrupted, shutting down.")
+        stop_all()
+        for thread in threads:
+            thread.join()
+    finally:
+        close_target_sessions()
+        fetch_engine.close()
+        parallel_pipeline.close()
+        if proxy_pool:
+            proxy_pool.save_scores()
+        notification_queue.flush(timeout=NOTIFICATION_FLUSH_TIMEOUT)
+        event_dispatcher.flush(timeout=NOTIFICATION_FLUSH_TIMEOUT)
+
+
+def poll_targets_once(targets, proxy_pool=None):
+    """Polls every target once, concurrently. Returns the cycle stats of each target, keyed by name."""
+
+    def poll_once(target):
+        try:
+            return run_poll_cycle(get_target_session(target, proxy_pool), proxy_pool=proxy_pool, target=target)
+        finally:
+            close_connection()
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        return dict(zip([target.name for target in targets], executor.map(poll_once, targets)))
+
+
+def parse_args():
+    """Parses the command line arguments."""
+    parser = argparse.ArgumentParser(description="Monitor the whiskey release page for new products and stock.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep running and poll on an adaptive schedule instead of exiting after one run.")
+    return parser.parse_args()
 
 
 def main():
     """Main function to fetch and process product data from the API."""
+    args = parse_args()
     start_time = time.time()
     initialize_logging()
     initialize_db()
+    start_metrics_server()
 
-    # Create session and handle API request
-    session = create_session()
-    product_data = api_request(session, PRODUCT_URL)
+    targets = load_targets()
 
-    # Extract and validate "items", and process product data in one go
-    available_items = product_data.get("items")
-    if not available_items:
-        logging.warning("No 'items' found in the product data response or invalid format.")
+    if args.daemon:
+        run_daemon(targets)
         return
 
-    # Validate, transform product data, and store them in product_list
-    product_list = []
-    for item in available_items:
-        validated_product = ItemModel.model_validate(item)
-        if validated_product is not None:
-            product_list.append(validated_product)
-
-    # Fetch stock data for products
-    stock_data = fetch_stock_data(session, product_data, STOCK_URL)
-
-    # Process products and store them to the database with or without stock data
-    process_products_with_or_without_stock_data(product_list, stock_data)
+    # Create the sessions and run a single poll of every target
+    proxy_pool = create_proxy_pool()
+    try:
+        results = poll_targets_once(targets, proxy_pool)
+    finally:
+        close_target_sessions()
+        fetch_engine.close()
+        parallel_pipeline.close()
+    if proxy_pool:
+        proxy_pool.save_scores()
+    notification_queue.flush(timeout=NOTIFICATION_FLUSH_TIMEOUT)
+    event_dispatcher.flush(timeout=NOTIFICATION_FLUSH_TIMEOUT)
 
     # End time tracking and print the execution time
     elapsed_time = time.time() - start_time
+    for name, cycle_stats in results.items():
+        db_stats = cycle_stats["db"] if cycle_stats else None
+        if db_stats:
+            logging.info(
+                f"[{name}] DB sync took {db_stats['db_time']:.3f} seconds "
+                f"({db_stats['new']} new, {db_stats['changed']} changed, {db_stats['unchanged']} unchanged, "
+                f"{db_stats['removed']} removed)."
+            )
+        else:
+            logging.info(f"[{name}] Poll failed, nothing was stored.")
     logging.info(f"Execution completed in {elapsed_time:.2f} seconds.")
 
 
-
 if __name__ == "__main__":
     main()
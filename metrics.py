@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()  # Load environment variables
+
+# Port of the Prometheus-style metrics endpoint (disabled when unset) and path of the JSON-lines stats file
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_PREFIX = "whiskymon_"
+
+
+def escape_label_value(value):
+    """Escapes a label value for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def label_key(labels):
+    """Returns the registry key for a label dict. Values are stored as strings so keys always sort."""
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_labels(labels):
+    """Formats a sorted label tuple in Prometheus syntax."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """
+    In-process registry of counters, gauges and timing summaries.
+
+    Stage timings are recorded with timer(stage). The timings of the current poll cycle are also kept
+    separately so finish_cycle() can write one JSON line per cycle. Cycle state is per thread, so targets polled
+    concurrently each get their own cycle, and their stage and cycle metrics carry a target label.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {}
+        self.cycle_state = threading.local()
+
+    def target_labels(self):
+        """Returns the target label of this thread's cycle, if it has one."""
+        target = getattr(self.cycle_state, "target", None)
+        return {"target": target} if target else {}
+
+    def inc(self, name, value=1, **labels):
+        """Increments a counter."""
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Sets a gauge."""
+        with self.lock:
+            self.gauges[(name, label_key(labels))] = value
+
+    def observe(self, name, seconds, **labels):
+        """Records a duration in a summary (count, sum and last value)."""
+        key = (name, label_key(labels))
+        with self.lock:
+            count, total, _ = self.summaries.get(key, (0, 0.0, 0.0))
+            self.summaries[key] = (count + 1, total + seconds, seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """Times the enclosed block as a pipeline stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("stage_seconds", elapsed, stage=stage, **self.target_labels())
+            stages = getattr(self.cycle_state, "stages", None)
+            if stages is not None:
+                stages[stage] = stages.get(stage, 0.0) + elapsed
+
+    def start_cycle(self, target=None):
+        """Marks the start of a poll cycle on this thread, optionally for a named target."""
+        self.cycle_state.started_at = time.perf_counter()
+        self.cycle_state.stages = {}
+        self.cycle_state.target = target
+
+    def finish_cycle(self, cycle_stats=None):
+        """Records the cycle latency and counts, and appends the cycle to METRICS_FILE if it is set."""
+        labels = self.target_labels()
+        latency = time.perf_counter() - (getattr(self.cycle_state, "started_at", None) or time.perf_counter())
+        self.observe("cycle_seconds", latency, **labels)
+        self.inc("cycles_total", result="ok" if cycle_stats else "failed", **labels)
+
+        db_stats = (cycle_stats or {}).get("db") or {}
+        for status in ("new", "changed", "unchanged", "removed"):
+            if status in db_stats:
+                self.inc("products_total", db_stats[status], status=status, **labels)
+                self.set("products_last_cycle", db_stats[status], status=status, **labels)
+
+        if METRICS_FILE:
+            record = {
+                "timestamp": time.time(),
+                "cycle_seconds": latency,
+                "stages": dict(getattr(self.cycle_state, "stages", None) or {}),
+                "stats": cycle_stats,
+            }
+            if labels:
+                record["target"] = labels["target"]
+            try:
+                with open(METRICS_FILE, "a") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+            except OSError as e:
+                logging.warning(f"Could not write metrics to {METRICS_FILE}: {e}")
+        return latency
+
+    def render_prometheus(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            summaries = dict(self.summaries)
+
+        lines = []
+        for kind, registry in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in registry}):
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+                for (metric_name, labels), value in sorted(registry.items()):
+                    if metric_name == name:
+                        lines.append(f"{METRICS_PREFIX}{name}{format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in summaries}):
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} summary")
+            for (metric_name, labels), (count, total, last) in sorted(summaries.items()):
+                if metric_name == name:
+                    label_text = format_labels(labels)
+                    lines.append(f"{METRICS_PREFIX}{name}_count{label_text} {count}")
+                    lines.append(f"{METRICS_PREFIX}{name}_sum{label_text} {total:.6f}")
+                    lines.append(f"{METRICS_PREFIX}{name}_last{label_text} {last:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Returns every metric as a JSON-serialisable dict."""
+        with self.lock:
+            return {
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self.counters.items()],
+                "gauges": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self.gauges.items()],
+                "summaries": [{"name": n, "labels": dict(l), "count": c, "sum": s, "last": last}
+                              for (n, l), (c, s, last) in self.summaries.items()],
+            }
+
+
+# Process-wide metrics registry
+metrics = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves /metrics in Prometheus text format and /metrics.json as JSON."""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = metrics.render_prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(metrics.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Metrics request: {format % args}")
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Starts the metrics endpoint on a background thread. Returns the server, or None if no port is set."""
+    if port in (None, ""):
+        return None
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -1,5 +1,6 @@
 from __future__ import annotations
-from pydantic import BaseModel
+import logging
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from typing import List, Optional
 
 
@@ -144,14 +145,92 @@ class ItemModel(BaseModel):
     # configurable: bool
     class Config:
         extra = "allow"
+        # Only the full validation mode uses this model, so its schema is built on first use instead of at import
+        defer_build = True
+
+
+class ProductModel(BaseModel):
+    """
+    Compact projection of an item holding only the fields the database, notifications and scheduler use.
+
+    Everything except id is optional, and unknown keys are dropped instead of being carried on the model.
+    The stock fields are filled in later from the stock response.
+    """
+    id: str
+    brand: Optional[str] = None
+    displayName: Optional[str] = None
+    listPrice: Optional[float] = None
+    b2c_proof: Optional[str] = None
+    b2c_size: Optional[str] = None
+    lastModifiedDate: Optional[str] = None
+    shippable: Optional[bool] = None
+    active: Optional[bool] = None
+    b2c_upc: Optional[str] = None
+    primaryFullImageURL: Optional[str] = None
+    b2c_comingSoon: Optional[str] = None
+    b2c_highlyAllocatedProduct: Optional[str] = None
+    # Filled in from the stock response and by the database layer
+    inStockQuantity: Optional[int] = None
+    orderableQuantity: Optional[int] = None
+    stockStatus: Optional[str] = None
+    url: Optional[str] = None
+    class Config:
+        extra = "ignore"
+
+
+class TargetConfig(BaseModel):
+    """
+    One monitored endpoint pair from the targets file.
+
+    Intervals left unset fall back to POLL_INTERVAL/POLL_INTERVAL_MIN/POLL_INTERVAL_MAX, and chat_id falls back to
+    TELEGRAM_GROUP_CHAT_ID.
+    """
+    name: str
+    product_url: str
+    stock_url: str
+    chat_id: Optional[str] = None
+    poll_interval: Optional[float] = None
+    min_interval: Optional[float] = None
+    max_interval: Optional[float] = None
+    class Config:
+        extra = "forbid"
 
 
 class ResponseModel(BaseModel):
     totalResults: int
-    # offset: int
-    # limit: int
+    offset: Optional[int] = None
+    limit: Optional[int] = None
     # links: List[Link]
     # category: Category
     items: List[Item]
     class Config:
         extra = "allow"
+        defer_build = True
+
+
+product_list_adapter = TypeAdapter(List[ProductModel])
+
+
+def validate_products(items, lean=True):
+    """
+    Validates a list of raw items into ProductModel (lean) or ItemModel instances.
+
+    The lean path validates the whole list in one TypeAdapter call. Items that fail validation are logged and
+    skipped rather than aborting the run.
+    """
+    if lean:
+        try:
+            return product_list_adapter.validate_python(items)
+        except ValidationError:
+            # Fall back to item by item so one bad item only drops itself
+            pass
+
+    model = ProductModel if lean else ItemModel
+    products = []
+    for item in items:
+        try:
+            products.append(model.model_validate(item))
+        except ValidationError as e:
+            item_id = item.get("id") if isinstance(item, dict) else None
+            logging.error(f"Skipping item {item_id} that failed validation: {e.error_count()} errors")
+    return products
@@ -0,0 +1,126 @@
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()  # Load environment variables
+
+# Seconds during which a product/event pair (or identical content) is announced at most once. 0 disables dedup.
+NOTIFICATION_DEDUP_TTL = float(os.getenv("NOTIFICATION_DEDUP_TTL", "86400"))
+# Fields that identify a product to a reader; a re-listed product with these unchanged is a near-duplicate
+LEDGER_HASH_FIELDS = ("brand", "displayName", "b2c_size", "b2c_proof", "b2c_upc")
+
+INSERT_LEDGER_SQL = """
+INSERT OR REPLACE INTO notification_ledger (target, product_id, event, content_hash, notified_at)
+VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def notification_content_hash(product):
+    """Hashes the identifying fields of a product, ignoring case and whitespace differences."""
+    values = (" ".join(str(getattr(product, field, None) or "").lower().split()) for field in LEDGER_HASH_FIELDS)
+    return hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()
+
+
+class NotificationLedger:
+    """
+    Remembers which notifications went out, so a product/event pair is announced at most once per TTL.
+
+    The ledger is persisted in the notification_ledger table and mirrored in two dicts, one keyed by
+    (target, product_id, event) and one by (target, event, content_hash), so checks are O(1) lookups with no
+    database round trip. A product is a duplicate if either its key or its content was announced within the TTL;
+    the second catches rows that were deleted and re-added under a new id. New entries are written in the caller's
+    transaction and only added to memory once it commits.
+    """
+
+    def __init__(self, ttl=NOTIFICATION_DEDUP_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hashes = {}
+        self.loaded = False
+
+    def load(self, conn):
+        """Loads the unexpired entries from the database, once per process."""
+        if self.loaded:
+            return
+        cutoff = int(time.time() - self.ttl)
+        rows = conn.execute(
+            "SELECT target, product_id, event, content_hash, notified_at FROM notification_ledger "
+            "WHERE notified_at >= ?", (cutoff,)
+        ).fetchall()
+        with self.lock:
+            if not self.loaded:
+                for row in rows:
+                    self.add(row)
+                self.loaded = True
+        logging.debug(f"Loaded {len(rows)} notification ledger entries.")
+
+    def add(self, row):
+        """Adds a ledger row to the in-memory indexes. The caller holds the lock."""
+        target, product_id, event, content_hash, notified_at = row
+        self.entries[(target, product_id, event)] = (content_hash, notified_at)
+        hash_key = (target, event, content_hash)
+        self.hashes[hash_key] = max(notified_at, self.hashes.get(hash_key, 0))
+
+    def is_duplicate(self, target, product_id, event, content_hash, now):
+        """Returns True if the product/event pair or the same content was announced within the TTL."""
+        cutoff = now - self.ttl
+        entry = self.entries.get((target, product_id, event))
+        if entry is not None and entry[1] >= cutoff:
+            return True
+        return self.hashes.get((target, event, content_hash), -1) >= cutoff
+
+    def filter_products(self, target, products, event, now=None):
+        """
+        Splits products into the ones to announce and the suppressed duplicates.
+
+        Returns (to_notify, suppressed, rows) where rows are the ledger rows to write with INSERT_LEDGER_SQL.
+        Duplicates within the batch itself are suppressed too.
+        """
+        now = int(now or time.time())
+        to_notify, suppressed, rows = [], [], []
+        if self.ttl <= 0:
+            return list(products), suppressed, rows
+
+        seen_hashes = set()
+        with self.lock:
+            for product in products:
+                content_hash = notification_content_hash(product)
+                if content_hash in seen_hashes or self.is_duplicate(target, product.id, event, content_hash, now):
+                    suppressed.append(product)
+                    continue
+                seen_hashes.add(content_hash)
+                to_notify.append(product)
+                rows.append((target, product.id, event, content_hash, now))
+        return to_notify, suppressed, rows
+
+    def remember(self, rows):
+        """Adds committed ledger rows to memory."""
+        with self.lock:
+            for row in rows:
+                self.add(row)
+
+    def prune(self, conn):
+        """Deletes expired entries from the database and from memory. Returns the number of deleted rows."""
+        cutoff = int(time.time() - self.ttl)
+        try:
+            with conn:
+                deleted = conn.execute("DELETE FROM notification_ledger WHERE notified_at < ?", (cutoff,)).rowcount
+        except sqlite3.Error as e:
+            logging.error(f"Database error while pruning the notification ledger: {e}")
+            return 0
+
+        with self.lock:
+            self.entries = {key: entry for key, entry in self.entries.items() if entry[1] >= cutoff}
+            self.hashes = {key: notified_at for key, notified_at in self.hashes.items() if notified_at >= cutoff}
+        if deleted:
+            logging.info(f"Pruned {deleted} expired notification ledger entries.")
+        return deleted
+
+
+# Process-wide ledger shared by every target
+notification_ledger = NotificationLedger()
@@ -0,0 +1,53 @@
+import os
+from urllib.parse import urlsplit, urlunsplit
+from dotenv import load_dotenv
+
+load_dotenv()  # Load environment variables
+
+# Items requested per product page. 0 keeps whatever limit the target's product URL (or the API default) sets.
+PRODUCT_PAGE_SIZE = int(os.getenv("PRODUCT_PAGE_SIZE", "0"))
+# Product pages after the first are fetched concurrently, at most PAGE_FETCH_WORKERS at a time, and failed pages
+# are retried for PAGE_FETCH_RETRIES more rounds
+PAGE_FETCH_WORKERS = int(os.getenv("PAGE_FETCH_WORKERS", "16"))
+PAGE_FETCH_RETRIES = int(os.getenv("PAGE_FETCH_RETRIES", "1"))
+
+
+def page_url(url, offset=None, limit=None):
+    """
+    Returns url with its offset and/or limit query parameters set. The other parameters are kept verbatim, so
+    already-encoded values aren't encoded twice.
+    """
+    parts = urlsplit(url)
+    replaced = [(name, value) for name, value in (("offset", offset), ("limit", limit)) if value is not None]
+    names = {name for name, _ in replaced}
+    params = [param for param in parts.query.split("&") if param and param.split("=", 1)[0] not in names]
+    params += [f"{name}={value}" for name, value in replaced]
+    return urlunsplit(parts._replace(query="&".join(params)))
+
+
+def remaining_page_offsets(fields, first_count):
+    """
+    Returns the offsets of the pages after the first and the page size to request them with.
+
+    fields holds the first page's top-level members (its totalResults and offset) and first_count is the number
+    of items it held. Pages step by first_count rather than the advertised limit, so a server that caps the page
+    size below the requested limit doesn't leave gaps. Returns no offsets if the first page holds the whole
+    listing or doesn't report totalResults.
+    """
+    total = fields.get("totalResults")
+    if not isinstance(total, int) or first_count <= 0:
+        return [], first_count
+    offset = fields.get("offset") or 0
+    return list(range(offset + first_count, total, first_count)), first_count
+
+
+def unique_items(items):
+    """Yields the items whose id hasn't been seen before, so an item that shifted between pages is kept once."""
+    seen = set()
+    for item in items:
+        item_id = item.get("id") if isinstance(item, dict) else None
+        if item_id is not None:
+            if item_id in seen:
+                continue
+            seen.add(item_id)
+        yield item
@@ -0,0 +1,169 @@
+import os
+import json
+import math
+import logging
+import threading
+import multiprocessing
+from operator import itemgetter
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+from models import ProductModel, validate_products
+from snapshot import hash64, fields_hash
+from db import prepare_product
+
+load_dotenv()  # Load environment variables
+
+# Worker processes that parse, validate and hash very large listings. 0 keeps all of it in the poller's process.
+PARALLEL_WORKERS = int(os.getenv("PARALLEL_WORKERS", "0"))
+# Listings with fewer items stay on the sequential path, where handing them to the pool costs more than it saves.
+# benchmarks/bench_parallel.py measures the crossover on a given machine.
+PARALLEL_MIN_ITEMS = int(os.getenv("PARALLEL_MIN_ITEMS", "20000"))
+# Hashing tasks per worker, so a slow worker doesn't hold up the rest of the cycle
+PARALLEL_TASKS_PER_WORKER = 4
+
+# Order of the values in the rows the workers send back
+PRODUCT_FIELDS = tuple(ProductModel.model_fields)
+product_row = itemgetter(*PRODUCT_FIELDS)
+ID_INDEX = PRODUCT_FIELDS.index("id")
+
+
+def init_worker(log_queue, level):
+    """Sends the worker's log records to the poller's handlers through log_queue."""
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
+
+
+def validate_page(text):
+    """
+    Runs in a worker: parses one page of a listing, validates its items into ProductModel and prepares them for
+    storing. Returns the products as tuples of PRODUCT_FIELDS values, or None if the page isn't a valid listing.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        logging.error(f"Failed to decode a product page: {e}")
+        return None
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        logging.error("Product page has no 'items' list.")
+        return None
+
+    rows = []
+    for product in validate_products(items):
+        prepare_product(product)
+        rows.append(product_row(product.__dict__))
+    return rows
+
+
+def hash_products(rows):
+    """Runs in a worker: returns the snapshot (id hash, fields hash) of each (id, tracked values) row."""
+    return [(hash64(product_id), fields_hash(values)) for product_id, values in rows]
+
+
+def build_products(rows):
+    """
+    Turns worker rows back into ProductModel instances without validating them a second time. The values were
+    validated by the worker, so they are set directly, as ProductModel.model_construct does.
+    """
+    new, set_attribute = ProductModel.__new__, object.__setattr__
+    products = []
+    for row in rows:
+        product = new(ProductModel)
+        set_attribute(product, "__dict__", dict(zip(PRODUCT_FIELDS, row)))
+        set_attribute(product, "__pydantic_fields_set__", set(PRODUCT_FIELDS))
+        set_attribute(product, "__pydantic_extra__", None)
+        set_attribute(product, "__pydantic_private__", None)
+        products.append(product)
+    return products
+
+
+class ParallelPipeline:
+    """
+    Spreads the CPU-bound steps of a very large poll over a pool of worker processes.
+
+    Each page of a listing is parsed, validated and prepared in a worker, and only compact tuples of the product
+    fields come back. After the stock join, the snapshot fingerprints are hashed in the workers too, so the
+    poller's own process is left with the join and the database write. Listings below min_items, or held in a
+    single page, stay on the sequential path.
+
+    The pool is created on first use and kept for later cycles. Workers are spawned rather than forked, so they
+    don't inherit the poller's threads and locks; their log records go to the poller's handlers.
+    """
+
+    def __init__(self, workers=PARALLEL_WORKERS, min_items=PARALLEL_MIN_ITEMS):
+        self.workers = workers
+        self.min_items = min_items
+        self.executor = None
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def enabled_for(self, item_count, shards=None):
+        """Returns True if a listing of item_count items split into shards pages should go to the pool."""
+        return self.workers > 0 and item_count >= self.min_items and (shards is None or shards > 1)
+
+    def start(self):
+        """Starts the worker pool, if it isn't running yet, and returns it."""
+        with self.lock:
+            if self.executor is None:
+                context = multiprocessing.get_context("spawn")
+                log_queue = context.Queue()
+                root = logging.getLogger()
+                self.listener = QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+                self.listener.start()
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=context, initializer=init_worker,
+                                                    initargs=(log_queue, root.level))
+            return self.executor
+
+    def validate_pages(self, texts):
+        """
+        Parses, validates and prepares the pages of a listing in the pool. Returns the products, de-duplicated
+        by id in page order, and whether every page was valid. Returns None if the pool failed, in which case
+        the caller should fall back to the sequential path.
+        """
+        try:
+            results = list(self.start().map(validate_page, texts))
+        except BrokenProcessPool as e:
+            logging.error(f"Parallel validation failed, restarting the worker pool: {e}")
+            self.close()
+            return None
+
+        seen = set()
+        rows = []
+        for row in chain.from_iterable(filter(None, results)):
+            if row[ID_INDEX] not in seen:
+                seen.add(row[ID_INDEX])
+                rows.append(row)
+        return build_products(rows), None not in results
+
+    def fingerprints(self, products, fields):
+        """
+        Hashes the products' snapshot fingerprints over the given fields in the pool. Returns them keyed by
+        product id, or None if the pool failed.
+        """
+        rows = [(product.id, tuple(getattr(product, field, None) for field in fields)) for product in products]
+        size = max(1, math.ceil(len(rows) / (self.workers * PARALLEL_TASKS_PER_WORKER)))
+        try:
+            hashes = list(self.start().map(hash_products, [rows[i:i + size] for i in range(0, len(rows), size)]))
+        except BrokenProcessPool as e:
+            logging.error(f"Parallel hashing failed, restarting the worker pool: {e}")
+            self.close()
+            return None
+        return dict(zip((product_id for product_id, _ in rows), chain.from_iterable(hashes)))
+
+    def close(self):
+        """Stops the worker pool."""
+        with self.lock:
+            if self.executor is None:
+                return
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.listener.stop()
+            self.executor = None
+            self.listener = None
+
+
+# Process-wide pipeline shared by every target
+parallel_pipeline = ParallelPipeline()
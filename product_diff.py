@@ -0,0 +1,167 @@
+import os
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()  # Load environment variables
+
+logger = logging.getLogger(__name__)
+
+
+def as_flag(value):
+    """Converts SQLite's 0/1 and the API's booleans or "true"/"false" strings to a bool."""
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes")
+    return bool(value)
+
+
+def as_price(value):
+    """Converts a price to a float rounded to cents, so REAL round trips and string prices compare equal."""
+    return round(float(value), 2)
+
+
+# Type each tracked field is compared as. Stored and fetched values are converted before comparing, so a stored
+# 0/1, REAL or integer matches the API's bool, string or float for the same value.
+FIELD_TYPES = {
+    "brand": str, "displayName": str, "inStockQuantity": int, "orderableQuantity": int, "listPrice": as_price,
+    "b2c_proof": str, "b2c_size": str, "stockStatus": str, "lastModifiedDate": str, "shippable": as_flag,
+    "active": as_flag, "b2c_upc": str, "primaryFullImageURL": str, "url": str,
+}
+
+# How much a change to each field matters:
+#   ignore  the row isn't rewritten for it; the stored value catches up when the row is written for another reason
+#   store   the row is rewritten (and the stock/price history recorded) without a "changed" event
+#   notify  the row is rewritten and a "changed" event is emitted
+SIGNIFICANCE_LEVELS = ("ignore", "store", "notify")
+DEFAULT_FIELD_SIGNIFICANCE = {
+    "brand": "notify", "displayName": "notify", "inStockQuantity": "store", "orderableQuantity": "store",
+    "listPrice": "notify", "b2c_proof": "notify", "b2c_size": "notify", "stockStatus": "notify",
+    "lastModifiedDate": "ignore", "shippable": "notify", "active": "notify", "b2c_upc": "notify",
+    "primaryFullImageURL": "store", "url": "store",
+}
+
+# Relative list price move below which a price change is ignored (0.05 = 5%). Moves are measured against the
+# stored price, so small moves still add up to a stored change once they pass the threshold together.
+PRICE_CHANGE_THRESHOLD = float(os.getenv("PRICE_CHANGE_THRESHOLD", "0"))
+
+# Fields filled in from the stock response. None means the product had no stock entry this poll, not that its
+# stock is gone, so the stored value is kept.
+STOCK_FIELDS = ("inStockQuantity", "orderableQuantity", "stockStatus")
+
+# Transitions classified from a product's changes, each emitted as an event of that type
+TRANSITION_TYPES = ("restock", "sell_out", "price_drop", "price_raise", "status_change")
+
+
+def parse_field_significance(value, defaults=DEFAULT_FIELD_SIGNIFICANCE):
+    """
+    Returns defaults overridden by a FIELD_SIGNIFICANCE string of field:level pairs, such as
+    "primaryFullImageURL:ignore,inStockQuantity:notify". Malformed entries are logged and skipped.
+    """
+    significance = dict(defaults)
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        field, _, level = entry.partition(":")
+        field, level = field.strip(), level.strip().lower()
+        if level not in SIGNIFICANCE_LEVELS:
+            logger.warning(f"Ignoring FIELD_SIGNIFICANCE entry {entry!r}: the level must be one of "
+                            f"{', '.join(SIGNIFICANCE_LEVELS)}.")
+            continue
+        significance[field] = level
+    return significance
+
+
+FIELD_SIGNIFICANCE = parse_field_significance(os.getenv("FIELD_SIGNIFICANCE", ""))
+
+
+def normalize(field, value):
+    """Converts a stored or fetched value to the field's comparison type. Values that don't convert are kept."""
+    convert = FIELD_TYPES.get(field)
+    if value is None or convert is None:
+        return value
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def price_moved(old_price, new_price, threshold=PRICE_CHANGE_THRESHOLD):
+    """Returns True if the price moved by at least threshold relative to the old price."""
+    if old_price is None or new_price is None or not old_price or threshold <= 0:
+        return True
+    return abs(new_price - old_price) >= threshold * abs(old_price)
+
+
+class ProductChange:
+    """
+    The classified difference between a stored row and a product.
+
+    diff holds {field: {"old": ..., "new": ...}} with the normalized values of every field that changed and isn't
+    ignored, level is the highest significance among them ("ignore" if there are none), and transitions lists the
+    (type, diff) pair of each restock, sell-out, price move and status flip.
+    """
+
+    def __init__(self, diff, level, transitions):
+        self.diff = diff
+        self.level = level
+        self.transitions = transitions
+
+    @property
+    def stored(self):
+        """True if the row has to be rewritten."""
+        return self.level != "ignore"
+
+    @property
+    def notify(self):
+        """True if the change gets a "changed" event."""
+        return self.level == "notify"
+
+
+def classify_transitions(diff):
+    """Returns the (type, diff) pairs of the restock, sell-out, price and status transitions in a field diff."""
+    transitions = []
+
+    stock = diff.get("inStockQuantity")
+    if stock:
+        # A product that never had stock data gets its first value, which is neither a restock nor a sell-out
+        old_stock, new_stock = stock["old"], stock["new"]
+        if isinstance(old_stock, int) and isinstance(new_stock, int):
+            if old_stock <= 0 < new_stock:
+                transitions.append(("restock", {"inStockQuantity": stock}))
+            elif new_stock <= 0 < old_stock:
+                transitions.append(("sell_out", {"inStockQuantity": stock}))
+
+    price = diff.get("listPrice")
+    if price and isinstance(price["old"], float) and isinstance(price["new"], float):
+        transitions.append(("price_drop" if price["new"] < price["old"] else "price_raise", {"listPrice": price}))
+
+    status = diff.get("stockStatus")
+    if status and status["old"] is not None:
+        transitions.append(("status_change", {"stockStatus": status}))
+
+    return transitions
+
+
+def diff_product(existing_data, product, significance=None):
+    """Compares a stored row (a dict of tracked fields) with a product and classifies the difference."""
+    significance = significance or FIELD_SIGNIFICANCE
+    diff = {}
+    level = 0
+    for field, old_value in existing_data.items():
+        new_value = getattr(product, field, None)
+        # Most fields are equal as they are; only differing ones pay for the conversion
+        if old_value == new_value:
+            continue
+        field_level = SIGNIFICANCE_LEVELS.index(significance.get(field, "notify"))
+        if not field_level or (new_value is None and field in STOCK_FIELDS):
+            continue
+        old_value, new_value = normalize(field, old_value), normalize(field, new_value)
+        if old_value == new_value or (field == "listPrice" and not price_moved(old_value, new_value)):
+            continue
+        diff[field] = {"old": old_value, "new": new_value}
+        level = max(level, field_level)
+    return ProductChange(diff, SIGNIFICANCE_LEVELS[level], classify_transitions(diff))
+
+
+def keep_known_stock(existing_data, product):
+    """Fills the stock fields the product has no value for with the stored ones, so they aren't written as NULL."""
+    for field in STOCK_FIELDS:
+        if getattr(product, field, None) is None and existing_data.get(field) is not None:
+            product.__dict__[field] = existing_data[field]
@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from metrics import metrics
+
+load_dotenv()  # Load environment variables
+
+# Health check settings
+PROXY_CHECK_URL = os.getenv("PROXY_CHECK_URL", "https://httpbin.org/ip")
+PROXY_CHECK_TIMEOUT = float(os.getenv("PROXY_CHECK_TIMEOUT", "10"))
+PROXY_CHECK_WORKERS = int(os.getenv("PROXY_CHECK_WORKERS", "20"))
+# Where proxy scores are persisted, and how long a score is trusted before the proxy is probed again
+PROXY_SCORES_PATH = os.getenv("PROXY_SCORES_PATH", "proxy_scores.json")
+PROXY_SCORE_TTL = float(os.getenv("PROXY_SCORE_TTL", "3600"))
+# Rotate to the next healthy proxy on every request instead of only after a 403/503
+PROXY_ROTATE_EACH_REQUEST = os.getenv("PROXY_ROTATE_EACH_REQUEST", "false").lower() == "true"
+# Consecutive request failures after which a proxy is taken out of rotation
+PROXY_MAX_FAILURES = 3
+
+
+def proxy_label(proxy):
+    """Returns the proxy's host:port without credentials, for use in logs and metrics."""
+    parts = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+    return f"{parts.hostname}:{parts.port}" if parts.port else str(parts.hostname)
+
+
+def load_proxy_file(file_path):
+    """Loads the proxies listed in the proxy file, one per line."""
+    try:
+        with open(file_path, 'r') as f:
+            return [line.strip() for line in f.readlines() if line.strip()]
+    except FileNotFoundError:
+        logging.error(f"Proxy file {file_path} not found.")
+        return []
+
+
+class ProxyPool:
+    """
+    A scored pool of proxies.
+
+    Proxies are health checked concurrently against check_url, scored by success rate and latency, and handed out
+    in rotation across the healthy set. Scores are persisted to scores_path so a restart only re-probes proxies
+    whose score is older than score_ttl. A proxy dropped after repeated failures is probed again by recheck once
+    score_ttl has passed since it was dropped.
+    """
+
+    def __init__(self, proxies, check_url=PROXY_CHECK_URL, check_timeout=PROXY_CHECK_TIMEOUT,
+                 workers=PROXY_CHECK_WORKERS, scores_path=PROXY_SCORES_PATH, score_ttl=PROXY_SCORE_TTL):
+        self.proxies = list(dict.fromkeys(proxies))
+        self.check_url = check_url
+        self.check_timeout = check_timeout
+        self.workers = max(1, workers)
+        self.scores_path = scores_path
+        self.score_ttl = score_ttl
+        self.scores = {}
+        self.lock = threading.Lock()
+        self.rotation = []
+        self.rotation_index = 0
+        self.recheck_lock = threading.Lock()
+        self.direct_warned = False
+        self.load_scores()
+
+    def load_scores(self):
+        """Loads persisted scores for the proxies in the pool."""
+        if not self.scores_path or not os.path.exists(self.scores_path):
+            return
+        try:
+            with open(self.scores_path, 'r') as f:
+                stored_scores = json.load(f)
+            self.scores = {proxy: stored_scores[proxy] for proxy in self.proxies if proxy in stored_scores}
+            logging.debug(f"Loaded scores for {len(self.scores)} proxies from {self.scores_path}.")
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load proxy scores from {self.scores_path}: {e}")
+
+    def save_scores(self):
+        """Persists the current scores, replacing the file atomically."""
+        if not self.scores_path:
+            return
+        with self.lock:
+            snapshot = dict(self.scores)
+        tmp_path = f"{self.scores_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.scores_path)
+        except OSError as e:
+            logging.warning(f"Could not save proxy scores to {self.scores_path}: {e}")
+
+    def check_proxy(self, proxy):
+        """Probes a single proxy against the health check URL. Returns (healthy, latency)."""
+        import requests
+
+        start = time.perf_counter()
+        try:
+            response = requests.get(self.check_url, proxies={"http": proxy, "https": proxy},
+                                    timeout=self.check_timeout)
+            latency = time.perf_counter() - start
+            if response.status_code == 200:
+                return True, latency
+            logging.warning(f"Proxy {proxy} failed with status code {response.status_code}")
+        except requests.RequestException as e:
+            logging.error(f"Error with proxy {proxy}: {e}")
+        return False, time.perf_counter() - start
+
+    def needs_check(self, proxy, now):
+        """Returns True if the proxy has no score or its score is older than the TTL."""
+        score = self.scores.get(proxy)
+        return score is None or now - score.get("checked_at", 0) > self.score_ttl
+
+    def probe(self, proxies):
+        """Health checks the given proxies with a bounded thread pool and replaces their scores with the results."""
+        logging.info(f"Checking {len(proxies)} proxies with {min(self.workers, len(proxies))} workers...")
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(proxies))) as executor:
+            results = list(executor.map(self.check_proxy, proxies))
+
+        checked_at = time.time()
+        with self.lock:
+            for proxy, (healthy, latency) in zip(proxies, results):
+                self.scores[proxy] = {
+                    "healthy": healthy,
+                    "latency": latency,
+                    "successes": 1 if healthy else 0,
+                    "failures": 0 if healthy else 1,
+                    "consecutive_failures": 0 if healthy else PROXY_MAX_FAILURES,
+                    "checked_at": checked_at,
+                }
+
+    def check_all(self, force=False):
+        """Health checks every proxy without a fresh score, using a bounded thread pool."""
+        now = time.time()
+        to_check = [proxy for proxy in self.proxies if force or self.needs_check(proxy, now)]
+
+        if to_check:
+            self.probe(to_check)
+            self.save_scores()
+
+        self.rebuild_rotation()
+        logging.info(f"{len(self.rotation)} of {len(self.proxies)} proxies are healthy.")
+        return self.healthy_proxies()
+
+    def recheck(self):
+        """
+        Probes the unhealthy proxies whose score is older than score_ttl again, putting the ones that pass back
+        into rotation, and saves the scores. Runs between poll cycles; a call made while another thread is
+        rechecking returns at once.
+        """
+        if not self.recheck_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            with self.lock:
+                to_check = [proxy for proxy in self.proxies
+                            if not self.scores.get(proxy, {}).get("healthy") and self.needs_check(proxy, now)]
+            if to_check:
+                self.probe(to_check)
+                self.rebuild_rotation()
+                logging.info(f"{len(self.rotation)} of {len(self.proxies)} proxies are healthy after the recheck.")
+            self.save_scores()
+        finally:
+            self.recheck_lock.release()
+
+    def score(self, proxy):
+        """Scores a proxy by its success rate, penalised by its average latency. Higher is better."""
+        score = self.scores.get(proxy)
+        if not score or not score.get("healthy"):
+            return 0.0
+        attempts = score["successes"] + score["failures"]
+        success_rate = score["successes"] / attempts if attempts else 0.0
+        return success_rate / (1.0 + score["latency"])
+
+    def rebuild_rotation(self):
+        """Orders the healthy proxies by score for rotation."""
+        with self.lock:
+            self.rotation = sorted(
+                (proxy for proxy in self.proxies if self.scores.get(proxy, {}).get("healthy")),
+                key=self.score, reverse=True
+            )
+            self.rotation_index = 0
+            if self.rotation:
+                self.direct_warned = False
+        metrics.set("proxies_healthy", len(self.rotation))
+
+    def healthy_proxies(self):
+        """Returns the healthy proxies, best score first."""
+        return list(self.rotation)
+
+    def next_proxy(self):
+        """Returns the next healthy proxy in rotation, or None if there are none."""
+        with self.lock:
+            if not self.rotation:
+                return None
+            proxy = self.rotation[self.rotation_index % len(self.rotation)]
+            self.rotation_index += 1
+            return proxy
+
+    def report_success(self, proxy, latency):
+        """Records a successful request through the proxy."""
+        if proxy not in self.scores:
+            return
+        with self.lock:
+            score = self.scores[proxy]
+            score["successes"] += 1
+            score["consecutive_failures"] = 0
+            # Exponential moving average keeps the latency current without storing samples
+            score["latency"] = 0.8 * score["latency"] + 0.2 * latency
+        metrics.observe("proxy_request_seconds", latency, proxy=proxy_label(proxy))
+
+    def report_failure(self, proxy):
+        """Records a failed request through the proxy, dropping it from rotation after repeated failures."""
+        if proxy not in self.scores:
+            return
+        with self.lock:
+            score = self.scores[proxy]
+            score["failures"] += 1
+            score["consecutive_failures"] += 1
+            dropped = score["consecutive_failures"] >= PROXY_MAX_FAILURES and score["healthy"]
+            if dropped:
+                score["healthy"] = False
+                # recheck probes it again once score_ttl has passed from now
+                score["checked_at"] = time.time()
+        metrics.inc("proxy_failures_total", proxy=proxy_label(proxy))
+        if dropped:
+            logging.warning(f"Proxy {proxy} failed {PROXY_MAX_FAILURES} times in a row. Removing it from rotation.")
+            self.rebuild_rotation()
+
+    def apply(self, session, proxy=None):
+        """
+        Binds the session to the given proxy, or the next one in rotation. Returns the proxy used. With no healthy
+        proxy left, the session falls back to the direct connection, which is logged once until a proxy recovers.
+        """
+        proxy = proxy or self.next_proxy()
+        if proxy:
+            session.proxies.update({"http": proxy, "https": proxy})
+        else:
+            session.proxies.clear()
+            if self.proxies and not self.direct_warned:
+                self.direct_warned = True
+                logging.warning(f"None of the {len(self.proxies)} proxies is healthy. Falling back to the direct "
+                                f"connection until one passes a recheck.")
+        return proxy
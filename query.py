@@ -0,0 +1,334 @@
+"""
+Read-only query API over the stored products.
+
+Products can be filtered by target, brand, stock status, price, size, proof and last update, searched by name and
+brand through the products_fts full-text index, and sorted by any of SORT_KEYS. Results are read by iterating the
+SQLite cursor, and pages are cut with keyset pagination: each page returns an opaque token of its last row's sort
+value and rowid, so a later page costs the same as the first however deep it is.
+
+Usage:
+    python query.py --search bourbon --in-stock --max-price 100 --sort price
+    python query.py --serve [--port 8081]
+
+The server answers GET /products with one JSON page ({"items": [...], "next": token}) and GET /products.jsonl
+with every match as JSON lines, taking the same filters as query parameters (e.g. ?brand=Buffalo%20Trace&limit=20).
+"""
+import os
+import json
+import base64
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+from db_layer import open_connection, apply_migrations
+
+load_dotenv()  # Load environment variables
+
+# Where the query server listens. It has no authentication, so keep it on localhost.
+QUERY_HOST = os.getenv("QUERY_HOST", "127.0.0.1")
+QUERY_PORT = int(os.getenv("QUERY_PORT", "8081"))
+# Rows per page when no limit is given, and the most a page can hold
+QUERY_PAGE_SIZE = 50
+QUERY_MAX_PAGE_SIZE = 1000
+# A search matching fewer products than this drives the query from the full-text index; a broader one scans the
+# sort order's index and checks each row against the matches instead, so it can stop after one page
+SEARCH_DRIVE_LIMIT = 1000
+
+RESULT_FIELDS = [
+    "target", "id", "brand", "displayName", "listPrice", "stockStatus", "inStockQuantity", "orderableQuantity",
+    "b2c_size", "b2c_proof", "url", "last_updated", "removed_at"
+]
+
+# Sort keys and the expression each orders by. Every expression matches one of the indexes from migration 8, and
+# migration 10 pairs each with the brand, stock_status and size filters.
+SORT_KEYS = {
+    "name": "displayName COLLATE NOCASE",
+    "brand": "brand COLLATE NOCASE",
+    "price": "listPrice",
+    "proof": "CAST(b2c_proof AS REAL)",
+    "size": "b2c_size COLLATE NOCASE",
+    "last_updated": "last_updated",
+}
+
+
+def parse_timestamp(value):
+    """Converts a unix timestamp or an ISO date/time (UTC) to the format SQLite's CURRENT_TIMESTAMP stores."""
+    try:
+        moment = datetime.fromtimestamp(float(value), timezone.utc)
+    except ValueError:
+        moment = datetime.fromisoformat(str(value))
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Query filters, their parser, and the SQL condition each adds
+FILTERS = {
+    # The unary + keeps the primary key out of index selection: a target holds most of the few there are, so
+    # scanning the sort order's index and checking the target is cheaper than sorting every product of it
+    "target": (str, "+target = ?"),
+    "brand": (str, "brand = ? COLLATE NOCASE"),
+    "stock_status": (str, "stockStatus = ?"),
+    "size": (str, "b2c_size = ? COLLATE NOCASE"),
+    "min_price": (float, "listPrice >= ?"),
+    "max_price": (float, "listPrice <= ?"),
+    "min_proof": (float, "CAST(b2c_proof AS REAL) >= ?"),
+    "max_proof": (float, "CAST(b2c_proof AS REAL) <= ?"),
+    "updated_since": (parse_timestamp, "last_updated >= ?"),
+}
+
+
+def fts_query(text):
+    """Turns free text into an FTS5 query matching every word as a prefix, with FTS syntax characters escaped."""
+    words = text.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+def encode_token(sort_value, rowid):
+    """Encodes a page's last sort value and rowid as an opaque token."""
+    return base64.urlsafe_b64encode(json.dumps([sort_value, rowid]).encode()).decode()
+
+
+def decode_token(token):
+    """Decodes a token from encode_token. Raises ValueError if it is malformed."""
+    try:
+        sort_value, rowid = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid page token: {token}") from e
+    if not isinstance(rowid, int):
+        raise ValueError(f"Invalid page token: {token}")
+    return sort_value, rowid
+
+
+class ProductQuery:
+    """
+    A product query: filters, full-text search, sort order and an optional page token.
+
+    Filters are the keys of FILTERS, plus search (free text over names and brands), in_stock (inStockQuantity
+    above zero) and include_removed (also match tombstoned products). Raises ValueError for an unknown filter or
+    sort key, or a value that doesn't parse.
+    """
+
+    def __init__(self, search=None, sort="name", descending=False, after=None, in_stock=False,
+                 include_removed=False, **filters):
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key {sort!r}. Use one of: {', '.join(SORT_KEYS)}")
+        unknown = set(filters) - set(FILTERS)
+        if unknown:
+            raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+        self.filters = {name: FILTERS[name][0](value) for name, value in filters.items() if value not in (None, "")}
+        self.search = fts_query(search) if search else None
+        self.sort = sort
+        self.descending = descending
+        self.after = decode_token(after) if after else None
+        self.in_stock = in_stock
+        self.include_removed = include_removed
+
+    @classmethod
+    def from_params(cls, params):
+        """Builds a query from string parameters, e.g. an HTTP query string. Returns the query and the page size."""
+        params = dict(params)
+        flags = {name: params.pop(name, "").lower() in ("1", "true", "yes")
+                 for name in ("descending", "in_stock", "include_removed")}
+        limit = min(int(params.pop("limit", QUERY_PAGE_SIZE)), QUERY_MAX_PAGE_SIZE)
+        if limit <= 0:
+            raise ValueError("limit must be positive")
+        return cls(**params, **flags), limit
+
+    def sql(self, limit=None, broad_search=False):
+        """
+        Returns the SELECT statement and its parameters. With broad_search, the search condition is kept out of
+        index selection (see SEARCH_DRIVE_LIMIT).
+        """
+        sort_expression = SORT_KEYS[self.sort]
+        conditions = [FILTERS[name][1] for name in self.filters]
+        params = list(self.filters.values())
+
+        if not self.include_removed:
+            # Matches the WHERE clause of the partial indexes, so they can be used
+            conditions.append("removed_at IS NULL")
+        if self.in_stock:
+            conditions.append("inStockQuantity > 0")
+        if self.search:
+            # The unary + stops SQLite from driving the query from the full-text matches
+            conditions.append(f"{'+' if broad_search else ''}rowid IN "
+                              f"(SELECT rowid FROM products_fts WHERE products_fts MATCH ?)")
+            params.append(self.search)
+
+        if self.after:
+            # SQLite sorts NULLs first, so they come before every value ascending and after every value descending
+            sort_value, rowid = self.after
+            if sort_value is None and not self.descending:
+                conditions.append(f"(({sort_expression}) IS NULL AND rowid > ? OR ({sort_expression}) IS NOT NULL)")
+                params.append(rowid)
+            elif sort_value is None:
+                conditions.append(f"({sort_expression}) IS NULL AND rowid < ?")
+                params.append(rowid)
+            # The leading inclusive bound is redundant but lets SQLite seek into the sort index
+            elif not self.descending:
+                conditions.append(f"{sort_expression} >= ? AND ({sort_expression} > ? OR rowid > ?)")
+                params += [sort_value, sort_value, rowid]
+            else:
+                conditions.append(f"({sort_expression} <= ? AND ({sort_expression} < ? OR rowid < ?) "
+                                  f"OR ({sort_expression}) IS NULL)")
+                params += [sort_value, sort_value, rowid]
+
+        direction = "DESC" if self.descending else "ASC"
+        sql = (
+            f"SELECT {', '.join(RESULT_FIELDS)}, {sort_expression}, rowid FROM products "
+            f"WHERE {' AND '.join(conditions)} "
+            f"ORDER BY {sort_expression} {direction}, rowid {direction}"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return sql, params
+
+
+def is_broad_search(conn, search):
+    """Returns True if the full-text search matches at least SEARCH_DRIVE_LIMIT products."""
+    count = conn.execute(
+        "SELECT COUNT(*) FROM (SELECT rowid FROM products_fts WHERE products_fts MATCH ? LIMIT ?)",
+        (search, SEARCH_DRIVE_LIMIT)
+    ).fetchone()[0]
+    return count >= SEARCH_DRIVE_LIMIT
+
+
+def iter_products(query, conn, limit=None):
+    """
+    Yields the products matching the query as dicts, read from the cursor one row at a time. Each dict also holds
+    the page token that resumes after it under "_token".
+    """
+    sql, params = query.sql(limit, broad_search=bool(query.search) and is_broad_search(conn, query.search))
+    for row in conn.execute(sql, params):
+        product = dict(zip(RESULT_FIELDS, row))
+        product["_token"] = encode_token(row[-2], row[-1])
+        yield product
+
+
+def query_page(query, conn, limit=QUERY_PAGE_SIZE):
+    """Returns one page of matches as {"items": [...], "next": token}, with next None on the last page."""
+    items = list(iter_products(query, conn, limit + 1))
+    next_token = items[limit - 1]["_token"] if len(items) > limit else None
+    items = items[:limit]
+    for item in items:
+        del item["_token"]
+    return {"items": items, "next": next_token}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Serves /products as JSON pages and /products.jsonl as a stream of JSON lines."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path not in ("/products", "/products.jsonl"):
+            self.send_error(404)
+            return
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        conn = open_connection()
+        try:
+            query, limit = ProductQuery.from_params(params)
+            if url.path == "/products":
+                body = json.dumps(query_page(query, conn, limit)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                rows = iter_products(query, conn, int(params["limit"]) if "limit" in params else None)
+                first = next(rows, None)
+                # Errors surface on the first row, before the status line is sent
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                for product in [first] if first else []:
+                    self.write_line(product)
+                for product in rows:
+                    self.write_line(product)
+        except (ValueError, TypeError, sqlite3.OperationalError) as e:
+            self.send_error(400, str(e))
+        except (BrokenPipeError, ConnectionResetError):
+            logging.debug("Query client disconnected.")
+        finally:
+            conn.close()
+
+    def write_line(self, product):
+        del product["_token"]
+        self.wfile.write((json.dumps(product) + "\n").encode())
+
+    def log_message(self, format, *args):
+        logging.debug(f"Query request: {format % args}")
+
+
+def start_query_server(port=QUERY_PORT, host=QUERY_HOST):
+    """Starts the query server on a background thread and returns it."""
+    server = ThreadingHTTPServer((host, int(port)), QueryHandler)
+    threading.Thread(target=server.serve_forever, name="query-server", daemon=True).start()
+    logging.info(f"Serving product queries on http://{host}:{server.server_port}/products")
+    return server
+
+
+def parse_args():
+    """Parses the command line arguments."""
+    parser = argparse.ArgumentParser(description="Query the stored products.")
+    parser.add_argument("--search", help="Words to match in product names and brands, as prefixes.")
+    parser.add_argument("--target")
+    parser.add_argument("--brand")
+    parser.add_argument("--stock-status")
+    parser.add_argument("--size", help="Bottle size, e.g. 750ML.")
+    parser.add_argument("--min-price", type=float)
+    parser.add_argument("--max-price", type=float)
+    parser.add_argument("--min-proof", type=float)
+    parser.add_argument("--max-proof", type=float)
+    parser.add_argument("--updated-since", help="Unix timestamp or ISO date/time (UTC).")
+    parser.add_argument("--in-stock", action="store_true", help="Only products with stock on hand.")
+    parser.add_argument("--include-removed", action="store_true", help="Also match products no longer listed.")
+    parser.add_argument("--sort", default="name", choices=list(SORT_KEYS))
+    parser.add_argument("--descending", action="store_true")
+    parser.add_argument("--limit", type=int, help="Stop after this many products.")
+    parser.add_argument("--json", action="store_true", help="Print JSON lines instead of a table.")
+    parser.add_argument("--serve", action="store_true", help="Serve queries over HTTP instead.")
+    parser.add_argument("--port", type=int, default=QUERY_PORT)
+    return parser.parse_args()
+
+
+def main():
+    """Runs one query and prints the matches as they are read, or serves queries over HTTP."""
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    conn = open_connection()
+    apply_migrations(conn)
+
+    if args.serve:
+        conn.close()
+        server = start_query_server(args.port)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    query = ProductQuery(
+        search=args.search, sort=args.sort, descending=args.descending, in_stock=args.in_stock,
+        include_removed=args.include_removed, target=args.target, brand=args.brand, stock_status=args.stock_status,
+        size=args.size, min_price=args.min_price, max_price=args.max_price, min_proof=args.min_proof,
+        max_proof=args.max_proof, updated_since=args.updated_since,
+    )
+    for product in iter_products(query, conn, args.limit):
+        del product["_token"]
+        if args.json:
+            print(json.dumps(product))
+        else:
+            price = f"${product['listPrice']:.2f}" if product["listPrice"] is not None else "-"
+            print(f"{price:>10}  {product['stockStatus'] or '-':<12} {product['displayName']} ({product['brand']}, "
+                  f"{product['b2c_size']}, {product['b2c_proof']} proof)")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
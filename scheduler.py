@@ -0,0 +1,100 @@
+import os
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+from metrics import metrics
+
+load_dotenv()  # Load environment variables
+
+# Polling intervals in seconds
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "60"))
+POLL_INTERVAL_MIN = float(os.getenv("POLL_INTERVAL_MIN", "10"))
+POLL_INTERVAL_MAX = float(os.getenv("POLL_INTERVAL_MAX", "300"))
+
+# Values of the b2c_* flags that mark an item as hot
+TRUTHY_FLAGS = {"true", "yes", "y", "1"}
+
+
+def is_hot_product(product):
+    """Returns True if the product is coming soon or highly allocated."""
+    for flag in ("b2c_comingSoon", "b2c_highlyAllocatedProduct"):
+        value = getattr(product, flag, None)
+        if value is not None and str(value).strip().lower() in TRUTHY_FLAGS:
+            return True
+    return False
+
+
+class AdaptiveScheduler:
+    """
+    Runs a poll cycle repeatedly, tightening the interval when the page is hot and backing off when it is quiet.
+
+    The cycle callable returns a dict with at least "hot" (number of coming soon/highly allocated items) and
+    "moved" (number of new or changed products). Cycle latency and drift (how late a cycle started compared to
+    when it was scheduled) are logged after each cycle and kept on the instance. Give each scheduler a name when
+    several run side by side; it prefixes the log lines and labels the gauges.
+    """
+
+    def __init__(self, cycle, interval=POLL_INTERVAL, min_interval=POLL_INTERVAL_MIN,
+                 max_interval=POLL_INTERVAL_MAX, tighten_factor=0.5, backoff_factor=1.5, name=None):
+        self.cycle = cycle
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min(max(interval, min_interval), max_interval)
+        self.tighten_factor = tighten_factor
+        self.backoff_factor = backoff_factor
+        self.stop_event = threading.Event()
+
+        self.cycles = 0
+        self.last_latency = 0.0
+        self.last_drift = 0.0
+        self.max_drift = 0.0
+
+    def next_interval(self, cycle_stats):
+        """Computes the next polling interval from the stats of the cycle that just finished."""
+        if cycle_stats and (cycle_stats.get("hot") or cycle_stats.get("moved")):
+            self.interval = max(self.min_interval, self.interval * self.tighten_factor)
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff_factor)
+        return self.interval
+
+    def log_prefix(self):
+        """Returns the "[name] " prefix for log lines, or an empty string for an unnamed scheduler."""
+        return f"[{self.name}] " if self.name else ""
+
+    def stop(self):
+        """Asks the scheduler to stop after the current cycle."""
+        self.stop_event.set()
+
+    def run(self):
+        """Runs cycles until stop() is called."""
+        scheduled_at = time.monotonic()
+
+        while not self.stop_event.is_set():
+            started_at = time.monotonic()
+            self.last_drift = max(0.0, started_at - scheduled_at)
+            self.max_drift = max(self.max_drift, self.last_drift)
+
+            try:
+                cycle_stats = self.cycle()
+            except Exception as e:
+                logging.error(f"{self.log_prefix()}Unexpected error during poll cycle: {e}")
+                cycle_stats = None
+
+            self.cycles += 1
+            self.last_latency = time.monotonic() - started_at
+            interval = self.next_interval(cycle_stats)
+            labels = {"target": self.name} if self.name else {}
+            metrics.set("cycle_drift_seconds", self.last_drift, **labels)
+            metrics.set("poll_interval_seconds", interval, **labels)
+
+            logging.info(
+                f"{self.log_prefix()}Cycle {self.cycles} completed in {self.last_latency:.2f} seconds "
+                f"(drift {self.last_drift:.2f}s, max drift {self.max_drift:.2f}s). "
+                f"Next poll in {interval:.1f} seconds."
+            )
+
+            # Schedule from the planned start so slow cycles don't push every later poll back
+            scheduled_at = max(scheduled_at + interval, started_at + self.min_interval)
+            self.stop_event.wait(max(0.0, scheduled_at - time.monotonic()))
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from dotenv import load_dotenv
+from metrics import metrics
+
+load_dotenv()  # Load environment variables
+
+logger = logging.getLogger(__name__)
+
+# Where session state (cookies, client identifier, proxy) is kept between runs
+SESSION_STATE_PATH = os.getenv("SESSION_STATE_PATH", "session_state.json")
+# Sessions are rotated once they are older than SESSION_MAX_AGE seconds or after SESSION_MAX_FORBIDDEN 403s in a row
+SESSION_MAX_AGE = float(os.getenv("SESSION_MAX_AGE", "3600"))
+SESSION_MAX_FORBIDDEN = int(os.getenv("SESSION_MAX_FORBIDDEN", "2"))
+# TLS client identifiers that rotated sessions cycle through
+SESSION_CLIENT_IDENTIFIERS = [
+    identifier.strip() for identifier in os.getenv("SESSION_CLIENT_IDENTIFIERS", "chrome_120").split(",")
+    if identifier.strip()
+]
+
+
+def export_cookies(cookie_jar):
+    """Returns the cookies of a jar as a list of JSON-serialisable dicts."""
+    return [
+        {"name": cookie.name, "value": cookie.value, "domain": cookie.domain, "path": cookie.path,
+         "expires": cookie.expires, "secure": cookie.secure}
+        for cookie in cookie_jar
+    ]
+
+
+def import_cookies(cookie_jar, cookies, now=None):
+    """Adds exported cookies to a jar, skipping the ones that expired."""
+    now = now or time.time()
+    for cookie in cookies:
+        if cookie.get("expires") and cookie["expires"] < now:
+            continue
+        cookie_jar.set(cookie["name"], cookie["value"], domain=cookie.get("domain", ""),
+                       path=cookie.get("path", "/"), expires=cookie.get("expires"), secure=cookie.get("secure", False))
+
+
+class SessionPool:
+    """
+    Keeps one long-lived TLS session per key (a target, or one of a target's stock workers).
+
+    A session's cookies (including any anti-bot tokens the site sets), client identifier and proxy are saved to
+    state_path, so the next run starts from the same identity instead of a cold one. A session is rotated when
+    it is older than max_age or after max_forbidden consecutive 403s: its TLS state and cookies are dropped and it
+    moves to the next client identifier and proxy. Rotation happens in place, so callers holding the session keep
+    a valid object.
+
+    The saved state is read on first use rather than on construction, so a pool created at import time doesn't
+    touch the file, or log, before the application has configured logging.
+    """
+
+    def __init__(self, factory, state_path=SESSION_STATE_PATH, max_age=SESSION_MAX_AGE,
+                 max_forbidden=SESSION_MAX_FORBIDDEN, client_identifiers=None):
+        self.factory = factory
+        self.state_path = state_path
+        self.max_age = max_age
+        self.max_forbidden = max_forbidden
+        self.client_identifiers = client_identifiers or SESSION_CLIENT_IDENTIFIERS or ["chrome_120"]
+        self.entries = {}
+        self.saved_state = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def ensure_loaded(self):
+        """Loads the saved session state the first time the pool is used."""
+        with self.lock:
+            if not self.loaded:
+                self.loaded = True
+                self.load_state()
+
+    def load_state(self):
+        """Loads the session state saved by a previous run."""
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r') as f:
+                self.saved_state = json.load(f)
+            logger.debug(f"Loaded the state of {len(self.saved_state)} sessions from {self.state_path}.")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load session state from {self.state_path}: {e}")
+
+    def save_state(self):
+        """Saves the state of every open session, replacing the file atomically."""
+        # A pool that was never used has nothing to add to the saved state
+        if not self.state_path or not self.loaded:
+            return
+        with self.lock:
+            state = dict(self.saved_state)
+            for key, entry in self.entries.items():
+                session = entry["session"]
+                state[key] = {
+                    "client_identifier": session.client_identifier,
+                    "proxy": session.proxies.get("http"),
+                    "cookies": export_cookies(session.cookies),
+                    "created_at": entry["created_at"],
+                }
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.warning(f"Could not save session state to {self.state_path}: {e}")
+
+    def next_client_identifier(self, current=None):
+        """Returns the client identifier after current in the rotation."""
+        if current not in self.client_identifiers:
+            return self.client_identifiers[0]
+        return self.client_identifiers[(self.client_identifiers.index(current) + 1) % len(self.client_identifiers)]
+
+    def bind_proxy(self, session, proxy_pool, proxy=None):
+        """Binds the session to proxy if it is still healthy, otherwise to the next proxy in rotation."""
+        if proxy_pool is None:
+            return
+        if proxy and proxy not in proxy_pool.healthy_proxies():
+            proxy = None
+        proxy_pool.apply(session, proxy)
+
+    def acquire(self, key, proxy_pool=None):
+        """Returns the session for key, restoring it from the saved state or creating it on first use."""
+        self.ensure_loaded()
+        with self.lock:
+            entry = self.entries.get(key)
+            saved = self.saved_state.pop(key, None) if entry is None else None
+
+        if entry is None:
+            now = time.time()
+            if saved and now - saved.get("created_at", 0) < self.max_age:
+                session = self.factory(saved.get("client_identifier") or self.client_identifiers[0])
+                import_cookies(session.cookies, saved.get("cookies", []), now)
+                self.bind_proxy(session, proxy_pool, saved.get("proxy"))
+                created_at = saved["created_at"]
+                logger.debug(f"Restored session {key} with {len(session.cookies)} cookies.")
+            else:
+                session = self.factory(self.client_identifiers[0])
+                self.bind_proxy(session, proxy_pool)
+                created_at = now
+            session.pool_key = key
+            entry = {"session": session, "created_at": created_at, "forbidden": 0}
+            with self.lock:
+                entry = self.entries.setdefault(key, entry)
+
+        if time.time() - entry["created_at"] > self.max_age:
+            self.rotate(entry["session"], proxy_pool, reason="age")
+        return entry["session"]
+
+    def rotate(self, session, proxy_pool=None, reason="forbidden"):
+        """Drops the session's TLS state and cookies and moves it to the next client identifier and proxy."""
+        from requests.cookies import cookiejar_from_dict
+
+        key = getattr(session, "pool_key", None)
+        try:
+            session.close()
+        except Exception as e:
+            logger.debug(f"Error closing session {key}: {e}")
+        # A new session id makes tls_client start a fresh session on the next request
+        session._session_id = str(uuid.uuid4())
+        session.cookies = cookiejar_from_dict({})
+        session.client_identifier = self.next_client_identifier(session.client_identifier)
+        self.bind_proxy(session, proxy_pool)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry["created_at"] = time.time()
+                entry["forbidden"] = 0
+        metrics.inc("sessions_rotated_total", reason=reason)
+        logger.info(f"Rotated session {key} ({reason}). Now using {session.client_identifier}.")
+
+    def report(self, session, status_code, proxy_pool=None):
+        """Records a response status for a pooled session, rotating it after max_forbidden 403s in a row."""
+        key = getattr(session, "pool_key", None)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            if status_code == 403:
+                entry["forbidden"] += 1
+                rotate = entry["forbidden"] >= self.max_forbidden
+            else:
+                entry["forbidden"] = 0
+                rotate = False
+        if rotate:
+            self.rotate(session, proxy_pool)
+
+    def close(self):
+        """Saves the session state and closes every session."""
+        self.save_state()
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+        for entry in entries:
+            entry["session"].close()
@@ -0,0 +1,158 @@
+import os
+import mmap
+import struct
+import hashlib
+import logging
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()  # Load environment variables
+
+# Directory of the per-target catalog snapshots. Set it to an empty string to always diff against SQLite.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+
+# File layout: magic, sync generation, record count and the complete flag, then (id hash, fields hash) pairs of
+# unsigned 64-bit integers sorted by id hash
+SNAPSHOT_MAGIC = b"WMSNAP01"
+SNAPSHOT_HEADER = struct.Struct("<8sQQQ")
+
+
+def hash64(text):
+    """Returns a 64-bit hash of a string."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def fields_hash(values):
+    """Returns a 64-bit hash of a tuple of field values."""
+    return hash64(repr(values))
+
+
+def product_fields_hash(product, fields):
+    """Returns a 64-bit hash of the product's values for the given fields."""
+    return fields_hash(tuple(getattr(product, field, None) for field in fields))
+
+
+class CatalogSnapshot:
+    """
+    The last stored state of one target's catalog: a 64-bit hash of each product id mapped to a 64-bit hash of
+    its tracked fields, plus the sync generation it was taken at.
+
+    A product whose hashes match was stored with exactly these values, so it is unchanged without looking at
+    SQLite. The generation ties the snapshot to the database: every sync that writes bumps the target's
+    generation in the same transaction, so a snapshot from before a crash or from another database no longer
+    matches and is discarded. A complete snapshot holds every live product of the target, so products missing
+    from a listing can be found without querying SQLite.
+    """
+
+    def __init__(self, entries=None, generation=0, complete=False):
+        self.entries = entries or {}
+        self.generation = generation
+        self.complete = complete
+
+    @classmethod
+    def load(cls, path):
+        """Reads a snapshot file through a memory map. Returns None if it is missing or malformed."""
+        try:
+            with open(path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    magic, generation, count, complete = SNAPSHOT_HEADER.unpack_from(mapped, 0)
+                    if magic != SNAPSHOT_MAGIC or len(mapped) != SNAPSHOT_HEADER.size + count * 16:
+                        logging.warning(f"Ignoring malformed snapshot {path}.")
+                        return None
+                    view = memoryview(mapped)[SNAPSHOT_HEADER.size:]
+                    try:
+                        values = view.cast("Q")
+                        # The pairs are unpacked in bulk by the buffer protocol rather than record by record
+                        entries = dict(zip(values[0::2], values[1::2]))
+                    finally:
+                        del values
+                        view.release()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error) as e:
+            logging.warning(f"Could not read snapshot {path}: {e}")
+            return None
+        return cls(entries, generation, bool(complete))
+
+    def save(self, path):
+        """Writes the snapshot to path, replacing the file atomically."""
+        records = bytearray(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.generation, len(self.entries), self.complete))
+        for id_hash in sorted(self.entries):
+            records += struct.pack("<QQ", id_hash, self.entries[id_hash])
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(records)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not save snapshot {path}: {e}")
+
+
+class SnapshotCache:
+    """Holds the in-memory snapshot of each target, loading them from directory on first use."""
+
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = directory
+        self.snapshots = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def path(self, target):
+        return os.path.join(self.directory, f"{target}.snap")
+
+    def get(self, target, generation):
+        """Returns the target's snapshot if it matches the database's sync generation, otherwise None."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            snapshot = self.snapshots.get(target)
+            if snapshot is None:
+                snapshot = CatalogSnapshot.load(self.path(target))
+                if snapshot is not None:
+                    self.snapshots[target] = snapshot
+        if snapshot is None:
+            return None
+        if snapshot.generation != generation:
+            logging.info(f"Snapshot of {target} is out of date with the database. Rebuilding it.")
+            self.discard(target)
+            return None
+        return snapshot
+
+    def put(self, target, snapshot):
+        """Replaces the target's in-memory snapshot."""
+        if self.enabled:
+            with self.lock:
+                self.snapshots[target] = snapshot
+                self.dirty.add(target)
+
+    def discard(self, target):
+        """Forgets the target's snapshot, in memory and on disk."""
+        with self.lock:
+            self.snapshots.pop(target, None)
+            self.dirty.discard(target)
+        if self.enabled:
+            try:
+                os.remove(self.path(target))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Could not remove snapshot {self.path(target)}: {e}")
+
+    def save(self, target):
+        """Writes the target's snapshot to disk if it changed since it was last written."""
+        with self.lock:
+            if target not in self.dirty:
+                return
+            self.dirty.discard(target)
+            snapshot = self.snapshots.get(target)
+        if snapshot is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            snapshot.save(self.path(target))
+
+
+# Process-wide snapshot cache shared by every target
+snapshot_cache = SnapshotCache()
@@ -0,0 +1,54 @@
+import os
+import json
+import logging
+from typing import List
+from dotenv import load_dotenv
+from pydantic import TypeAdapter
+from models import TargetConfig
+from db_layer import DEFAULT_TARGET
+
+load_dotenv()  # Load environment variables
+
+# JSON file listing the monitored targets. Without it, PRODUCT_URL/STOCK_URL form a single "default" target.
+TARGETS_FILE = os.getenv("TARGETS_FILE")
+
+target_list_adapter = TypeAdapter(List[TargetConfig])
+
+
+def default_target():
+    """Returns the single target described by PRODUCT_URL, STOCK_URL and TELEGRAM_GROUP_CHAT_ID."""
+    return TargetConfig(
+        name=DEFAULT_TARGET,
+        product_url=os.getenv("PRODUCT_URL") or "",
+        stock_url=os.getenv("STOCK_URL") or "",
+        chat_id=os.getenv("TELEGRAM_GROUP_CHAT_ID"),
+    )
+
+
+def load_targets(file_path=None):
+    """
+    Loads the targets from the targets file, or returns the default target if no file is configured.
+
+    The file holds a JSON list of objects with name, product_url and stock_url, and optionally chat_id,
+    poll_interval, min_interval and max_interval. Target names must be unique since they scope the stored rows.
+    """
+    file_path = file_path or TARGETS_FILE
+    if not file_path:
+        return [default_target()]
+
+    try:
+        with open(file_path, 'r') as f:
+            targets = target_list_adapter.validate_python(json.load(f))
+    except (OSError, ValueError) as e:
+        # ValidationError is a ValueError, so a malformed target lands here too
+        raise ValueError(f"Could not load targets from {file_path}: {e}") from e
+
+    names = [target.name for target in targets]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate target names in {file_path}: {', '.join(duplicates)}")
+    if not targets:
+        raise ValueError(f"No targets defined in {file_path}.")
+
+    logging.info(f"Loaded {len(targets)} targets from {file_path}: {', '.join(names)}")
+    return targets
@@ -1,7 +1,10 @@
 import os
+import time
+import queue
 import logging
-import requests
+import threading
 from dotenv import load_dotenv
+from metrics import metrics
 
 load_dotenv()  # Load environment variables
 
@@ -11,37 +14,223 @@ TELEGRAM_BOT_USER_NAME = os.getenv("TELEGRAM_BOT_USER_NAME")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 TELEGRAM_GROUP_CHAT_ID = os.getenv("TELEGRAM_GROUP_CHAT_ID")
 
+# Bot API base URL, overridable so notifications can be pointed at a local fake endpoint
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_REQUEST_TIMEOUT = float(os.getenv("TELEGRAM_REQUEST_TIMEOUT", "10"))
+# Minimum seconds between two messages to the same chat (Telegram allows about 20 per minute in groups)
+TELEGRAM_CHAT_MIN_INTERVAL = float(os.getenv("TELEGRAM_CHAT_MIN_INTERVAL", "3"))
+# Messages queued for one chat within the coalesce window are merged into a digest above the threshold
+TELEGRAM_COALESCE_WINDOW = float(os.getenv("TELEGRAM_COALESCE_WINDOW", "2"))
+TELEGRAM_DIGEST_THRESHOLD = int(os.getenv("TELEGRAM_DIGEST_THRESHOLD", "5"))
+TELEGRAM_MAX_RETRIES = 3
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+# Keep-alive connection pool shared by every Telegram request, created with the first message
+telegram_session = None
+telegram_session_lock = threading.Lock()
+
 # tmp_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getUpdates"
 # tmp = requests.get(tmp_url).json()
 
 
-def send_telegram_message(message, chat_id):
-    """Sends a message to the Telegram chat using the bot."""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID or not TELEGRAM_GROUP_CHAT_ID:
+def get_telegram_session():
+    """Returns the shared Telegram session, importing requests and creating it on first use."""
+    global telegram_session
+    with telegram_session_lock:
+        if telegram_session is None:
+            import requests
+            telegram_session = requests.Session()
+    return telegram_session
+
+
+def telegram_configured():
+    """Returns True if the bot token and chat IDs needed to send messages are set."""
+    return bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID and TELEGRAM_GROUP_CHAT_ID)
+
+
+def post_telegram_message(message, chat_id):
+    """
+    Posts a message to the Telegram chat using the bot.
+
+    Returns a (sent, retry_after) tuple, where retry_after is the number of seconds Telegram asked us to wait
+    before retrying after a flood limit, or None. sent is None if the bot isn't configured and nothing was sent.
+    """
+    if not telegram_configured():
         logging.error("Telegram bot token or chat ID is missing. Skipping notification.")
-        return
+        return None, None
 
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     payload = {
         "chat_id": chat_id,
         "text": message,
         "parse_mode": "Markdown"
     }
 
+    import requests
+
     try:
-        response = requests.post(url, json=payload)
+        response = get_telegram_session().post(url, json=payload, timeout=TELEGRAM_REQUEST_TIMEOUT)
         response_json = response.json()
 
         if response.status_code != 200 or not response_json.get("ok", False):
             error_description = response_json.get("description", "Unknown error")
             error_code = response_json.get("error_code", "No error code")
 
-            if error_code == 400 and "not enough rights" in error_description.lower():
+            if error_code == 429:
+                retry_after = response_json.get("parameters", {}).get("retry_after", 1)
+                logging.warning(f"Telegram flood limit hit. Retrying after {retry_after} seconds.")
+                return False, retry_after
+            elif error_code == 400 and "not enough rights" in error_description.lower():
                 logging.error(
                     "ERROR - Bot lacks permissions to send messages to the chat. Please check bot permissions.")
             else:
                 logging.error(f"Failed to send Telegram message: {response_json}")
+            return False, None
+
+        return True, None
     except requests.RequestException as e:
         logging.error(f"Network error while sending Telegram message: {e}")
     except Exception as e:
         logging.error(f"Unexpected error sending Telegram message: {e}")
+    return False, None
+
+
+def send_telegram_message(message, chat_id):
+    """Sends a message to the Telegram chat using the bot."""
+    return bool(post_telegram_message(message, chat_id)[0])
+
+
+class NotificationQueue:
+    """
+    Outbound Telegram queue drained by a background worker.
+
+    Messages are sent over the shared keep-alive session, spaced per chat by TELEGRAM_CHAT_MIN_INTERVAL, and
+    retried after the retry_after Telegram returns on flood limits. When TELEGRAM_DIGEST_THRESHOLD or more
+    messages of one kind (the same title) for one chat arrive within TELEGRAM_COALESCE_WINDOW, their summaries are
+    sent as a single digest under that title. When configured() is False nothing can be sent, so flush doesn't
+    wait for the queue.
+    """
+
+    def __init__(self, send=post_telegram_message, chat_min_interval=TELEGRAM_CHAT_MIN_INTERVAL,
+                 coalesce_window=TELEGRAM_COALESCE_WINDOW, digest_threshold=TELEGRAM_DIGEST_THRESHOLD,
+                 configured=telegram_configured):
+        self.send = send
+        self.configured = configured
+        self.chat_min_interval = chat_min_interval
+        self.coalesce_window = coalesce_window
+        self.digest_threshold = digest_threshold
+        self.queue = queue.Queue()
+        self.last_sent = {}
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Starts the background worker if it isn't running."""
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, name="telegram-notifications", daemon=True)
+                self.worker.start()
+
+    def enqueue(self, message, chat_id, summary=None, title=None):
+        """
+        Queues a message for chat_id.
+
+        summary is the one-line form used when the message is merged into a digest, under the digest title.
+        """
+        self.start()
+        self.queue.put({"message": message, "chat_id": chat_id, "summary": summary or message, "title": title})
+
+    def flush(self, timeout=None):
+        """Waits until every queued message has been handled. Returns False if the timeout expired first."""
+        if not self.configured():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def collect_batch(self):
+        """Blocks for the next message, then gathers everything else that arrives within the coalesce window."""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.coalesce_window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def build_messages(self, batch):
+        """
+        Groups a batch by chat and title and turns it into (chat_id, text) pairs, merging bursts into digests.
+        Each kind of message gets its own digest, so removed products aren't listed under the new products title.
+        """
+        by_kind = {}
+        for item in batch:
+            by_kind.setdefault((item["chat_id"], item["title"]), []).append(item)
+
+        messages = []
+        for (chat_id, title), items in by_kind.items():
+            if len(items) < self.digest_threshold:
+                messages.extend((chat_id, item["message"]) for item in items)
+                continue
+
+            title = title or f"🔔 *{len(items)} Updates*"
+            digest = title
+            for item in items:
+                line = f"\n{item['summary']}"
+                # Start a new digest message rather than exceed Telegram's message length limit
+                if len(digest) + len(line) > TELEGRAM_MAX_MESSAGE_LENGTH:
+                    messages.append((chat_id, digest))
+                    digest = title + " (continued)"
+                digest += line
+            messages.append((chat_id, digest))
+        return messages
+
+    def deliver(self, chat_id, text):
+        """Sends one message, honouring the per-chat interval and Telegram's retry_after."""
+        for attempt in range(TELEGRAM_MAX_RETRIES):
+            wait = self.last_sent.get(chat_id, 0) + self.chat_min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            with metrics.timer("notification_send"):
+                sent, retry_after = self.send(text, chat_id)
+            if sent is None:
+                # Nothing went over the network, so there is no interval to keep or flood limit to wait out
+                metrics.inc("notifications_total", result="skipped")
+                return False
+            metrics.inc("notifications_total", result="sent" if sent else "failed")
+            self.last_sent[chat_id] = time.monotonic()
+            if sent:
+                return True
+            if retry_after is None:
+                return False
+            time.sleep(retry_after)
+
+        logging.error(f"Giving up on Telegram message to chat {chat_id} after {TELEGRAM_MAX_RETRIES} attempts.")
+        return False
+
+    def run(self):
+        """Worker loop: drains the queue forever."""
+        while True:
+            batch = self.collect_batch()
+            try:
+                for chat_id, text in self.build_messages(batch):
+                    self.deliver(chat_id, text)
+            except Exception as e:
+                logging.error(f"Unexpected error in the Telegram notification worker: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+
+# Process-wide notification queue
+notification_queue = NotificationQueue()
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from telegram_utils import NotificationQueue
+
+
+class HeldQueue(NotificationQueue):
+    """A queue whose worker never starts, so a test can build the messages of what was queued."""
+
+    def start(self):
+        pass
+
+    def queued(self):
+        return [self.queue.get_nowait() for _ in range(self.queue.qsize())]
+
+
+def product(i):
+    return SimpleNamespace(id=f"{i:06d}", displayName=f"Bottle {i}", brand="Brand", inStockQuantity=5,
+                           orderableQuantity=5, listPrice=50.0, url=f"https://example.com/product/{i:06d}")
+
+
+def held_queue(monkeypatch, digest_threshold=3):
+    notifications = HeldQueue(send=lambda text, chat_id: (True, None), digest_threshold=digest_threshold)
+    monkeypatch.setattr(db, "notification_queue", notifications)
+    return notifications
+
+
+def test_new_and_removed_products_get_separate_digests(monkeypatch):
+    notifications = held_queue(monkeypatch)
+    for i in range(4):
+        db.notify_new_product(product(i), "chat")
+        db.notify_removed_product(product(100 + i), "chat")
+
+    messages = notifications.build_messages(notifications.queued())
+
+    assert len(messages) == 2
+    new_digest = next(text for _, text in messages if text.startswith("🆕 *New Products Added!*"))
+    removed_digest = next(text for _, text in messages if text.startswith("❌ *Products Removed!*"))
+    assert all(f"Bottle {i}]" in new_digest and f"Bottle {100 + i}]" not in new_digest for i in range(4))
+    assert all(f"Bottle {100 + i}]" in removed_digest and f"Bottle {i}]" not in removed_digest for i in range(4))
+
+
+def test_kind_below_threshold_is_sent_as_single_messages(monkeypatch):
+    notifications = held_queue(monkeypatch)
+    for i in range(3):
+        db.notify_new_product(product(i), "chat")
+    db.notify_removed_product(product(100), "chat")
+
+    messages = notifications.build_messages(notifications.queued())
+
+    assert [text.split("\n")[0] for _, text in messages] == ["🆕 *New Products Added!*", "❌ *Product Removed!*"]
+
+
+def test_restocks_are_not_announced_as_new_products(monkeypatch):
+    notifications = held_queue(monkeypatch)
+    for i in range(3):
+        db.notify_new_product(product(i), "chat")
+        db.notify_restocked_product(product(200 + i), "chat")
+
+    messages = notifications.build_messages(notifications.queued())
+
+    assert sorted(text.split("\n")[0] for _, text in messages) == ["🆕 *New Products Added!*", "🔄 *Back in Stock!*"]
+    restock_digest = next(text for _, text in messages if text.startswith("🔄 *Back in Stock!*"))
+    assert all(f"Bottle {200 + i}]" in restock_digest and f"Bottle {i}]" not in restock_digest for i in range(3))
+
+
+def test_unconfigured_bot_is_not_rate_limited():
+    attempts = []
+    notifications = NotificationQueue(send=lambda text, chat_id: attempts.append(text) or (None, None),
+                                      chat_min_interval=5)
+    start = time.monotonic()
+    for i in range(3):
+        assert notifications.deliver("chat", f"message {i}") is False
+    assert time.monotonic() - start < 1
+    assert len(attempts) == 3
+
+
+def test_flush_returns_at_once_without_credentials():
+    notifications = HeldQueue(configured=lambda: False)
+    notifications.enqueue("message", "chat")
+    assert notifications.flush(timeout=5) is True
@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import pytest
+import db
+import db_layer
+from models import validate_products
+from fixtures import generate_product_page
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    # Without the snapshot cache every poll reads the stored state, as a fresh one-shot run does
+    monkeypatch.setattr(db.snapshot_cache, "directory", "")
+    monkeypatch.setattr(db, "notify_new_product", lambda product, chat_id=None: None)
+    connection = db_layer.open_connection(str(tmp_path / "products.db"))
+    db_layer.apply_migrations(connection)
+    yield connection
+    connection.close()
+
+
+def poll(conn, items):
+    return db.store_products_to_db(validate_products([dict(item) for item in items]), conn)
+
+
+def live_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM products WHERE removed_at IS NULL").fetchone()[0]
+
+
+def test_replaced_catalog_is_removed(conn):
+    items = generate_product_page(5)["items"]
+    poll(conn, items[:3])
+    assert poll(conn, items[3:])["removed"] == 3
+    assert live_count(conn) == 2
+
+
+def test_suspected_partial_listing_is_confirmed_across_runs(conn):
+    items = generate_product_page(10)["items"]
+    poll(conn, items)
+    for _ in range(db.REMOVAL_CONFIRM_POLLS - 1):
+        assert poll(conn, items[:2])["removed"] == 0
+    assert live_count(conn) == 10
+    assert poll(conn, items[:2])["removed"] == 8
+    assert live_count(conn) == 2
+    assert conn.execute("SELECT COUNT(*) FROM removal_candidates").fetchone()[0] == 0
+
+
+def test_complete_listing_resets_the_miss_counts(conn):
+    items = generate_product_page(10)["items"]
+    poll(conn, items)
+    poll(conn, items[:2])
+    poll(conn, items)
+    for _ in range(db.REMOVAL_CONFIRM_POLLS - 1):
+        assert poll(conn, items[:2])["removed"] == 0
+    assert live_count(conn) == 10